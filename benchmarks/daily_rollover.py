@@ -0,0 +1,109 @@
+"""
+Время снятия итогов дня (daily_rollover_query) на большом наборе данных.
+
+Создает схему bench_rollover в базе из config.settings, заполняет daily_group_records
+~--rows строками за вчера и замеряет:
+  - снятие итогов одним INSERT ... SELECT в одной транзакции;
+  - повторный запуск (должен вставить 0 строк);
+  - снятие, прерванное откатом транзакции, и повтор после него;
+  - для сравнения старую схему: DELETE и COMMIT на каждую группу.
+Схема удаляется после прогона.
+
+    python -m benchmarks.daily_rollover --rows 100000 --groups 1000 --types 4
+"""
+import argparse
+import asyncio
+import sys
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import func, select, text
+
+from bot.database.models import Base, DailyGroupRecords, DailyReports
+from bot.database.partitions import ensure_daily_partitions
+from bot.database.session import engine
+from bot.database.storage import daily_rollover_query
+
+SCHEMA = 'bench_rollover'
+
+SEED = [
+    # Пользователь i состоит в группе i % groups, в каждой группе types типов, у каждого есть подходы за вчера
+    "INSERT INTO users (user_id, username) SELECT i, 'user' || i FROM generate_series(1, :users) i",
+    "INSERT INTO groups (group_id, group_name) SELECT '-' || g, 'group' || g FROM generate_series(1, :groups) g",
+    "INSERT INTO record_types (group_id, record_type, required) "
+    "SELECT '-' || g, 'type' || t, 50 FROM generate_series(1, :groups) g, generate_series(1, :types) t",
+    "INSERT INTO user_groups (user_id, group_id) "
+    "SELECT u.id, g.id FROM users u JOIN groups g ON g.group_id = '-' || (u.user_id % :groups + 1)",
+    "INSERT INTO daily_group_records (user_id, group_id, type_record_id, count, date) "
+    "SELECT u.user_id, rt.group_id, rt.id, (u.user_id * rt.id) % 60, :day "
+    "FROM users u JOIN record_types rt ON rt.group_id = '-' || (u.user_id % :groups + 1)",
+    "ANALYZE",
+]
+
+
+async def timed(conn, statement, params=None):
+    started = time.perf_counter()
+    result = await conn.execute(statement, params or {})
+    return result, time.perf_counter() - started
+
+
+async def count_reports(conn, day: date) -> int:
+    return (await conn.execute(select(func.count()).select_from(DailyReports).where(DailyReports.date == day))).scalar()
+
+
+async def run(rows: int, groups: int, types: int) -> bool:
+    day = date.today() - timedelta(days=1)
+    users = max(1, rows // types)
+    ok = True
+    async with engine.connect() as conn:
+        await conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+        await conn.execute(text(f'CREATE SCHEMA {SCHEMA}'))
+        await conn.execute(text(f'SET search_path TO {SCHEMA}'))
+        try:
+            await conn.run_sync(Base.metadata.create_all)
+            await ensure_daily_partitions(conn, since=day)
+            for statement in SEED:
+                await conn.execute(text(statement), {'users': users, 'groups': groups, 'types': types, 'day': day})
+            await conn.commit()
+            daily_rows = (await conn.execute(select(func.count()).select_from(DailyGroupRecords))).scalar()
+            print(f'daily_group_records: {daily_rows} строк, групп {groups}, типов {types}')
+
+            # Сбой посреди снятия: транзакция откатывается целиком, ни одна группа не снята частично
+            await timed(conn, daily_rollover_query(day))
+            await conn.rollback()
+            after_crash = await count_reports(conn, day)
+            ok &= after_crash == 0
+            print(f"{'ok  ' if after_crash == 0 else 'FAIL'} после отката строк в daily_reports: {after_crash}")
+
+            result, elapsed = await timed(conn, daily_rollover_query(day))
+            await conn.commit()
+            print(f'ok   снятие итогов: {result.rowcount} строк за {elapsed * 1000:.0f} мс')
+
+            result, elapsed = await timed(conn, daily_rollover_query(day))
+            await conn.commit()
+            ok &= result.rowcount == 0
+            print(f"{'ok  ' if result.rowcount == 0 else 'FAIL'} повторный запуск: {result.rowcount} строк "
+                  f"за {elapsed * 1000:.0f} мс")
+
+            # Старая схема: отдельный DELETE и COMMIT на каждую группу
+            started = time.perf_counter()
+            for group in range(1, groups + 1):
+                await conn.execute(text('DELETE FROM daily_group_records WHERE group_id = :group_id'),
+                                   {'group_id': f'-{group}'})
+                await conn.commit()
+            print(f'     DELETE по группам ({groups} транзакций): {(time.perf_counter() - started) * 1000:.0f} мс')
+        finally:
+            await conn.rollback()
+            await conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+            await conn.commit()
+    await engine.dispose()
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000, help='строк в daily_group_records')
+    parser.add_argument('--groups', type=int, default=1000)
+    parser.add_argument('--types', type=int, default=4)
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args.rows, args.groups, args.types)) else 1)
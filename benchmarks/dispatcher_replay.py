@@ -0,0 +1,215 @@
+"""
+Сквозной прогон апдейтов через Dispatcher бота с проверкой на регрессии.
+
+Для каждого размера группы (--sizes) заполняет базу из config.settings новой группой
+и прогоняет через настоящий диспетчер (create_dispatcher: роутеры commands и pushups,
+TopicMiddlewares, сессия БД) сценарии:
+  - flow         - кружок -> тип -> количество;
+  - stats        - /stats;
+  - group_stats  - /group_stats;
+  - lazy         - /lazy -> выбор типа -> список не сделавших норму по этому типу.
+Bot без сети, лимиты очереди исходящих сняты - замеряется обработка апдейта, а не
+отправка. Время операции - от подачи первого апдейта сценария до завершения
+последнего; --concurrency параллельных участников, у каждого свои пользователи группы.
+С --updates дополнительно воспроизводятся записанные апдейты (JSON на строку).
+
+Печатает апдейтов в секунду и p50/p95/p99 на операцию - лучшее из --repeats прогонов
+сценария: посторонняя нагрузка на машине только замедляет, так что лучший прогон ближе
+всего к цене самого кода и один неудачный прогон не выглядит регрессией. Результаты сравниваются с
+--baseline: p95 выше базового больше чем на --tolerance или скорость ниже на столько
+же - регрессия, код выхода 1. --save-baseline записывает текущий прогон как базовый.
+Базовый файл имеет смысл только для той машины и базы, на которой он снят. На общей
+виртуальной машине весь прогон то и дело оказывается в полтора раза медленнее соседнего,
+поэтому --tolerance по умолчанию 0.5; на выделенной машине его стоит уменьшить.
+
+Нужен Postgres: хранилище использует upsert'ы, партиции и часовые пояса Postgres.
+
+    python -m benchmarks.dispatcher_replay --sizes 10 100 1000 --ops 200 --save-baseline
+    python -m benchmarks.dispatcher_replay --sizes 10 100 1000 --ops 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List
+
+from aiogram.types import Update
+
+from benchmarks.fakes import BOT_ID, create_fake_bot, message_update, callback_update
+from benchmarks.session_usage import seed
+from benchmarks.webhook_latency import percentile, recorded_updates
+from bot.database.session import async_session, engine
+from bot.database.storage import init_database, load_topic_routes
+from bot.utils.outbound import outbound
+from bot.utils.rate_limit import TokenBucket
+from main import create_dispatcher
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'dispatcher_baseline.json')
+UNLIMITED = 1_000_000
+
+
+def flow(bot, chat_id: int, user_id: int) -> List[Update]:
+    return [
+        message_update(bot, chat_id, user_id, video_note=True),
+        callback_update(bot, chat_id, user_id, data='type_type0', message_id=1, message_from=BOT_ID),
+        callback_update(bot, chat_id, user_id, data='count_10', message_id=1, message_from=BOT_ID),
+    ]
+
+
+def stats(bot, chat_id: int, user_id: int) -> List[Update]:
+    return [message_update(bot, chat_id, user_id, text='/stats')]
+
+
+def group_stats(bot, chat_id: int, user_id: int) -> List[Update]:
+    return [message_update(bot, chat_id, user_id, text='/group_stats')]
+
+
+def lazy(bot, chat_id: int, user_id: int) -> List[Update]:
+    return [
+        message_update(bot, chat_id, user_id, text='/lazy'),
+        callback_update(bot, chat_id, user_id, data='type_type0', message_id=1, message_from=BOT_ID),
+    ]
+
+
+SCENARIOS: Dict[str, Callable] = {
+    'flow': flow,
+    'stats': stats,
+    'group_stats': group_stats,
+    'lazy': lazy,
+}
+
+
+def summarize(latencies: List[float], updates: int, wall: float) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        'ops': len(latencies),
+        'updates_per_s': round(updates / wall, 1) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 0.5), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+    }
+
+
+async def feed_op(dp, bot, updates: List[Update]) -> float:
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) * 1000
+
+
+async def run_scenario(dp, bot, chat_id: int, members: int, make_op: Callable, ops: int, concurrency: int,
+                       warmup: int) -> Dict[str, float]:
+    for index in range(warmup):
+        await feed_op(dp, bot, make_op(bot, chat_id, index % members + 1))
+
+    lanes = min(concurrency, members)
+    latencies: List[float] = []
+    updates = 0
+
+    async def lane(index: int):
+        nonlocal updates
+        # Свои пользователи у каждого участника: состояния FSM параллельных сценариев не пересекаются
+        users = range(index + 1, members + 1, lanes)
+        for number in range(index, ops, lanes):
+            op = make_op(bot, chat_id, users[number // lanes % len(users)])
+            updates += len(op)
+            latencies.append(await feed_op(dp, bot, op))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(lane(index) for index in range(lanes)))
+    return summarize(latencies, updates, time.perf_counter() - started)
+
+
+async def run_repeated(repeats: int, *args) -> Dict[str, float]:
+    runs = [await run_scenario(*args) for _ in range(repeats)]
+    return {field: (max if field == 'updates_per_s' else min)(run[field] for run in runs) for field in runs[0]}
+
+
+async def run_recorded(dp, bot, path: str) -> Dict[str, float]:
+    latencies = []
+    payloads = recorded_updates(path)
+    started = time.perf_counter()
+    for payload in payloads:
+        update = Update.model_validate(payload, context={'bot': bot})
+        latencies.append(await feed_op(dp, bot, [update]))
+    return summarize(latencies, len(payloads), time.perf_counter() - started)
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    regressions = []
+    for key, current in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{key}: p95 {current['p95_ms']:.1f} мс, базовый {base['p95_ms']:.1f} мс")
+        if current['updates_per_s'] < base['updates_per_s'] * (1 - tolerance):
+            regressions.append(f"{key}: {current['updates_per_s']:.0f} апдейтов/с, "
+                               f"базовый {base['updates_per_s']:.0f}")
+    return regressions
+
+
+async def run(args) -> bool:
+    await init_database()
+    bot = create_fake_bot(latency=args.latency)
+    # Ответы не ждут отправки, но без снятых лимитов очередь копится и мешает close()
+    outbound.global_bucket = TokenBucket(rate=UNLIMITED, capacity=UNLIMITED)
+    outbound.chat_rate = UNLIMITED
+
+    # Новые группы на каждый запуск, чтобы повторные прогоны не пересекались
+    base = -int(time.time()) * 1000
+    chats = {}
+    for index, members in enumerate(args.sizes):
+        chats[members] = base - index
+        await seed(chats[members], members, args.types)
+    async with async_session() as session:
+        await load_topic_routes(session)
+
+    dp = create_dispatcher()
+    results: Dict[str, dict] = {}
+    for members, chat_id in chats.items():
+        for name in args.scenarios:
+            key = f'{name}@{members}'
+            results[key] = await run_repeated(args.repeats, dp, bot, chat_id, members, SCENARIOS[name],
+                                              args.ops, args.concurrency, args.warmup)
+            print(f"{key:<18} " + ' '.join(f'{field}={value}' for field, value in results[key].items()))
+    if args.updates:
+        results['recorded'] = await run_recorded(dp, bot, args.updates)
+        print(f"{'recorded':<18} " + ' '.join(f'{field}={value}' for field, value in results['recorded'].items()))
+
+    await outbound.close()
+    await bot.session.close()
+    await engine.dispose()
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+        print(f'Базовые результаты записаны в {args.baseline}')
+        return True
+    if not os.path.exists(args.baseline):
+        print(f'Базовых результатов нет ({args.baseline}), сравнение пропущено')
+        return True
+    with open(args.baseline) as file:
+        regressions = compare(results, json.load(file), args.tolerance)
+    for regression in regressions:
+        print(f'РЕГРЕССИЯ {regression}')
+    return not regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='участников в группе')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--types', type=int, default=2)
+    parser.add_argument('--ops', type=int, default=100, help='операций на сценарий и размер группы')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--repeats', type=int, default=3, help='прогонов сценария, в результат идет лучший')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответов Bot API, с')
+    parser.add_argument('--updates', help='файл с записанными апдейтами (JSON на строку)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='допустимое ухудшение, доля')
+    sys.exit(0 if asyncio.run(run(parser.parse_args())) else 1)
@@ -0,0 +1,114 @@
+"""Фейки Telegram для бенчмарков: сессия Bot без сети и конструкторы апдейтов."""
+import asyncio
+import itertools
+import random
+from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.types import Chat, Message, Update
+
+BOT_ID = 42
+
+
+class FakeTelegramSession(BaseSession):
+    """
+    Сессия Bot, которая не ходит в сеть и отвечает правдоподобными объектами.
+
+    flood_rate - доля запросов, на которые вместо ответа приходит 429 с retry_after секунд.
+    """
+
+    def __init__(self, latency: float = 0.0, flood_rate: float = 0.0, retry_after: int = 1,
+                 seed: Optional[int] = None, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.requests: List[TelegramMethod] = []
+        self.flood_waits = 0
+        self._message_ids = itertools.count(100_000)
+        self._random = random.Random(seed)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        self.requests.append(method)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_rate and self._random.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise TelegramRetryAfter(method=method, message=f'Too Many Requests: retry after {self.retry_after}',
+                                     retry_after=self.retry_after)
+
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return True
+
+        return Message(
+            message_id=getattr(method, 'message_id', None) or next(self._message_ids),
+            date=datetime.now(),
+            chat=Chat(id=int(chat_id), type='supergroup'),
+            text=getattr(method, 'text', None),
+        )
+
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        yield b''
+
+    async def close(self) -> None:
+        pass
+
+
+def create_fake_bot(latency: float = 0.0, flood_rate: float = 0.0, retry_after: int = 1, seed: Optional[int] = None) -> Bot:
+    session = FakeTelegramSession(latency=latency, flood_rate=flood_rate, retry_after=retry_after, seed=seed)
+    return Bot(token=f'{BOT_ID}:FAKE', session=session)
+
+
+_update_ids = itertools.count(1)
+
+
+def _chat(chat_id: int) -> Dict[str, Any]:
+    return {'id': chat_id, 'type': 'supergroup', 'title': f'bench {chat_id}'}
+
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {'id': user_id, 'is_bot': user_id == BOT_ID, 'first_name': f'user{user_id}', 'username': f'user{user_id}'}
+
+
+def message_update(bot: Bot, chat_id: int, user_id: int, text: str = None, video_note: bool = False,
+                   message_id: int = None) -> Update:
+    """Апдейт с сообщением (команда, текст или кружок)"""
+    message = {
+        'message_id': message_id or next(_update_ids),
+        'date': int(datetime.now().timestamp()),
+        'chat': _chat(chat_id),
+        'from': _user(user_id),
+    }
+    if text is not None:
+        message['text'] = text
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    if video_note:
+        message['video_note'] = {'file_id': 'vn', 'file_unique_id': 'vn', 'length': 240, 'duration': 5}
+
+    return Update.model_validate({'update_id': next(_update_ids), 'message': message}, context={'bot': bot})
+
+
+def callback_update(bot: Bot, chat_id: int, user_id: int, data: str, message_id: int,
+                    message_from: int = BOT_ID) -> Update:
+    """Апдейт с нажатием inline-кнопки под сообщением бота"""
+    callback = {
+        'id': str(next(_update_ids)),
+        'chat_instance': str(chat_id),
+        'from': _user(user_id),
+        'data': data,
+        'message': {
+            'message_id': message_id,
+            'date': int(datetime.now().timestamp()),
+            'chat': _chat(chat_id),
+            'from': _user(message_from),
+            'text': '💪',
+        },
+    }
+    return Update.model_validate({'update_id': next(_update_ids), 'callback_query': callback}, context={'bot': bot})
@@ -0,0 +1,126 @@
+"""
+Проверка планов горячих запросов на большом наборе данных.
+
+Создает схему bench_plans в базе из config.settings, заполняет ее ~1M строк
+в daily_group_records и users_records, выполняет EXPLAIN для запросов из
+storage.py и падает, если по большой таблице идет Seq Scan. Схема удаляется
+после прогона. На маленьком наборе то же самое проверяет tests/test_query_plans.py
+с выключенным Seq Scan: здесь смотрим, что планировщик сам выбирает индексы на
+реальных объемах.
+
+    python -m benchmarks.query_plans --users 250000 --groups 1000 --types 4
+"""
+import argparse
+import asyncio
+import json
+import sys
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import List, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from bot.database.models import Base, DailyGroupRecords, RecordTypes, UsersRecords, User, user_group_association
+from bot.database.partitions import ensure_daily_partitions
+from bot.database.session import engine
+from bot.database.storage import group_stats_query
+
+SCHEMA = 'bench_plans'
+LARGE_TABLES = {'users', 'user_groups', 'record_types', 'daily_group_records', 'users_records'}
+
+SEED = [
+    # Пользователь i состоит в группе i % groups, в каждой группе types типов
+    "INSERT INTO users (user_id, username) SELECT i, 'user' || i FROM generate_series(1, :users) i",
+    "INSERT INTO groups (group_id, group_name) SELECT '-' || g, 'group' || g FROM generate_series(1, :groups) g",
+    "INSERT INTO record_types (group_id, record_type, required) "
+    "SELECT '-' || g, 'type' || t, 50 FROM generate_series(1, :groups) g, generate_series(1, :types) t",
+    "INSERT INTO user_groups (user_id, group_id) "
+    "SELECT u.id, g.id FROM users u JOIN groups g ON g.group_id = '-' || (u.user_id % :groups + 1)",
+    "INSERT INTO daily_group_records (user_id, group_id, type_record_id, count, date) "
+    "SELECT u.user_id, rt.group_id, rt.id, (u.user_id * rt.id) % 60, current_date "
+    "FROM users u JOIN record_types rt ON rt.group_id = '-' || (u.user_id % :groups + 1)",
+    "INSERT INTO users_records (user_id, type_record_id, summary_count) "
+    "SELECT user_id, type_record_id, count * 30 FROM daily_group_records",
+    "ANALYZE",
+]
+
+
+def hot_queries(group_id: str, user_id: int):
+    return {
+        'daily по (user, group, type)': select(DailyGroupRecords.count).where(
+            DailyGroupRecords.user_id == user_id,
+            DailyGroupRecords.group_id == group_id,
+            DailyGroupRecords.type_record_id == 1,
+            DailyGroupRecords.date == date.today()),
+        'users_records по (user, type)': select(UsersRecords.summary_count).where(
+            UsersRecords.user_id == user_id,
+            UsersRecords.type_record_id == 1),
+        'типы группы': select(RecordTypes.id, RecordTypes.record_type, RecordTypes.required).where(
+            RecordTypes.group_id == group_id),
+        'участники группы': select(User.user_id).join(
+            user_group_association, User.id == user_group_association.c.user_id).where(
+            user_group_association.c.group_id == 1),
+        'статистика группы': group_stats_query(group_id),
+    }
+
+
+def seq_scans(plan: dict):
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') in LARGE_TABLES:
+        yield plan['Relation Name']
+    for child in plan.get('Plans', []):
+        yield from seq_scans(child)
+
+
+@asynccontextmanager
+async def bench_schema(conn: AsyncConnection, users: int, groups: int, types: int):
+    """Временная схема SCHEMA с данными SEED, удаляется на выходе"""
+    await conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+    await conn.execute(text(f'CREATE SCHEMA {SCHEMA}'))
+    await conn.execute(text(f'SET search_path TO {SCHEMA}'))
+    try:
+        await conn.run_sync(Base.metadata.create_all)
+        await ensure_daily_partitions(conn)
+        params = {'users': users, 'groups': groups, 'types': types}
+        for statement in SEED:
+            await conn.execute(text(statement), params)
+        await conn.commit()
+        yield
+    finally:
+        await conn.rollback()
+        await conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+        await conn.commit()
+
+
+async def explain_hot_queries(conn: AsyncConnection, groups: int) -> List[Tuple[str, float, List[str]]]:
+    """(запрос, стоимость, большие таблицы с Seq Scan) для каждого запроса из hot_queries"""
+    plans = []
+    for name, query in hot_queries(group_id='-1', user_id=groups).items():
+        compiled = query.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+        result = await conn.execute(text(f'EXPLAIN (FORMAT JSON) {compiled}'))
+        plan = result.scalar_one()
+        plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]['Plan']
+        plans.append((name, plan['Total Cost'], sorted(set(seq_scans(plan)))))
+    return plans
+
+
+async def run(users: int, groups: int, types: int) -> bool:
+    ok = True
+    async with engine.connect() as conn:
+        async with bench_schema(conn, users, groups, types):
+            for name, cost, scans in await explain_hot_queries(conn, groups):
+                ok &= not scans
+                print(f"{'FAIL' if scans else 'ok  '} {name:<32} cost={cost:<10} "
+                      f"{'Seq Scan: ' + ', '.join(scans) if scans else ''}")
+    await engine.dispose()
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=250_000)
+    parser.add_argument('--groups', type=int, default=1000)
+    parser.add_argument('--types', type=int, default=4)
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args.users, args.groups, args.types)) else 1)
@@ -0,0 +1,165 @@
+"""
+Нагрузочный прогон напоминаний и отчета в полночь.
+
+Создает схему bench_reminders в базе из config.settings и заполняет ее: --groups групп
+в одном слоте расписания (часовой пояс и время напоминания по умолчанию), в каждой
+--members участников и --types типов тренировок, за сегодня и вчера у случайной доли
+--active пар участник-тип есть подходы случайного объема. Затем вызывает настоящие
+send_reminders и send_daily_report из bot.utils.reminders с Bot без сети: ответ через
+--latency секунд, на долю --flood-rate запросов - 429 с retry_after --retry-after.
+Лимиты очереди исходящих берутся из настроек (TELEGRAM_GLOBAL_RATE, OUTBOUND_CONCURRENCY)
+или из --global-rate/--concurrency.
+
+Для каждой задачи печатает время выполнения, число SQL-запросов, отправленные запросы
+к Bot API и 429, пиковую память Python (tracemalloc, замедляет прогон; --no-tracemalloc
+отключает). Код выхода 1, если напоминания не укладываются в --deadline секунд
+(по умолчанию час - до следующего напоминания). Схема удаляется после прогона.
+
+    python -m benchmarks.reminders_load --groups 10000 --members 10 --types 3
+    python -m benchmarks.reminders_load --groups 10000 --latency 0.1 --flood-rate 0.01 --retry-after 5
+"""
+import argparse
+import asyncio
+import sys
+import time
+import tracemalloc
+from datetime import timedelta
+
+from sqlalchemy import event, text
+
+from benchmarks.fakes import create_fake_bot
+from bot.database.models import Base, DEFAULT_REMINDER_TIME, DEFAULT_TIMEZONE
+from bot.database.partitions import ensure_daily_partitions
+from bot.database.session import engine
+from bot.database.storage import local_today
+from bot.utils.outbound import outbound
+from bot.utils.rate_limit import TokenBucket
+from bot.utils.reminders import send_daily_report, send_reminders
+from config.settings import settings
+
+SCHEMA = 'bench_reminders'
+
+SEED = [
+    # Участник j группы g - пользователь (g - 1) * members + j, у каждого свои группа и подходы
+    "INSERT INTO users (user_id, username) SELECT i, 'user' || i FROM generate_series(1, :groups * :members) i",
+    "INSERT INTO groups (group_id, group_name, timezone, reminder_time) "
+    "SELECT '-' || g, 'group' || g, :timezone, :reminder_time FROM generate_series(1, :groups) g",
+    "INSERT INTO record_types (group_id, record_type, required) "
+    "SELECT '-' || g, 'type' || t, :required FROM generate_series(1, :groups) g, generate_series(1, :types) t",
+    "INSERT INTO user_groups (user_id, group_id) "
+    "SELECT u.id, g.id FROM users u JOIN groups g ON g.group_id = '-' || ((u.user_id - 1) / :members + 1)",
+]
+
+PROGRESS = (
+    # Часть норм выполнена, часть нет, часть пар без подходов вовсе
+    "INSERT INTO daily_group_records (user_id, group_id, type_record_id, count, date) "
+    "SELECT u.user_id, rt.group_id, rt.id, floor(random() * rt.required * 1.5)::int, :day "
+    "FROM users u JOIN record_types rt ON rt.group_id = '-' || ((u.user_id - 1) / :members + 1) "
+    "WHERE random() < :active"
+)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = 0
+
+    def __call__(self, *args):
+        self.statements += 1
+
+
+queries = QueryCounter()
+
+
+def _use_bench_schema(dbapi_connection, connection_record):
+    # Задачи напоминаний берут соединения из общего пула - схема нужна каждому из них
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'SET search_path TO {SCHEMA}')
+    cursor.close()
+
+
+async def seed(args):
+    today = local_today(DEFAULT_TIMEZONE)
+    params = {'groups': args.groups, 'members': args.members, 'types': args.types, 'required': args.required,
+              'timezone': DEFAULT_TIMEZONE, 'reminder_time': DEFAULT_REMINDER_TIME, 'active': args.active}
+    async with engine.connect() as conn:
+        await conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+        await conn.execute(text(f'CREATE SCHEMA {SCHEMA}'))
+        await conn.run_sync(Base.metadata.create_all)
+        await ensure_daily_partitions(conn, since=today - timedelta(days=1))
+        await conn.execute(text('SELECT setseed(:seed)'), {'seed': args.seed})
+        for statement in SEED:
+            await conn.execute(text(statement), params)
+        for day in (today, today - timedelta(days=1)):
+            await conn.execute(text(PROGRESS), {**params, 'day': day})
+        await conn.execute(text('ANALYZE'))
+        await conn.commit()
+        rows = (await conn.execute(text('SELECT count(*) FROM daily_group_records'))).scalar()
+    print(f'групп {args.groups}, участников {args.groups * args.members}, типов {args.types}, '
+          f'строк подходов за два дня {rows}')
+
+
+async def measure(name: str, bot, job, *args, trace: bool = True) -> float:
+    session = bot.session
+    statements, requests, floods = queries.statements, len(session.requests), session.flood_waits
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        await job(bot, *args)
+    finally:
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if trace else 0
+        if trace:
+            tracemalloc.stop()
+    print(f'{name:<16} время {elapsed:.1f} с, SQL-запросов {queries.statements - statements}, '
+          f'запросов к Bot API {len(session.requests) - requests}, 429: {session.flood_waits - floods}'
+          + (f', пик памяти {peak / 2 ** 20:.1f} МБ' if trace else ''))
+    return elapsed
+
+
+async def run(args) -> bool:
+    # Слушатель схемы должен видеть все соединения, поэтому пул начинаем заново
+    await engine.dispose()
+    event.listen(engine.sync_engine, 'connect', _use_bench_schema)
+    event.listen(engine.sync_engine, 'before_cursor_execute', queries)
+
+    outbound.global_bucket = TokenBucket(rate=args.global_rate, capacity=args.global_rate)
+    outbound.concurrency = args.concurrency
+    bot = create_fake_bot(latency=args.latency, flood_rate=args.flood_rate, retry_after=args.retry_after,
+                          seed=args.groups)
+    print(f'Bot API: задержка {args.latency * 1000:.0f} мс, 429 на {args.flood_rate:.1%} запросов, '
+          f'лимит {args.global_rate:g} сообщений/с, отправителей {args.concurrency}')
+
+    try:
+        await seed(args)
+        elapsed = await measure('send_reminders', bot, send_reminders, DEFAULT_TIMEZONE, DEFAULT_REMINDER_TIME,
+                                trace=args.tracemalloc)
+        await measure('send_daily_report', bot, send_daily_report, DEFAULT_TIMEZONE, trace=args.tracemalloc)
+    finally:
+        await outbound.close()
+        await bot.session.close()
+        async with engine.begin() as conn:
+            await conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+        await engine.dispose()
+
+    ok = elapsed <= args.deadline
+    print(f"{'ok  ' if ok else 'FAIL'} напоминания за {elapsed:.0f} с при допустимых {args.deadline:.0f} с")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--groups', type=int, default=1000)
+    parser.add_argument('--members', type=int, default=10)
+    parser.add_argument('--types', type=int, default=3)
+    parser.add_argument('--required', type=int, default=50, help='норма каждого типа')
+    parser.add_argument('--active', type=float, default=0.7, help='доля пар участник-тип с подходами за день')
+    parser.add_argument('--seed', type=float, default=0.42, help='setseed Postgres, от -1 до 1')
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка ответов Bot API, с')
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after в ответах 429, с')
+    parser.add_argument('--global-rate', type=float, default=settings.TELEGRAM_GLOBAL_RATE)
+    parser.add_argument('--concurrency', type=int, default=settings.OUTBOUND_CONCURRENCY)
+    parser.add_argument('--deadline', type=float, default=3600, help='за сколько секунд должны уйти напоминания')
+    parser.add_argument('--no-tracemalloc', dest='tracemalloc', action='store_false')
+    sys.exit(0 if asyncio.run(run(parser.parse_args())) else 1)
@@ -0,0 +1,107 @@
+"""
+Сколько соединений из пула и SQL-запросов стоит один апдейт.
+
+Прогоняет типовые апдейты через настоящий Dispatcher (Bot без сети) против
+базы из config.settings и печатает checkout'ы пула и запросы на апдейт.
+
+    python -m benchmarks.session_usage --members 50 --types 4
+
+Прогон по умолчанию (50 участников, 4 типа, локальный PostgreSQL 16, чистая база),
+checkout'ов / запросов на апдейт:
+
+    апдейт                  до сессии на апдейт (d0eefc1)   сессия на апдейт (89cbc93)
+    /stats                  33 / 41                          1 / 37
+    /group_stats            1506 / 1906                      1 / 1706
+    /types                  4 / 4                            1 / 4
+    video_note→type→count   2.3 / 4.3                        0.7 / 4.3
+
+До 89cbc93 в дереве нет create_dispatcher и сессии в функциях хранилища: для прогона
+d0eefc1 диспетчер собран как в тогдашнем main(), а seed вызывает функции без session.
+"""
+import argparse
+import asyncio
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import event
+
+from benchmarks.fakes import BOT_ID, create_fake_bot, message_update, callback_update
+from bot.database.session import async_session, engine
+from bot.database.storage import init_database, load_topic_routes, get_or_create_group, add_training_type, add_user_to_group, \
+    get_or_create_user, add_pushups
+from main import create_dispatcher
+
+
+@dataclass
+class Counters:
+    checkouts: int = 0
+    statements: int = 0
+
+
+counters = Counters()
+
+
+@event.listens_for(engine.sync_engine.pool, 'checkout')
+def _on_checkout(*args):
+    counters.checkouts += 1
+
+
+@event.listens_for(engine.sync_engine, 'before_cursor_execute')
+def _on_execute(*args):
+    counters.statements += 1
+
+
+async def seed(chat_id: int, members: int, types: int):
+    group_id = str(chat_id)
+    async with async_session() as session:
+        async with session.begin():
+            await get_or_create_group(session, group_id=group_id, group_name='bench')
+            for type_index in range(types):
+                await add_training_type(session, group_id=group_id, training_type=f'type{type_index}',
+                                        required_count=50)
+            for user_id in range(1, members + 1):
+                await get_or_create_user(session, user_id, username=f'user{user_id}', first_name=f'user{user_id}')
+                await add_user_to_group(session, user_id, group_id)
+                await add_pushups(session, user_id=user_id, group_id=group_id, type_record='type0', count=10)
+
+
+async def measure(dp, bot, name: str, updates):
+    before = Counters(counters.checkouts, counters.statements)
+    for update in updates:
+        await dp.feed_update(bot, update)
+    print(f'{name:<24} updates={len(updates):<3} '
+          f'checkouts/update={(counters.checkouts - before.checkouts) / len(updates):<6.1f} '
+          f'statements/update={(counters.statements - before.statements) / len(updates):.1f}')
+
+
+async def run(members: int, types: int):
+    # Новая группа на каждый запуск, чтобы повторные прогоны не пересекались
+    chat_id = -int(time.time())
+    await init_database()
+    await seed(chat_id, members, types)
+    async with async_session() as session:
+        await load_topic_routes(session)
+
+    dp = create_dispatcher()
+    bot = create_fake_bot()
+    user_id = 1
+
+    await measure(dp, bot, '/stats', [message_update(bot, chat_id, user_id, text='/stats')])
+    await measure(dp, bot, '/group_stats', [message_update(bot, chat_id, user_id, text='/group_stats')])
+    await measure(dp, bot, '/types', [message_update(bot, chat_id, user_id, text='/types')])
+    await measure(dp, bot, 'video_note→type→count', [
+        message_update(bot, chat_id, user_id, video_note=True),
+        callback_update(bot, chat_id, user_id, data='type_type0', message_id=1, message_from=BOT_ID),
+        callback_update(bot, chat_id, user_id, data='count_10', message_id=1, message_from=BOT_ID),
+    ])
+
+    await bot.session.close()
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=50)
+    parser.add_argument('--types', type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(run(args.members, args.types))
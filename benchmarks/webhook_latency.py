@@ -0,0 +1,144 @@
+"""
+Задержка обработки апдейтов в режиме вебхука.
+
+Поднимает приложение вебхука на localhost с Bot без сети (ответы API с задержкой
+--latency), POST'ит апдейты и печатает p50/p99 времени от отправки POST до
+завершения обработки апдейта. Апдейты одного чата отправляются по порядку,
+чаты - параллельно, не больше --connections одновременных запросов.
+
+По умолчанию поток генерируется: в каждом из --chats чатов участники по кругу
+записывают подход (кружок -> тип -> количество) и смотрят /stats. С --updates
+отправляются записанные апдейты Telegram, по одному JSON на строку.
+
+    python -m benchmarks.webhook_latency --chats 50 --rounds 20 --in-flight 64
+    python -m benchmarks.webhook_latency --updates recorded.jsonl
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from aiogram.types import Update
+from aiohttp import ClientSession, web
+
+from benchmarks.fakes import BOT_ID, create_fake_bot, message_update, callback_update
+from benchmarks.session_usage import seed
+from bot.database.session import async_session, engine
+from bot.database.storage import init_database, load_topic_routes
+from bot.utils.webhook import UpdateProcessor, create_webhook_app, update_order_key
+from main import create_dispatcher
+
+PATH = '/webhook'
+
+
+class TimedProcessor(UpdateProcessor):
+    """Запоминает момент завершения обработки каждого апдейта"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.finished: Dict[int, float] = {}
+
+    async def process(self, update):
+        await super().process(update)
+        self.finished[update.update_id] = time.perf_counter()
+
+
+def percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def generated_updates(bot, chat_ids: List[int], members: int, rounds: int):
+    for round_index in range(rounds):
+        for chat_id in chat_ids:
+            user_id = round_index % members + 1
+            yield message_update(bot, chat_id, user_id, video_note=True)
+            yield callback_update(bot, chat_id, user_id, data='type_type0', message_id=1, message_from=BOT_ID)
+            yield callback_update(bot, chat_id, user_id, data='count_10', message_id=1, message_from=BOT_ID)
+            yield message_update(bot, chat_id, user_id, text='/stats')
+
+
+def recorded_updates(path: str):
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+async def post_all(url: str, streams: Dict, connections: int, sent: Dict[int, float]):
+    limit = asyncio.Semaphore(connections)
+
+    async def post_stream(http: ClientSession, payloads: List[dict]):
+        for payload in payloads:
+            async with limit:
+                sent[payload['update_id']] = time.perf_counter()
+                async with http.post(url, json=payload) as response:
+                    response.raise_for_status()
+
+    async with ClientSession() as http:
+        await asyncio.gather(*(post_stream(http, payloads) for payloads in streams.values()))
+
+
+async def run(args):
+    bot = create_fake_bot(latency=args.latency)
+    await init_database()
+
+    if args.updates:
+        payloads = recorded_updates(args.updates)
+    else:
+        # Новые группы на каждый запуск, чтобы повторные прогоны не пересекались
+        base = -int(time.time()) * 1000
+        chat_ids = [base - index for index in range(args.chats)]
+        for chat_id in chat_ids:
+            await seed(chat_id, args.members, args.types)
+        payloads = [update.model_dump(mode='json', by_alias=True, exclude_none=True)
+                    for update in generated_updates(bot, chat_ids, args.members, args.rounds)]
+
+    async with async_session() as session:
+        await load_topic_routes(session)
+
+    # Апдейты одного чата отправляем по очереди, как их доставил бы Telegram
+    streams = defaultdict(list)
+    for payload in payloads:
+        streams[update_order_key(Update.model_validate(payload))].append(payload)
+
+    dp = create_dispatcher()
+    processor = TimedProcessor(dp, bot, max_in_flight=args.in_flight, max_pending=args.pending)
+    runner = web.AppRunner(create_webhook_app(processor, PATH, secret=None))
+    await runner.setup()
+    site = web.TCPSite(runner, host='127.0.0.1', port=args.port)
+    await site.start()
+
+    sent: Dict[int, float] = {}
+    started = time.perf_counter()
+    try:
+        await post_all(f'http://127.0.0.1:{args.port}{PATH}', streams, args.connections, sent)
+        await processor.drain()
+    finally:
+        await runner.cleanup()
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted((processor.finished[update_id] - sent[update_id]) * 1000
+                       for update_id in sent if update_id in processor.finished)
+    print(f'updates={len(latencies)} chats={len(streams)} wall={elapsed:.2f}s '
+          f'rate={len(latencies) / elapsed:.0f}/s in_flight={args.in_flight}')
+    if latencies:
+        print(f'p50={percentile(latencies, 0.5):.1f}ms p99={percentile(latencies, 0.99):.1f}ms '
+              f'max={latencies[-1]:.1f}ms')
+
+    await bot.session.close()
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', help='файл с записанными апдейтами (JSON на строку)')
+    parser.add_argument('--chats', type=int, default=20)
+    parser.add_argument('--members', type=int, default=10)
+    parser.add_argument('--types', type=int, default=2)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--in-flight', type=int, default=64)
+    parser.add_argument('--pending', type=int, default=1000)
+    parser.add_argument('--connections', type=int, default=40, help='как max_connections вебхука в Telegram')
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка ответов Bot API, с')
+    parser.add_argument('--port', type=int, default=8089)
+    asyncio.run(run(parser.parse_args()))
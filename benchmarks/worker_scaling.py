@@ -0,0 +1,106 @@
+"""
+Масштабирование пропускной способности по числу процессов-воркеров.
+
+Заполняет базу из config.settings группами с большим числом участников и для
+каждого значения --workers прогоняет через WorkerPool одинаковый поток /group_stats
+и /stats (запрос + рендер рейтинга - CPU-bound часть). Bot без сети отвечает с
+задержкой --latency. Время считается от отправки первого апдейта до подтверждения
+обработки последнего, старт процессов в замер не входит.
+
+    python -m benchmarks.worker_scaling --workers 1 2 4 --chats 64 --members 200 --rounds 5
+"""
+import argparse
+import asyncio
+import time
+from functools import partial
+
+from benchmarks.fakes import create_fake_bot, message_update
+from benchmarks.session_usage import seed
+from bot.database.session import async_session, engine
+from bot.database.storage import init_database, load_topic_routes
+from bot.utils.webhook import UpdateProcessor
+from bot.utils.workers import WorkerPool, consume_updates, mp_context
+from main import create_dispatcher
+
+READY = 'ready'
+
+
+class AckProcessor(UpdateProcessor):
+    """Сообщает супервизору о каждом обработанном апдейте"""
+
+    def __init__(self, done, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.done = done
+
+    async def process(self, update):
+        await super().process(update)
+        self.done.put_nowait(update.update_id)
+
+
+async def serve_bench_worker(done, latency: float, updates):
+    bot = create_fake_bot(latency=latency)
+    dp = create_dispatcher()
+    async with async_session() as session:
+        await load_topic_routes(session)
+    processor = AckProcessor(done, dp, bot, max_in_flight=64, max_pending=1000)
+    done.put_nowait(READY)
+    await consume_updates(updates, processor)
+    await engine.dispose()
+
+
+def bench_worker(done, latency: float, index: int, updates):
+    asyncio.run(serve_bench_worker(done, latency, updates))
+
+
+async def wait_for(done, count: int):
+    loop = asyncio.get_running_loop()
+    for _ in range(count):
+        await loop.run_in_executor(None, done.get)
+
+
+async def measure(workers: int, chat_ids, rounds: int, latency: float) -> float:
+    bot = create_fake_bot()
+    done = mp_context.Queue()
+    pool = WorkerPool(partial(bench_worker, done, latency), workers=workers, queue_size=10_000, bot=bot)
+    pool.start()
+    await wait_for(done, workers)
+
+    updates = [message_update(bot, chat_id, user_id=round_index + 1, text=text)
+               for round_index in range(rounds)
+               for chat_id in chat_ids
+               for text in ('/group_stats', '/stats')]
+    started = time.perf_counter()
+    for update in updates:
+        await pool.submit(update)
+    await wait_for(done, len(updates))
+    elapsed = time.perf_counter() - started
+
+    await pool.drain()
+    return len(updates) / elapsed
+
+
+async def run(args):
+    await init_database()
+    # Новые группы на каждый запуск, чтобы повторные прогоны не пересекались
+    base = -int(time.time()) * 1000
+    chat_ids = [base - index for index in range(args.chats)]
+    for chat_id in chat_ids:
+        await seed(chat_id, args.members, args.types)
+    await engine.dispose()
+
+    baseline = None
+    for workers in args.workers:
+        rate = await measure(workers, chat_ids, args.rounds, args.latency)
+        baseline = baseline or rate
+        print(f'workers={workers:<3} rate={rate:8.1f} updates/s  speedup={rate / baseline:.2f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--chats', type=int, default=64)
+    parser.add_argument('--members', type=int, default=200)
+    parser.add_argument('--types', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка ответов Bot API, с')
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,206 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+
+from config.settings import settings
+
+MISSING = object()
+
+
+class LRUCache:
+    """Простой процесс-локальный LRU-кэш с ограничением по размеру"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.evictions = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class _NoGroup(NamedTuple):
+    since: float
+
+
+class TopicRoutes(LRUCache):
+    """
+    Таблица маршрутизации group_id -> topic_id для TopicMiddlewares.
+
+    Заполняется при старте из таблицы groups, дополняется при промахах и после commit
+    новой группы в get_or_create_group. Топик группы задается при создании и не меняется,
+    поэтому найденные маршруты хранятся без срока. А вот отсутствие группы помнится только
+    negative_ttl секунд: группу мог создать другой процесс бота.
+    """
+
+    NO_GROUP = object()
+
+    def __init__(self, max_size: int, negative_ttl: float):
+        super().__init__(max_size)
+        self.negative_ttl = negative_ttl
+
+    def load(self, routes: Iterable[Tuple[str, Optional[int]]]) -> None:
+        self.clear()
+        for group_id, topic_id in routes:
+            self.set(group_id, topic_id)
+
+    def set_missing(self, group_id: str) -> None:
+        self.set(group_id, _NoGroup(time.monotonic()))
+
+    def lookup(self, group_id: str) -> Any:
+        """Возвращает topic_id, NO_GROUP для ненастроенного чата или MISSING, если нужно сходить в базу"""
+        route = self.get(group_id, MISSING)
+        if isinstance(route, _NoGroup):
+            if time.monotonic() - route.since > self.negative_ttl:
+                self.pop(group_id)
+                return MISSING
+            return self.NO_GROUP
+        return route
+
+
+class TrainingType(NamedTuple):
+    id: int
+    name: str
+    required: int
+
+
+class TrainingTypesRegistry(LRUCache):
+    """
+    Кэш типов тренировок по группам: group_id -> {название: TrainingType}.
+
+    Точно инвалидируется в add_training_type. TTL страхует от устаревших данных,
+    когда типы меняет другой процесс.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        super().__init__(max_size)
+        self.ttl = ttl
+
+    def get_types(self, group_id: str) -> Optional[Dict[str, TrainingType]]:
+        entry = self.get(group_id)
+        if entry is None:
+            return None
+        loaded_at, types = entry
+        if time.monotonic() - loaded_at > self.ttl:
+            self.pop(group_id)
+            return None
+        return types
+
+    def set_types(self, group_id: str, types: Dict[str, TrainingType]) -> None:
+        self.set(group_id, (time.monotonic(), types))
+
+    def invalidate(self, group_id: str) -> None:
+        self.pop(group_id)
+
+
+class CachedUser(NamedTuple):
+    id: int
+    user_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+
+
+class CachedGroup(NamedTuple):
+    id: int
+    group_id: str
+    group_name: Optional[str]
+    topic_id: Optional[int]
+    timezone: str
+    # Когда пояс прочитан из базы (time.monotonic): его может поменять другой процесс
+    timezone_loaded_at: float = 0.0
+
+
+class IdentityCache:
+    """
+    LRU известных пользователей, групп и членств в группах.
+
+    Изменения профиля (username, имя, название группы) применяются к кэшу сразу,
+    а в базу уходят пачкой в фоне через flush_identity_updates. Часовой пояс группы
+    старше timezone_ttl перечитывается из базы (timezone_expired).
+    """
+
+    def __init__(self, max_size: int, timezone_ttl: float):
+        self.timezone_ttl = timezone_ttl
+        self.users = LRUCache(max_size)
+        self.groups = LRUCache(max_size)
+        self.memberships = LRUCache(max_size)
+        self.pending_users: Dict[int, CachedUser] = {}
+        self.pending_groups: Dict[str, CachedGroup] = {}
+
+    @staticmethod
+    def _changes(cached: NamedTuple, **profile: Any) -> Dict[str, Any]:
+        return {field: value for field, value in profile.items()
+                if value is not None and getattr(cached, field) != value}
+
+    def update_user(self, user: CachedUser, **profile: Any) -> CachedUser:
+        changes = self._changes(user, **profile)
+        if not changes:
+            return user
+        user = user._replace(**changes)
+        self.users.set(user.user_id, user)
+        self.pending_users[user.user_id] = user
+        return user
+
+    @staticmethod
+    def group_from_row(group: Any) -> CachedGroup:
+        """Запись кэша для строки groups; ее пояс только что прочитан из базы"""
+        return CachedGroup(group.id, group.group_id, group.group_name, group.topic_id, group.timezone,
+                           time.monotonic())
+
+    def timezone_expired(self, group: CachedGroup) -> bool:
+        return time.monotonic() - group.timezone_loaded_at > self.timezone_ttl
+
+    def set_timezone(self, group: CachedGroup, timezone: str) -> CachedGroup:
+        group = group._replace(timezone=timezone, timezone_loaded_at=time.monotonic())
+        self.groups.set(group.group_id, group)
+        return group
+
+    def update_group(self, group: CachedGroup, **profile: Any) -> CachedGroup:
+        changes = self._changes(group, **profile)
+        if not changes:
+            return group
+        group = group._replace(**changes)
+        self.groups.set(group.group_id, group)
+        self.pending_groups[group.group_id] = group
+        return group
+
+    def take_pending(self) -> Tuple[List[CachedUser], List[CachedGroup]]:
+        users, self.pending_users = list(self.pending_users.values()), {}
+        groups, self.pending_groups = list(self.pending_groups.values()), {}
+        return users, groups
+
+    def requeue(self, users: Iterable[CachedUser], groups: Iterable[CachedGroup]) -> None:
+        """Возвращает в очередь изменения, которые не удалось записать (более свежие не затираются)"""
+        for user in users:
+            self.pending_users.setdefault(user.user_id, user)
+        for group in groups:
+            self.pending_groups.setdefault(group.group_id, group)
+
+
+topic_routes = TopicRoutes(max_size=settings.TOPIC_ROUTES_SIZE, negative_ttl=settings.TOPIC_ROUTES_NEGATIVE_TTL)
+training_types = TrainingTypesRegistry(max_size=settings.TRAINING_TYPES_CACHE_SIZE,
+                                       ttl=settings.TRAINING_TYPES_TTL)
+identity_cache = IdentityCache(max_size=settings.IDENTITY_CACHE_SIZE, timezone_ttl=settings.GROUP_TIMEZONE_TTL)
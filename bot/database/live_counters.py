@@ -0,0 +1,238 @@
+"""
+Живые счетчики подходов в Redis.
+
+Ключи:
+    live:{день}:{group_id}:{type_record_id}  ZSET user_id -> подходов за день (рейтинг группы по типу)
+    live:totals:{user_id}                    ZSET type_record_id -> подходов за все время
+    live:synced                              отметка, что счетчики сверены с Postgres
+    live:rebuild                             идущая сверка; инкремент, не дошедший до Redis, ее снимает
+    lock:live_reconcile                      блокировка сверки
+
+Postgres остается источником истины. После commit в Redis пишутся не приращения, а
+значения счетчиков, которые вернул upsert (в режиме write-behind - сброс буфера), через
+ZADD GT: счетчики только растут, поэтому запоздавшее или повторное значение не может
+уменьшить более свежее. Сверка (reconcile) пишет значения из базы так же и ничего не
+удаляет, так что подходы, записанные во время сверки, не теряются.
+
+Пока отметки live:synced нет, чтения возвращают None и вызывающий код идет в Postgres.
+Если значение не дошло до Redis, отметка снимается в самом Redis - счетчикам перестают
+верить все реплики, а не только эта. Сверку запускает лидер расписания, блокировка в
+Redis не дает двум процессам сверять одновременно (например, при смене лидера).
+"""
+import asyncio
+import logging
+import uuid
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from redis.asyncio import Redis
+from redis.exceptions import WatchError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.database.models import DailyGroupRecords, UsersRecords
+from bot.database.redis_client import get_redis
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+READY_KEY = 'live:synced'
+REBUILD_KEY = 'live:rebuild'
+RECONCILE_LOCK = 'lock:live_reconcile'
+# Блокировка истекает сама, если процесс упал посреди пересборки
+RECONCILE_LOCK_TTL = int(timedelta(minutes=30).total_seconds())
+# Вчерашние ключи нужны полуночному отчету, дальше они не читаются
+DAY_TTL = int(timedelta(days=3).total_seconds())
+# Сколько команд отправлять в Redis одним пайплайном при сверке
+CHUNK_SIZE = 1000
+
+
+def day_key(day: date, group_id: str, type_record_id: int) -> str:
+    return f'live:{day.isoformat()}:{group_id}:{type_record_id}'
+
+
+def total_key(user_id: int) -> str:
+    return f'live:totals:{user_id}'
+
+
+# (день, group_id, Telegram user_id, type_record_id, подходов за день)
+DailyValue = Tuple[date, str, int, int, int]
+# (Telegram user_id, type_record_id, подходов за все время)
+TotalValue = Tuple[int, int, int]
+
+
+class LiveCounters:
+    def __init__(self, redis: Optional[Redis], enabled: bool):
+        self.redis = redis
+        self.enabled = enabled and redis is not None
+        # Значение не дошло до Redis, и снять отметку live:synced тоже не удалось - до тех пор,
+        # пока это не получится, этот процесс счетчикам не верит
+        self.dirty = False
+        self._tasks: Set[asyncio.Task] = set()
+
+    def record(self, day: date, group_id: str, user_id: int, type_record_id: int, daily: int, total: int):
+        """Планирует запись значений одного счетчика после commit (синхронный - для after_commit)"""
+        self.record_many([(day, group_id, user_id, type_record_id, daily)], [(user_id, type_record_id, total)])
+
+    def record_many(self, daily: List[DailyValue], totals: List[TotalValue]):
+        """Планирует запись значений счетчиков, которые вернула база после commit"""
+        task = asyncio.get_running_loop().create_task(self._write_values(daily, totals))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    def _queue_values(pipe, daily: Iterable[DailyValue], totals: Iterable[TotalValue]):
+        # GT: значение меньше уже записанного - устаревшее, его пропускаем
+        for day, group_id, user_id, type_record_id, count in daily:
+            key = day_key(day, group_id, type_record_id)
+            pipe.zadd(key, {user_id: count}, gt=True)
+            pipe.expire(key, DAY_TTL)
+        for user_id, type_record_id, total in totals:
+            pipe.zadd(total_key(user_id), {type_record_id: total}, gt=True)
+
+    async def _write_values(self, daily: List[DailyValue], totals: List[TotalValue]):
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for start in range(0, max(len(daily), len(totals)), CHUNK_SIZE):
+                    self._queue_values(pipe, daily[start:start + CHUNK_SIZE], totals[start:start + CHUNK_SIZE])
+                    await pipe.execute()
+        except Exception as e:
+            logger.error(f"Не удалось обновить счетчики в Redis: {e}")
+            await self._invalidate()
+
+    async def _invalidate(self) -> bool:
+        """Снимает live:synced (и идущую сверку): до следующей сверки все реплики читают счетчики из Postgres"""
+        try:
+            await self.redis.delete(READY_KEY, REBUILD_KEY)
+        except Exception as e:
+            self.dirty = True
+            logger.error(f"Не удалось снять отметку сверки счетчиков: {e}")
+            return False
+        self.dirty = False
+        return True
+
+    async def drain(self):
+        """Дожидается отправки запланированных инкрементов"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def read(self,
+                   day: date,
+                   group_id: str,
+                   user_ids: List[int],
+                   type_ids: List[int]) -> Optional[Dict[Tuple[int, int], Tuple[Optional[int], int]]]:
+        """
+        Счетчики {(user_id, type_record_id): (за день или None, всего)} одним пайплайном.
+
+        None - счетчики недоступны или не сверены, нужно читать из Postgres.
+        """
+        if not self.enabled:
+            return None
+        if self.dirty:
+            # Снятие отметки после неудачного инкремента еще не дошло до Redis - пробуем снова
+            await self._invalidate()
+            return None
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.exists(READY_KEY)
+                if user_ids and type_ids:
+                    for type_id in type_ids:
+                        pipe.zmscore(day_key(day, group_id, type_id), user_ids)
+                    for user_id in user_ids:
+                        pipe.zmscore(total_key(user_id), type_ids)
+                replies = await pipe.execute()
+        except Exception as e:
+            logger.error(f"Не удалось прочитать счетчики из Redis: {e}")
+            return None
+
+        if not replies[0]:
+            return None
+        if not user_ids or not type_ids:
+            return {}
+
+        daily, totals = replies[1:1 + len(type_ids)], replies[1 + len(type_ids):]
+        counts = {}
+        for type_index, type_id in enumerate(type_ids):
+            for user_index, user_id in enumerate(user_ids):
+                today = daily[type_index][user_index]
+                total = totals[user_index][type_index]
+                counts[(user_id, type_id)] = (None if today is None else int(today), int(total or 0))
+        return counts
+
+    async def reconcile(self, session: AsyncSession, days: Iterable[date]) -> bool:
+        """
+        Сверяет счетчики с Postgres. False - сверку уже ведет другой процесс.
+
+        Значения из базы пишутся поверх живых ключей через ZADD GT, ключи не удаляются:
+        значение, записанное во время сверки, новее прочитанного из базы и остается.
+        Отметка live:synced ставится, только если за время сверки ни одно значение не
+        потерялось - иначе _invalidate снимает live:rebuild и отметку ставит следующая сверка.
+        """
+        if not self.enabled:
+            return False
+
+        token = uuid.uuid4().hex
+        if not await self.redis.set(RECONCILE_LOCK, token, nx=True, ex=RECONCILE_LOCK_TTL):
+            logger.info("Счетчики уже сверяет другой процесс")
+            return False
+
+        days = list(days)
+        try:
+            await self.redis.set(REBUILD_KEY, token)
+            async with self.redis.pipeline(transaction=False) as pipe:
+                result = await session.stream(
+                    select(DailyGroupRecords.date, DailyGroupRecords.group_id, DailyGroupRecords.user_id,
+                           DailyGroupRecords.type_record_id, DailyGroupRecords.count)
+                    .where(DailyGroupRecords.date.in_(days))
+                )
+                async for rows in result.partitions(CHUNK_SIZE):
+                    self._queue_values(pipe, [(row.date, row.group_id, row.user_id, row.type_record_id, row.count)
+                                              for row in rows], [])
+                    await pipe.execute()
+
+                result = await session.stream(
+                    select(UsersRecords.user_id, UsersRecords.type_record_id, UsersRecords.summary_count)
+                )
+                async for rows in result.partitions(CHUNK_SIZE):
+                    self._queue_values(pipe, [], [(row.user_id, row.type_record_id, row.summary_count) for row in rows])
+                    await pipe.execute()
+
+            ready = await self._mark_ready(token)
+        finally:
+            await self._release_lock(token)
+        if not ready:
+            logger.warning("Во время сверки значение счетчика не дошло до Redis, отметка сверки не поставлена")
+        return True
+
+    async def _mark_ready(self, token: str) -> bool:
+        """Ставит live:synced, если live:rebuild все еще наш, то есть сверку никто не отменил"""
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(REBUILD_KEY)
+                if await pipe.get(REBUILD_KEY) != token:
+                    return False
+                pipe.multi()
+                pipe.set(READY_KEY, date.today().isoformat())
+                pipe.delete(REBUILD_KEY)
+                await pipe.execute()
+        except WatchError:
+            return False
+        return True
+
+    async def _release_lock(self, token: str):
+        # Снимаем только свою блокировку: если наша истекла, ее мог взять другой процесс
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(RECONCILE_LOCK)
+                if await pipe.get(RECONCILE_LOCK) == token:
+                    pipe.multi()
+                    pipe.delete(RECONCILE_LOCK)
+                    await pipe.execute()
+        except WatchError:
+            pass
+        except Exception as e:
+            logger.error(f"Не удалось снять блокировку пересборки счетчиков: {e}")
+
+
+live_counters = LiveCounters(redis=get_redis(), enabled=settings.LIVE_COUNTERS)
@@ -1,15 +1,20 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Table, Index, Time
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
-from datetime import datetime
+from datetime import datetime, date, time
 
 Base = declarative_base()
 
+DEFAULT_TIMEZONE = 'Europe/Moscow'
+DEFAULT_REMINDER_TIME = time(21, 0)
+
 user_group_association = Table(
     'user_groups',
     Base.metadata,
     Column('user_id', Integer, ForeignKey('users.id')),
-    Column('group_id', Integer, ForeignKey('groups.id'))
+    Column('group_id', Integer, ForeignKey('groups.id')),
+    # group_id первым: индекс обслуживает и выборку участников группы, и проверку членства
+    Index('ux_user_groups_group_user', 'group_id', 'user_id', unique=True),
 )
 
 
@@ -33,6 +38,10 @@ class Group(Base):
     group_name = Column(String(255))
     topic_id = Column(Integer, nullable=True)
     created_at = Column(Date, default=datetime.now)
+    # Часовой пояс группы (имя из базы tz): в нем считаются сутки, напоминание и отчет в полночь
+    timezone = Column(String(64), nullable=False, default=DEFAULT_TIMEZONE, server_default=DEFAULT_TIMEZONE)
+    reminder_time = Column(Time, nullable=False, default=DEFAULT_REMINDER_TIME,
+                           server_default=DEFAULT_REMINDER_TIME.isoformat())
 
     # Связь с пользователями
     members = relationship("User", secondary=user_group_association, back_populates="groups")
@@ -40,6 +49,9 @@ class Group(Base):
 
 class RecordTypes(Base):
     __tablename__ = 'record_types'
+    __table_args__ = (
+        Index('ux_record_types_group_type', 'group_id', 'record_type', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     group_id = Column(String(255), ForeignKey('groups.group_id'))
@@ -50,14 +62,43 @@ class RecordTypes(Base):
     group = relationship('Group')
 
 class DailyGroupRecords(Base):
+    """Дневные счетчики: строка на пользователя, группу, тип и дату. Таблица разбита на помесячные партиции"""
     __tablename__ = 'daily_group_records'
-
-    id = Column(Integer, primary_key=True)
+    __table_args__ = (
+        # Ключ партиционирования (date) обязан входить в первичный и уникальные ключи
+        Index('ux_daily_group_records_user_group_type_date', 'user_id', 'group_id', 'type_record_id', 'date',
+              unique=True),
+        Index('ix_daily_group_records_group_date', 'group_id', 'date'),
+        {'postgresql_partition_by': 'RANGE (date)'},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.user_id'))
     group_id = Column(String(255), ForeignKey('groups.group_id'))
     type_record_id = Column(Integer, ForeignKey('record_types.id'))
     count = Column(Integer, nullable=False)
-    date = Column(Date, default=datetime.now)
+    date = Column(Date, primary_key=True, default=date.today)
+
+    # Связи
+    user = relationship("User")
+    group = relationship("Group")
+    record_types = relationship("RecordTypes")
+
+class DailyReports(Base):
+    """Итоги дня: результат и норма каждого участника группы по каждому типу, снимаются при смене суток"""
+    __tablename__ = 'daily_reports'
+    __table_args__ = (
+        # По нему же ON CONFLICT DO NOTHING делает повторный снимок дня безопасным
+        Index('ux_daily_reports_group_date_user_type', 'group_id', 'date', 'user_id', 'type_record_id', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    group_id = Column(String(255), ForeignKey('groups.group_id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.user_id'), nullable=False)
+    type_record_id = Column(Integer, ForeignKey('record_types.id'), nullable=False)
+    date = Column(Date, nullable=False)
+    count = Column(Integer, nullable=False)
+    required = Column(Integer, nullable=False)
 
     # Связи
     user = relationship("User")
@@ -66,6 +107,9 @@ class DailyGroupRecords(Base):
 
 class GroupsRecords(Base):
     __tablename__ = 'groups_records'
+    __table_args__ = (
+        Index('ux_groups_records_group_type', 'group_id', 'type_record_id', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     group_id = Column(String(255), ForeignKey('groups.group_id'))
@@ -78,6 +122,9 @@ class GroupsRecords(Base):
 
 class UsersRecords(Base):
     __tablename__ = 'users_records'
+    __table_args__ = (
+        Index('ux_users_records_user_type', 'user_id', 'type_record_id', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.user_id'))
@@ -86,4 +133,15 @@ class UsersRecords(Base):
 
     # Связи
     group = relationship("User")
-    record_types = relationship("RecordTypes")
\ No newline at end of file
+    record_types = relationship("RecordTypes")
+
+
+class SchedulerRuns(Base):
+    """Последний запуск каждой задачи расписания, общий для всех реплик бота"""
+    __tablename__ = 'scheduler_runs'
+
+    job_id = Column(String(255), primary_key=True)
+    fired_at = Column(DateTime(timezone=True), nullable=False)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    # Кто выполнял запуск: хост и pid процесса-лидера
+    holder = Column(String(255), nullable=False)
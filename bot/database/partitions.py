@@ -0,0 +1,126 @@
+"""
+Помесячные партиции daily_group_records.
+
+Дневные записи хранятся с датой и не удаляются в полночь: "сегодня" - это
+условие date = :day по индексу, а старая история отрезается целыми партициями.
+"""
+import logging
+import re
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from bot.database.models import DailyGroupRecords
+
+logger = logging.getLogger(__name__)
+
+TABLE = DailyGroupRecords.__tablename__
+LEGACY_TABLE = f'{TABLE}_legacy'
+_PARTITION_NAME = re.compile(rf'^{TABLE}_y(\d{{4}})m(\d{{2}})$')
+
+
+def month_start(day: date, shift: int = 0) -> date:
+    """Первое число месяца day, сдвинутого на shift месяцев"""
+    months = day.year * 12 + day.month - 1 + shift
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f'{TABLE}_y{month.year:04d}m{month.month:02d}'
+
+
+async def ensure_daily_partitions(conn: AsyncConnection, since: date = None, months_ahead: int = 2):
+    """Создает недостающие партиции с месяца since (по умолчанию текущего) на months_ahead месяцев вперед"""
+    today = date.today()
+    first = month_start(since or today)
+    last = month_start(today, months_ahead)
+
+    month = first
+    while month <= last:
+        next_month = month_start(month, 1)
+        await conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {TABLE} '
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+        ))
+        month = next_month
+
+
+async def list_daily_partitions(conn: AsyncConnection):
+    """Партиции таблицы в виде {имя: первое число месяца}"""
+    result = await conn.execute(text(
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+        'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+        'WHERE parent.relname = :table'
+    ), {'table': TABLE})
+
+    partitions = {}
+    for name in result.scalars():
+        match = _PARTITION_NAME.match(name)
+        if match:
+            partitions[name] = date(int(match.group(1)), int(match.group(2)), 1)
+    return partitions
+
+
+async def drop_daily_partitions_before(conn: AsyncConnection, before: date, detach_only: bool = False):
+    """Отцепляет (и по умолчанию удаляет) партиции месяцев целиком раньше before"""
+    dropped = []
+    for name, month in sorted((await list_daily_partitions(conn)).items(), key=lambda item: item[1]):
+        if month_start(month, 1) > before:
+            continue
+        await conn.execute(text(f'ALTER TABLE {TABLE} DETACH PARTITION {name}'))
+        if not detach_only:
+            await conn.execute(text(f'DROP TABLE {name}'))
+        dropped.append(name)
+    return dropped
+
+
+def legacy_name(name: str) -> str:
+    # Имена в Postgres ограничены 63 байтами
+    return f'legacy_{name}'[:63]
+
+
+async def migrate_legacy_daily_records(conn: AsyncConnection):
+    """
+    Переименовывает старую непартиционированную daily_group_records, чтобы create_all
+    создал партиционированную. Возвращает True, если перенос данных нужен.
+    """
+    result = await conn.execute(text(
+        # relkind - тип "char", asyncpg отдает его байтами: сравниваем как текст
+        "SELECT relkind::text FROM pg_class WHERE relname = :table AND relkind IN ('r', 'p') "
+        "AND relnamespace = current_schema()::regnamespace"
+    ), {'table': TABLE})
+    if result.scalar_one_or_none() != 'r':
+        return False
+
+    logger.info(f'Перевожу {TABLE} на помесячные партиции')
+    await conn.execute(text(f'ALTER TABLE {TABLE} RENAME TO {LEGACY_TABLE}'))
+    # Индексы (первичный ключ и индексы прежних версий моделей) и последовательность сохраняют
+    # старые имена - освобождаем их для новой таблицы, иначе create_all наткнется на занятое имя
+    result = await conn.execute(text(
+        'SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table'
+    ), {'table': LEGACY_TABLE})
+    for name in result.scalars().all():
+        await conn.execute(text(f'ALTER INDEX "{name}" RENAME TO "{legacy_name(name)}"'))
+    await conn.execute(text(f'ALTER SEQUENCE IF EXISTS {TABLE}_id_seq RENAME TO {LEGACY_TABLE}_id_seq'))
+    return True
+
+
+async def copy_legacy_daily_records(conn: AsyncConnection):
+    """
+    Переносит строки из старой таблицы в партиции и удаляет ее.
+
+    До upsert'ов подходы одного дня могли лежать в нескольких строках, а строки без даты
+    относятся к сегодня - такие строки складываются в одну, а не отбрасываются.
+    """
+    result = await conn.execute(text(f'SELECT min(date) FROM {LEGACY_TABLE}'))
+    await ensure_daily_partitions(conn, since=result.scalar_one() or date.today())
+    await conn.execute(text(
+        f'INSERT INTO {TABLE} (user_id, group_id, type_record_id, count, date) '
+        f'SELECT user_id, group_id, type_record_id, sum(count), coalesce(date, current_date) '
+        f'FROM {LEGACY_TABLE} GROUP BY user_id, group_id, type_record_id, coalesce(date, current_date) '
+        f'ON CONFLICT (user_id, group_id, type_record_id, date) '
+        f'DO UPDATE SET count = {TABLE}.count + EXCLUDED.count'
+    ))
+    await conn.execute(text(f'DROP TABLE {LEGACY_TABLE}'))
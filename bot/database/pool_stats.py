@@ -0,0 +1,86 @@
+"""
+Статистика пула соединений с базой.
+
+InstrumentedPool - пул SQLAlchemy, который замеряет время выдачи соединения
+(ожидание свободного соединения, открытие нового, pre-ping) и считает соединения сверх
+pool_size и таймауты. pool_stats.snapshot() отдает эти счетчики вместе с текущим
+состоянием пула.
+"""
+import logging
+import time
+from typing import Any, Dict
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    def __init__(self):
+        self.pool = None
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.overflow_events = 0
+        self.timeouts = 0
+
+    def record_checkout(self, wait: float):
+        self.checkouts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    def snapshot(self) -> Dict[str, Any]:
+        pool = self.pool
+        return {
+            'size': pool.size() if pool is not None else 0,
+            'checked_out': pool.checkedout() if pool is not None else 0,
+            'checked_in': pool.checkedin() if pool is not None else 0,
+            # Сколько соединений открыто сверх size прямо сейчас
+            'overflow': max(pool.overflow(), 0) if pool is not None else 0,
+            'checkouts': self.checkouts,
+            'wait_avg_ms': self.wait_total / self.checkouts * 1000 if self.checkouts else 0.0,
+            'wait_max_ms': self.wait_max * 1000,
+            'wait_total_s': self.wait_total,
+            'overflow_events': self.overflow_events,
+            'timeouts': self.timeouts,
+        }
+
+    def reset_max(self):
+        self.wait_max = 0.0
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # engine.dispose() создает новый пул - статистика переключается на него
+        pool_stats.pool = self
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            pool_stats.timeouts += 1
+            raise
+        pool_stats.record_checkout(time.perf_counter() - started)
+        return connection
+
+    def _create_connection(self):
+        # Счетчик overflow уже увеличен под это соединение: больше нуля - оно сверх pool_size
+        if self.overflow() > 0:
+            pool_stats.overflow_events += 1
+        return super()._create_connection()
+
+
+pool_stats = PoolStats()
+
+
+async def log_pool_stats():
+    stats = pool_stats.snapshot()
+    logger.info(f"Пул БД: занято {stats['checked_out']}/{stats['size']}+{stats['overflow']}, "
+                f"выдач {stats['checkouts']}, ожидание ср. {stats['wait_avg_ms']:.1f} мс, "
+                f"макс. {stats['wait_max_ms']:.1f} мс, сверх size {stats['overflow_events']}, "
+                f"таймаутов {stats['timeouts']}")
+    # Максимум считаем по интервалу между записями в лог
+    pool_stats.reset_max()
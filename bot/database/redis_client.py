@@ -0,0 +1,25 @@
+from typing import Optional
+
+from redis.asyncio import Redis
+
+from config.settings import settings
+
+_redis: Optional[Redis] = None
+
+
+def get_redis() -> Optional[Redis]:
+    """Общий клиент Redis или None, если REDIS_HOST не задан. Соединения открываются лениво"""
+    global _redis
+    if _redis is None and settings.REDIS_HOST:
+        _redis = Redis(host=settings.REDIS_HOST,
+                       port=settings.REDIS_PORT,
+                       password=settings.REDIS_PASSWORD,
+                       decode_responses=True)
+    return _redis
+
+
+async def close_redis():
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
@@ -1,345 +1,1005 @@
-from datetime import datetime, date
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, date, time, timedelta
+from typing import List, NamedTuple, Optional
+
+import pytz
 
 from aiogram.types import Message, User as TG_USER, Chat
-from sqlalchemy import select, func, and_, delete, or_, update
+from sqlalchemy import select, func, and_, or_, event, literal, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload, aliased
+from bot.database.cache import topic_routes, training_types, identity_cache, TrainingType, CachedUser, CachedGroup
+from bot.database.live_counters import live_counters
 from bot.database.models import Base, User, Group, user_group_association, DailyGroupRecords, GroupsRecords, \
-    UsersRecords, RecordTypes
-from bot.database.session import async_session
-from bot.database.session import engine
+    UsersRecords, RecordTypes, DailyReports, DEFAULT_TIMEZONE
+from bot.database.partitions import migrate_legacy_daily_records, copy_legacy_daily_records, \
+    ensure_daily_partitions, drop_daily_partitions_before, month_start
+from bot.database.session import async_session, engine
+from bot.database.write_behind import write_behind
 from config.settings import settings
 
+logger = logging.getLogger(__name__)
+
+# Все функции принимают общую AsyncSession (одна транзакция на апдейт, см. DbSessionMiddleware).
+# Функции не коммитят сами - фиксацию транзакции выполняет владелец сессии.
+
 
 async def init_database():
     """Инициализация базы данных"""
     async with engine.begin() as conn:
+        legacy = await migrate_legacy_daily_records(conn)
         await conn.run_sync(Base.metadata.create_all)
+        await ensure_columns(conn)
+        await ensure_daily_partitions(conn, months_ahead=settings.DAILY_PARTITIONS_AHEAD)
+        if legacy:
+            await copy_legacy_daily_records(conn)
+    await ensure_indexes()
 
 
-async def get_or_create_user(user_id: int, username: str = None, first_name: str = None, last_name: str = None):
-    """Получает или создает пользователя без передачи session"""
-    async with async_session() as session:
-        result = await session.execute(
-            select(User).where(User.user_id == user_id)
+# Колонки, добавленные в модели после создания таблиц: create_all существующие таблицы не меняет
+ADDED_COLUMNS = [
+    f"ALTER TABLE groups ADD COLUMN IF NOT EXISTS timezone VARCHAR(64) NOT NULL DEFAULT '{DEFAULT_TIMEZONE}'",
+    "ALTER TABLE groups ADD COLUMN IF NOT EXISTS reminder_time TIME NOT NULL DEFAULT '21:00'",
+]
+
+
+async def ensure_columns(conn):
+    for statement in ADDED_COLUMNS:
+        await conn.execute(text(statement))
+
+
+# Счетчики, которые складываются при слиянии повторяющихся строк; остальные неключевые столбцы берутся максимальными
+SUMMED_COLUMNS = {
+    'daily_group_records': ('count',),
+    'daily_reports': ('count',),
+    'groups_records': ('summary_count',),
+    'users_records': ('summary_count',),
+}
+# Таблицы со ссылкой на record_types.id: строки повторяющихся типов переносятся на тип с меньшим id
+TYPE_REFERENCES = ('daily_group_records', 'daily_reports', 'groups_records', 'users_records')
+
+
+async def ensure_indexes():
+    """
+    Досоздает индексы моделей в уже существующих таблицах (create_all их не трогает).
+
+    На уникальные индексы опираются ON CONFLICT в upsert'ах счетчиков и участников: без них каждая
+    запись падала бы с ошибкой. Поэтому перед созданием уникального индекса повторяющиеся строки
+    сливаются (см. collapse_duplicates), а если индекс все равно не создается, бот не запускается.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                async with engine.begin() as conn:
+                    if index.unique and await conn.scalar(text('SELECT to_regclass(:name)'), {'name': index.name}) is None:
+                        await collapse_duplicates(conn, table, [column.name for column in index.columns])
+                    await conn.run_sync(lambda sync_conn: index.create(sync_conn, checkfirst=True))
+            except Exception as e:
+                if index.unique:
+                    raise RuntimeError(f"Не удалось создать уникальный индекс {index.name} "
+                                       f"на {table.name}: {e}") from e
+                logger.error(f"Не удалось создать индекс {index.name}: {e}")
+
+
+def _merged_columns(table, key: List[str]):
+    """Неключевые столбцы table: складываемые счетчики и остальные (берутся максимальными)"""
+    summed = SUMMED_COLUMNS.get(table.name, ())
+    kept = [column.name for column in table.columns
+            if column.name not in key and column.name not in summed and not column.primary_key]
+    return summed, kept
+
+
+def _merged_select(key: List[str], summed, kept) -> str:
+    return ', '.join([*key, *(f'sum({name})' for name in summed), *(f'max({name})' for name in kept)])
+
+
+async def collapse_duplicates(conn, table, key: List[str]):
+    """
+    Сливает строки table с одинаковым key в одну, чтобы по key можно было создать уникальный индекс.
+
+    Счетчики из SUMMED_COLUMNS складываются, членство в группе просто перестает повторяться. У
+    повторяющихся типов остается тип с меньшим id, записи остальных переносятся на него.
+    """
+    if table.name == RecordTypes.__tablename__:
+        await _merge_record_types(conn, key)
+        return
+
+    summed, kept = _merged_columns(table, key)
+    key_list = ', '.join(key)
+    result = await conn.execute(text(
+        f'WITH duplicates AS ('
+        f'  DELETE FROM {table.name} WHERE ({key_list}) IN ('
+        f'    SELECT {key_list} FROM {table.name} GROUP BY {key_list} HAVING count(*) > 1)'
+        f'  RETURNING *) '
+        f'INSERT INTO {table.name} ({", ".join([*key, *summed, *kept])}) '
+        f'SELECT {_merged_select(key, summed, kept)} '
+        f'FROM duplicates GROUP BY {key_list}'
+    ))
+    if result.rowcount:
+        logger.warning(f"{table.name}: слиты повторяющиеся строки по {key_list} ({result.rowcount} ключей)")
+
+
+async def _merge_record_types(conn, key: List[str]):
+    await conn.execute(text(
+        f'CREATE TEMP TABLE type_duplicates ON COMMIT DROP AS '
+        f'SELECT id, keeper FROM ('
+        f'  SELECT id, min(id) OVER (PARTITION BY {", ".join(key)}) AS keeper FROM record_types '
+        f'  WHERE {" AND ".join(f"{name} IS NOT NULL" for name in key)}) types '
+        f'WHERE id <> keeper'
+    ))
+    duplicates = await conn.scalar(text('SELECT count(*) FROM type_duplicates'))
+    if not duplicates:
+        return
+
+    for name in TYPE_REFERENCES:
+        table = Base.metadata.tables[name]
+        unique = next(index for index in table.indexes if index.unique)
+        reference_key = [column.name for column in unique.columns]
+        summed, kept = _merged_columns(table, reference_key)
+        columns = ', '.join([*reference_key, *summed, *kept])
+        moved_key = ['keeper' if column == 'type_record_id' else column for column in reference_key]
+        statement = (
+            f'WITH moved AS ('
+            f'  DELETE FROM {name} USING type_duplicates WHERE {name}.type_record_id = type_duplicates.id '
+            f'  RETURNING {name}.*, type_duplicates.keeper) '
+            f'INSERT INTO {name} ({columns}) '
+            f'SELECT {_merged_select(moved_key, summed, kept)} '
+            f'FROM moved GROUP BY {", ".join(moved_key)}'
         )
-        user = result.scalar_one_or_none()
-
-        if not user:
-            user = User(
-                user_id=user_id,
-                username=username,
-                first_name=first_name,
-                last_name=last_name,
-            )
-            session.add(user)
-            await session.commit()
-            await session.refresh(user)
+        # Если уникальный индекс таблицы уже есть, перенесенные строки складываются с записями типа-хранителя;
+        # иначе повторы остаются до collapse_duplicates этой таблицы, которая идет после record_types
+        if await conn.scalar(text('SELECT to_regclass(:name)'), {'name': unique.name}) is not None:
+            updates = [*(f'{c} = {name}.{c} + EXCLUDED.{c}' for c in summed),
+                       *(f'{c} = GREATEST({name}.{c}, EXCLUDED.{c})' for c in kept)]
+            statement += f' ON CONFLICT ({", ".join(reference_key)}) DO UPDATE SET {", ".join(updates)}'
+        await conn.execute(text(statement))
 
-        return user
+    await conn.execute(text('DELETE FROM record_types USING type_duplicates WHERE record_types.id = type_duplicates.id'))
+    logger.warning(f"record_types: слиты повторяющиеся типы ({duplicates}), записи перенесены на оставшиеся")
 
 
-async def get_or_create_group(group_id: str, group_name: str = 'private', topic_id: int = None):
-    """Получает или создает группу без передачи session"""
-    async with async_session() as session:
-        result = await session.execute(
-            select(Group)
-            .where(Group.group_id == group_id)
+async def maintain_daily_partitions():
+    """Создает партиции дневных записей наперед и удаляет месяцы старше DAILY_HISTORY_MONTHS"""
+    async with engine.begin() as conn:
+        await ensure_daily_partitions(conn, months_ahead=settings.DAILY_PARTITIONS_AHEAD)
+        if settings.DAILY_HISTORY_MONTHS > 0:
+            dropped = await drop_daily_partitions_before(
+                conn, month_start(date.today(), -settings.DAILY_HISTORY_MONTHS))
+            if dropped:
+                logger.info(f"Удалены старые партиции дневных записей: {', '.join(dropped)}")
+
+
+def local_today(timezone: str) -> date:
+    """Текущая дата в часовом поясе timezone"""
+    return datetime.now(pytz.timezone(timezone)).date()
+
+
+def group_today(group_id: str) -> date:
+    """
+    Текущие сутки группы в ее часовом поясе. Пояс берется из кэша групп, для неизвестной группы - по умолчанию.
+
+    Обработчики сначала вызывают get_or_create_group, который перечитывает устаревший пояс.
+    """
+    cached = identity_cache.groups.get(group_id)
+    return local_today(cached.timezone if cached is not None else DEFAULT_TIMEZONE)
+
+
+def _on_commit(session: AsyncSession, callback):
+    """Выполняет callback после успешного commit транзакции сессии"""
+    event.listen(session.sync_session, 'after_commit', lambda _: callback(), once=True)
+
+
+async def get_or_create_user(session: AsyncSession,
+                             user_id: int,
+                             username: str = None,
+                             first_name: str = None,
+                             last_name: str = None):
+    """
+    Получает или создает пользователя.
+
+    Известный пользователь берется из кэша без запросов, изменения его профиля
+    записываются позже пачкой (flush_identity_updates).
+    """
+    cached = identity_cache.users.get(user_id)
+    if cached is not None:
+        return identity_cache.update_user(cached, username=username, first_name=first_name, last_name=last_name)
+
+    query = select(User).where(User.user_id == user_id)
+    user = (await session.execute(query)).scalar_one_or_none()
+
+    if not user:
+        await session.execute(
+            insert(User)
+            .values(user_id=user_id, username=username, first_name=first_name, last_name=last_name)
+            .on_conflict_do_nothing(index_elements=[User.user_id])
         )
+        user = (await session.execute(query)).scalar_one()
+        created = True
+    else:
+        created = False
+        for field, value in (('username', username), ('first_name', first_name), ('last_name', last_name)):
+            if value is not None and getattr(user, field) != value:
+                setattr(user, field, value)
 
-        group = result.scalar_one_or_none()
+    cached = CachedUser(user.id, user.user_id, user.username, user.first_name, user.last_name)
+    # Только что созданную строку кэшируем после commit, иначе откат оставит в кэше несуществующий id
+    if created:
+        _on_commit(session, lambda: identity_cache.users.set(user_id, cached))
+    else:
+        identity_cache.users.set(user_id, cached)
+    return cached
 
-        if not group:
-            group = Group(
-                group_id=group_id,
-                group_name=group_name,
-                topic_id=topic_id,
-                created_at=date.today(),
-            )
-            session.add(group)
-            await session.commit()
-            await session.refresh(group)
 
-        return group
+async def get_or_create_group(session: AsyncSession, group_id: str, group_name: str = None, topic_id: int = None):
+    """
+    Получает или создает группу. Известная группа берется из кэша без запросов.
 
-async def get_users_from_group(group_id: str):
-    async with async_session() as session:
-        group = await get_or_create_group(group_id=group_id)
-        group_id_int: int = int(group.id)
-        print(f'\n\n\n{group_id_int}\n\n\n')
-        result = await session.execute(
-            select(User)
-            .join(user_group_association, User.id == user_group_association.c.user_id)
-            .where(group_id_int == user_group_association.c.group_id)
+    Пояс группы меняет /timezone в любом процессе, поэтому раз в GROUP_TIMEZONE_TTL
+    он перечитывается из базы - иначе процесс считал бы сутки группы по старому поясу.
+    """
+    cached = identity_cache.groups.get(group_id)
+    if cached is not None:
+        if identity_cache.timezone_expired(cached):
+            timezone = (await session.execute(
+                select(Group.timezone).where(Group.group_id == group_id))).scalar_one_or_none()
+            if timezone is not None:
+                cached = identity_cache.set_timezone(cached, timezone)
+        return identity_cache.update_group(cached, group_name=group_name)
+
+    query = select(Group).where(Group.group_id == group_id)
+    group = (await session.execute(query)).scalar_one_or_none()
+
+    if not group:
+        await session.execute(
+            insert(Group)
+            .values(group_id=group_id,
+                    group_name=group_name or 'private',
+                    topic_id=topic_id,
+                    created_at=date.today())
+            .on_conflict_do_nothing(index_elements=[Group.group_id])
         )
-        users = result.scalars().all()
-        return users
+        group = (await session.execute(query)).scalar_one()
+        created = True
+    else:
+        created = False
+        if group_name is not None and group.group_name != group_name:
+            group.group_name = group_name
 
-async def add_user_to_group(user_id: int, group_id: str, group_name: str = None, topic_id: str = None):
-    """Добавляет пользователя в группу, безопасно проверяя наличие"""
+    cached = identity_cache.group_from_row(group)
+    topic_id = group.topic_id
+    if created:
+        # Откат транзакции не должен оставить в кэшах группу, которой нет в базе
+        def remember():
+            identity_cache.groups.set(group_id, cached)
+            topic_routes.set(group_id, topic_id)
+        _on_commit(session, remember)
+    else:
+        identity_cache.groups.set(group_id, cached)
+        topic_routes.set(group_id, topic_id)
+    return cached
+
+
+async def flush_identity_updates():
+    """Записывает накопленные изменения профилей пользователей и групп одним upsert'ом на таблицу"""
+    users, groups = identity_cache.take_pending()
+    if not users and not groups:
+        return 0
+
+    try:
+        async with async_session() as session:
+            async with session.begin():
+                if users:
+                    stmt = insert(User).values([
+                        {'user_id': user.user_id, 'username': user.username,
+                         'first_name': user.first_name, 'last_name': user.last_name}
+                        for user in users
+                    ])
+                    await session.execute(stmt.on_conflict_do_update(
+                        index_elements=[User.user_id],
+                        set_={'username': stmt.excluded.username,
+                              'first_name': stmt.excluded.first_name,
+                              'last_name': stmt.excluded.last_name}
+                    ))
+                if groups:
+                    stmt = insert(Group).values([
+                        {'group_id': group.group_id, 'group_name': group.group_name,
+                         'topic_id': group.topic_id, 'created_at': date.today()}
+                        for group in groups
+                    ])
+                    await session.execute(stmt.on_conflict_do_update(
+                        index_elements=[Group.group_id],
+                        set_={'group_name': stmt.excluded.group_name}
+                    ))
+    except Exception:
+        identity_cache.requeue(users, groups)
+        raise
+
+    return len(users) + len(groups)
+
+
+async def reconcile_live_counters() -> bool:
+    """Сверяет живые счетчики в Redis с Postgres за сегодня и вчера. Запускает лидер расписания"""
+    if not live_counters.enabled:
+        return False
+    # У групп свои часовые пояса: их "сегодня" - от вчера до завтра по часам сервера
+    today = date.today()
+    days = (today + timedelta(days=1), today, today - timedelta(days=1))
     async with async_session() as session:
-        user = await get_or_create_user(user_id, "", "")
-        group = await get_or_create_group(group_id, group_name, topic_id)
-        user = await session.get(User, user.id, options=[selectinload(User.groups)])
-        group = await session.get(Group, group.id)
-        if group not in user.groups:
-            user.groups.append(group)
-            await session.commit()
+        async with session.begin():
+            return await live_counters.reconcile(session, days=days)
+
+
+async def _ensure_membership(session: AsyncSession, user: CachedUser, group: CachedGroup):
+    """Добавляет пользователя в группу, если членство еще не известно кэшу"""
+    key = (user.id, group.id)
+    if key in identity_cache.memberships:
+        return
+
+    await session.execute(
+        insert(user_group_association)
+        .values(user_id=user.id, group_id=group.id)
+        .on_conflict_do_nothing(index_elements=[user_group_association.c.group_id,
+                                                user_group_association.c.user_id])
+    )
+    _on_commit(session, lambda: identity_cache.memberships.set(key, True))
 
 
-async def add_pushups(user_id: int,
+async def load_topic_routes(session: AsyncSession):
+    """Заполняет таблицу маршрутизации топиков группами из базы"""
+    result = await session.execute(
+        select(Group.group_id, Group.topic_id)
+        .order_by(Group.id)
+        .limit(topic_routes.max_size)
+    )
+    topic_routes.load(result.all())
+
+async def get_users_from_group(session: AsyncSession, group_id: str):
+    group = await get_or_create_group(session, group_id=group_id)
+    group_id_int: int = int(group.id)
+    result = await session.execute(
+        select(User)
+        .join(user_group_association, User.id == user_group_association.c.user_id)
+        .where(group_id_int == user_group_association.c.group_id)
+    )
+    users = result.scalars().all()
+    return users
+
+async def add_user_to_group(session: AsyncSession,
+                            user_id: int,
+                            group_id: str,
+                            group_name: str = None,
+                            topic_id: str = None):
+    """Добавляет пользователя в группу, безопасно проверяя наличие"""
+    user = await get_or_create_user(session, user_id)
+    group = await get_or_create_group(session, group_id, group_name, topic_id)
+    await _ensure_membership(session, user, group)
+
+
+async def add_pushups(session: AsyncSession,
+                      user_id: int,
                       group_id: str,
                       type_record: str,
                       group_name: str = None,
                       topic_id: str = None,
                       count: int = 0):
-    """Добавление отжиманий пользователю в конкретной группе"""
+    """
+    Добавление подхода пользователю в конкретной группе.
 
-    async with async_session() as session:
-        user = await get_or_create_user(user_id, "", "")
-        group = await get_or_create_group(group_id, group_name, topic_id)
-        type_record_id = await get_id_group_training_type(group_id=group_id, training_type=type_record)
-        await add_user_to_group(user_id, group_id, group_name, topic_id)
+    Все изменения выполняются в транзакции переданной сессии фиксированным набором запросов:
+    счетчики увеличиваются атомарно через INSERT ... ON CONFLICT DO UPDATE,
+    поэтому параллельные подходы не теряют записи. Если типа type_record в группе нет,
+    ничего не пишет и возвращает None.
+    """
 
-        # Ежедневная запись пользователя из группы по конкретному типу тренировки
-        result = await session.execute(
-            select(DailyGroupRecords.count).where(
-                DailyGroupRecords.user_id == user_id,
-                DailyGroupRecords.group_id == group_id,
-                DailyGroupRecords.type_record_id == type_record_id
-            )
-        )
-        daily_count = result.scalar_one_or_none()
+    # Пользователь, группа и членство - из кэша, в базу только при первом появлении
+    user = await get_or_create_user(session, user_id)
+    group = await get_or_create_group(session, group_id, group_name, topic_id)
+    await _ensure_membership(session, user, group)
 
-        if daily_count:
-            daily_count += count
-            await session.execute(
-                update(DailyGroupRecords)
-                .where(DailyGroupRecords.user_id == user_id,
-                       DailyGroupRecords.group_id == group_id,
-                       DailyGroupRecords.type_record_id == type_record_id)
-                .values(count=daily_count, date=datetime.now())
-            )
-        else:
-            daily_count = count
-            group_record = DailyGroupRecords(
-                user_id=user_id,
-                group_id=group_id,
-                type_record_id=type_record_id,
-                count=count,
-                date=datetime.now()
-            )
-            session.add(group_record)
+    type_record_id = await get_id_group_training_type(session, group_id=group_id, training_type=type_record)
+    if not type_record_id:
+        # Неизвестный тип не пройдет внешний ключ record_types - в буфере он заблокировал бы сброс
+        logger.warning(f"Подход не записан: в группе {group_id} нет типа {type_record!r}")
+        return None
 
-        # Обновляем общую статистику группы
-        result = await session.execute(
-            select(GroupsRecords.summary_count)
-            .where(GroupsRecords.group_id == group_id,
-                   GroupsRecords.type_record_id == type_record_id)
-        )
-        summary_record = result.scalar_one_or_none()
-
-        if summary_record:
-            summary_record += count
-        else:
-            group_record = GroupsRecords(
-                group_id=group_id,
-                type_record_id=type_record_id,
-                summary_count=count
-            )
-            session.add(group_record)
+    today = local_today(group.timezone)
+    if write_behind.enabled:
+        # Живые счетчики обновит сброс буфера, когда подход дойдет до базы
+        return await _add_pushups_buffered(session, user_id, group_id, type_record_id, count, today)
 
-        # Обновляем общую статистику пользователя
-        result = await session.execute(
-            select(UsersRecords.summary_count).where(
-                UsersRecords.user_id == user_id,
-                UsersRecords.type_record_id == type_record_id
-            )
+    # Ежедневная запись пользователя из группы по конкретному типу тренировки
+    daily_insert = insert(DailyGroupRecords).values(
+        user_id=user_id,
+        group_id=group_id,
+        type_record_id=type_record_id,
+        count=count,
+        date=today
+    )
+    result = await session.execute(
+        daily_insert.on_conflict_do_update(
+            index_elements=[DailyGroupRecords.user_id,
+                            DailyGroupRecords.group_id,
+                            DailyGroupRecords.type_record_id,
+                            DailyGroupRecords.date],
+            set_={'count': DailyGroupRecords.count + daily_insert.excluded.count}
+        ).returning(DailyGroupRecords.count)
+    )
+    daily_count = result.scalar_one()
+
+    # Обновляем общую статистику группы
+    group_insert = insert(GroupsRecords).values(
+        group_id=group_id,
+        type_record_id=type_record_id,
+        summary_count=count
+    )
+    await session.execute(
+        group_insert.on_conflict_do_update(
+            index_elements=[GroupsRecords.group_id, GroupsRecords.type_record_id],
+            set_={'summary_count': GroupsRecords.summary_count + group_insert.excluded.summary_count}
         )
-        summary_record = result.scalar_one_or_none()
+    )
+
+    # Обновляем общую статистику пользователя
+    user_insert = insert(UsersRecords).values(
+        user_id=user_id,
+        type_record_id=type_record_id,
+        summary_count=count
+    )
+    result = await session.execute(
+        user_insert.on_conflict_do_update(
+            index_elements=[UsersRecords.user_id, UsersRecords.type_record_id],
+            set_={'summary_count': UsersRecords.summary_count + user_insert.excluded.summary_count}
+        ).returning(UsersRecords.summary_count)
+    )
+    summary_record = result.scalar_one()
+
+    if live_counters.enabled:
+        _on_commit(session, lambda: live_counters.record(today, group_id, user_id, type_record_id,
+                                                         daily_count, summary_record))
+    return summary_record, daily_count, count
+
 
-        if summary_record:
-            summary_record += count
+async def get_group_training_types(session: AsyncSession, group_id: str):
+    """Типы тренировок группы {название: TrainingType} из кэша, при промахе - одним запросом"""
+    types = training_types.get_types(group_id)
+    if types is not None:
+        return types
 
-            await session.execute(
-                update(UsersRecords)
+    result = await session.execute(
+        select(RecordTypes.id, RecordTypes.record_type, RecordTypes.required)
+        .where(RecordTypes.group_id == group_id)
+        .order_by(RecordTypes.id)
+    )
+    types = {row.record_type: TrainingType(row.id, row.record_type, row.required) for row in result}
+    training_types.set_types(group_id, types)
+    return types
+
+
+async def _add_pushups_buffered(session: AsyncSession, user_id: int, group_id: str, type_record_id: int, count: int,
+                                today: date):
+    """Режим write-behind: инкремент уходит в буфер, ответ считается как база + незаписанная часть"""
+    key = (user_id, group_id, type_record_id, today)
+
+    async def read_counters():
+        result = await session.execute(
+            select(
+                select(DailyGroupRecords.count)
+                .where(DailyGroupRecords.user_id == user_id,
+                       DailyGroupRecords.group_id == group_id,
+                       DailyGroupRecords.type_record_id == type_record_id,
+                       DailyGroupRecords.date == today)
+                .scalar_subquery(),
+                select(UsersRecords.summary_count)
                 .where(UsersRecords.user_id == user_id,
                        UsersRecords.type_record_id == type_record_id)
-                .values(summary_count=summary_record)
-            )
-        else:
-            summary_record = count
-            user_record = UsersRecords(
-                user_id=user_id,
-                type_record_id=type_record_id,
-                summary_count=count
+                .scalar_subquery(),
             )
-            session.add(user_record)
+        )
+        return result.one()
 
-        await session.commit()
+    (daily_count, summary_record), pending = await write_behind.read_with_overlay(key, read_counters)
 
-        return summary_record, daily_count, count
+    # В буфер только после commit: пользователь мог быть создан в этой же транзакции
+    _on_commit(session, lambda: write_behind.add(key, count))
 
+    daily_count = (daily_count or 0) + pending + count
+    summary_record = (summary_record or 0) + pending + count
+    return summary_record, daily_count, count
 
-async def get_id_group_training_type(group_id: str, training_type: str):
-    async with async_session() as session:
-        result = await session.execute(
-            select(RecordTypes.id)
-            .where(RecordTypes.group_id == group_id)
-            .where(RecordTypes.record_type == training_type)
-        )
-        training_type_id = result.scalar_one_or_none() or 0
-        return training_type_id
 
+async def get_id_group_training_type(session: AsyncSession, group_id: str, training_type: str):
+    types = await get_group_training_types(session, group_id)
+    training_type_id = types[training_type].id if training_type in types else 0
+    return training_type_id
 
-async def get_all_types_training_group(group_id: str):
-    async with async_session() as session:
-        result = await session.execute(
-            select(RecordTypes.record_type)
-            .where(RecordTypes.group_id == group_id)
-        )
-        records = result.scalars().all()
-        return records
 
+async def get_all_types_training_group(session: AsyncSession, group_id: str):
+    types = await get_group_training_types(session, group_id)
+    return list(types)
 
-async def add_training_type(group_id: str, training_type: str, required_count: int):
-    async with async_session() as session:
-        record_types = RecordTypes(
-            group_id=group_id,
-            record_type=training_type,
-            required=required_count
+
+async def add_training_type(session: AsyncSession, group_id: str, training_type: str, required_count: int):
+    record_types = RecordTypes(
+        group_id=group_id,
+        record_type=training_type,
+        required=required_count
+    )
+    session.add(record_types)
+    await session.flush()
+
+    # Сбрасываем кэш сразу и еще раз после commit, чтобы параллельное чтение не закэшировало старый список
+    training_types.invalidate(group_id)
+    _on_commit(session, lambda: training_types.invalidate(group_id))
+
+
+def _stats_entry(user_id: int, group_id: str, training_type: str, today, total):
+    return {
+        'user_id': user_id,
+        'group_id': group_id,
+        'training_type': training_type,
+        'today': int(today),
+        'total': int(total)
+    }
+
+
+def group_stats_query(group_id: str, training_type: str = None, day: date = None):
+    """Матрица участник x тип тренировки группы: за день day (по умолчанию сегодня) и всего"""
+    query = (
+        select(
+            User.user_id,
+            User.username,
+            RecordTypes.id.label('type_record_id'),
+            RecordTypes.record_type,
+            func.coalesce(func.sum(DailyGroupRecords.count), 0).label('today'),
+            func.coalesce(func.sum(UsersRecords.summary_count), 0).label('total'),
         )
-        session.add(record_types)
-        await session.commit()
+        .select_from(user_group_association)
+        .join(Group, and_(Group.id == user_group_association.c.group_id,
+                          Group.group_id == group_id))
+        .join(User, User.id == user_group_association.c.user_id)
+        .outerjoin(RecordTypes, RecordTypes.group_id == Group.group_id)
+        .outerjoin(DailyGroupRecords, and_(
+            DailyGroupRecords.user_id == User.user_id,
+            DailyGroupRecords.group_id == Group.group_id,
+            DailyGroupRecords.type_record_id == RecordTypes.id,
+            DailyGroupRecords.date == (day or group_today(group_id)),
+        ))
+        .outerjoin(UsersRecords, and_(
+            UsersRecords.user_id == User.user_id,
+            UsersRecords.type_record_id == RecordTypes.id,
+        ))
+        .group_by(User.id, User.user_id, User.username, RecordTypes.id, RecordTypes.record_type)
+        .order_by(User.id, RecordTypes.id)
+    )
+    if training_type:
+        query = query.where(RecordTypes.record_type == training_type)
 
+    return query
 
-async def get_group_stats(tg_group: Chat, training_type: str = None):
-    """Получение статистики по тренировкам в группе"""
-    async with async_session() as session:
-        group = await get_or_create_group(str(tg_group.id))
-        users = await get_users_from_group(str(tg_group.id))
-
-        if training_type:
-            # training_type_id = await get_id_group_training_type(group_id, training_type)
-            # TO DO:
-            print()
-        else:
-            try:
-                group_stats = {}
-                for user in users:
-                    user_stats = await get_user_stats(tg_user_id=user.user_id,
-                                                      tg_group=tg_group)
-                    total_size_trainings = 0
-                    for type, stats in user_stats.items():
-                            total_size_trainings += int(stats['today'])
-                    user_stats['total_size_trainings'] = total_size_trainings
-                    group_stats[user.username] = user_stats
-            except Exception as e:
-                print(e)
-        return dict(sorted(group_stats.items(), key=lambda x: x[1]['total_size_trainings'], reverse=True))
+
+async def get_group_stats(session: AsyncSession, tg_group: Chat, training_type: str = None):
+    """
+    Получение статистики по тренировкам в группе.
+
+    Вся матрица участник x тип (сегодня / всего) считается одним сгруппированным запросом.
+    """
+    group_id = str(tg_group.id)
+    today = group_today(group_id)
+    if live_counters.enabled:
+        group_stats = await _get_group_stats_live(session, group_id, training_type, today)
+        if group_stats is not None:
+            return group_stats
+
+    result = await session.execute(group_stats_query(group_id, training_type, today))
+
+    group_stats = {}
+    for row in result:
+        user_stats = group_stats.setdefault(row.username, {'total_size_trainings': 0})
+        if row.record_type is None:
+            continue
+        # Незаписанные инкременты write-behind буфера
+        pending = write_behind.overlay((row.user_id, group_id, row.type_record_id, today))
+        user_stats[row.record_type] = _stats_entry(row.user_id, group_id, row.record_type,
+                                                   row.today + pending, row.total + pending)
+        user_stats['total_size_trainings'] += int(row.today + pending)
+
+    # Счетчик общего числа упражнений держим последним ключом, как его ожидает рендер
+    for user_stats in group_stats.values():
+        user_stats['total_size_trainings'] = user_stats.pop('total_size_trainings')
+
+    return _sort_group_stats(group_stats)
+
+
+def _sort_group_stats(group_stats: dict):
+    return dict(sorted(group_stats.items(), key=lambda x: x[1]['total_size_trainings'], reverse=True))
+
+
+async def _group_members(session: AsyncSession, group_id: str):
+    """Участники группы (user_id, username) в порядке вступления"""
+    result = await session.execute(
+        select(User.user_id, User.username)
+        .select_from(user_group_association)
+        .join(Group, and_(Group.id == user_group_association.c.group_id,
+                          Group.group_id == group_id))
+        .join(User, User.id == user_group_association.c.user_id)
+        .order_by(User.id)
+    )
+    return result.all()
+
+
+async def _get_group_stats_live(session: AsyncSession, group_id: str, training_type: Optional[str], day: date):
+    """Статистика группы по счетчикам из Redis. None - счетчики недоступны"""
+    types = list((await get_group_training_types(session, group_id)).values())
+    if training_type:
+        types = [t for t in types if t.name == training_type]
+        if not types:
+            return {}
+
+    members = await _group_members(session, group_id)
+    counts = await live_counters.read(day, group_id, [m.user_id for m in members], [t.id for t in types])
+    if counts is None:
+        return None
+
+    group_stats = {}
+    for member in members:
+        user_stats = group_stats.setdefault(member.username, {})
+        total_size = user_stats.pop('total_size_trainings', 0)
+        for training in types:
+            today, total = counts[(member.user_id, training.id)]
+            user_stats[training.name] = _stats_entry(member.user_id, group_id, training.name, today or 0, total)
+            total_size += today or 0
+        user_stats['total_size_trainings'] = total_size
+
+    return _sort_group_stats(group_stats)
 
 # Получение статистики пользователя из определенной группы
-async def get_user_group_training_type_stats(user_id: int, group_id: str, training_type: str):
-    async with async_session() as session:
-        user = await get_or_create_user(user_id, "", "")
-        group = await get_or_create_group(group_id)
-        training_type_id = await get_id_group_training_type(group_id, training_type)
-        await add_user_to_group(user_id, group_id)
+async def get_user_group_training_type_stats(session: AsyncSession, user_id: int, group_id: str, training_type: str):
+    user = await get_or_create_user(session, user_id)
+    group = await get_or_create_group(session, group_id)
+    training_type_id = await get_id_group_training_type(session, group_id, training_type)
+    await add_user_to_group(session, user_id, group_id)
 
-        result = await session.execute(
-            select(DailyGroupRecords.count)
-            .where(DailyGroupRecords.user_id == user_id,
-                   DailyGroupRecords.group_id == group_id,
-                   DailyGroupRecords.type_record_id == training_type_id)
+    result = await session.execute(
+        select(DailyGroupRecords.count)
+        .where(DailyGroupRecords.user_id == user_id,
+               DailyGroupRecords.group_id == group_id,
+               DailyGroupRecords.type_record_id == training_type_id,
+               DailyGroupRecords.date == local_today(group.timezone))
+    )
+    today = result.scalar_one_or_none() or 0
+
+    result = await session.execute(
+        select(func.sum(UsersRecords.summary_count))
+        .where(UsersRecords.user_id == user_id,
+               UsersRecords.type_record_id == training_type_id)
+    )
+    total = result.scalar_one_or_none() or 0
+
+    return {
+        'user_id': user.user_id,
+        'group_id': group.group_id,
+        'training_type': training_type,
+        'today': today,
+        'total': total
+    }
+
+
+async def get_today_records(session: AsyncSession, user_id: int, group_id: str, type_record_id: int):
+    user = await get_or_create_user(session, user_id)
+
+    result = await session.execute(
+        select(DailyGroupRecords.count)
+        .where(DailyGroupRecords.user_id == user.id,
+               DailyGroupRecords.group_id == group_id,
+               DailyGroupRecords.type_record_id == type_record_id,
+               DailyGroupRecords.date == group_today(group_id))
+    )
+    count = result.scalar_one_or_none() or 0
+    return count
+
+
+async def get_total_records(session: AsyncSession, user_id: int, type_record_id: int):
+    user = await get_or_create_user(session, user_id)
+
+    result = await session.execute(
+        select(UsersRecords.summary_count)
+        .where(UsersRecords.user_id == user.id,
+               UsersRecords.type_record_id == type_record_id)
+    )
+    count = result.scalar_one_or_none() or 0
+    return count
+
+
+async def get_user_stats(session: AsyncSession,
+                         tg_user_id: int,
+                         tg_group: Chat):
+    """Статистика пользователя по всем типам тренировок группы одним запросом"""
+    group_id = str(tg_group.id)
+    today = group_today(group_id)
+    await get_or_create_user(session, user_id=tg_user_id)
+
+    if live_counters.enabled:
+        types = list((await get_group_training_types(session, group_id)).values())
+        counts = await live_counters.read(today, group_id, [tg_user_id], [t.id for t in types])
+        if counts is not None:
+            stats = {}
+            for training in types:
+                today_count, total = counts[(tg_user_id, training.id)]
+                stats[training.name] = _stats_entry(tg_user_id, group_id, training.name, today_count or 0, total)
+            return stats
+
+    result = await session.execute(
+        select(
+            RecordTypes.id.label('type_record_id'),
+            RecordTypes.record_type,
+            func.coalesce(func.sum(DailyGroupRecords.count), 0).label('today'),
+            func.coalesce(func.sum(UsersRecords.summary_count), 0).label('total'),
         )
-        today = result.scalar_one_or_none() or 0
+        .select_from(RecordTypes)
+        .outerjoin(DailyGroupRecords, and_(
+            DailyGroupRecords.user_id == tg_user_id,
+            DailyGroupRecords.group_id == group_id,
+            DailyGroupRecords.type_record_id == RecordTypes.id,
+            DailyGroupRecords.date == today,
+        ))
+        .outerjoin(UsersRecords, and_(
+            UsersRecords.user_id == tg_user_id,
+            UsersRecords.type_record_id == RecordTypes.id,
+        ))
+        .where(RecordTypes.group_id == group_id)
+        .group_by(RecordTypes.id, RecordTypes.record_type)
+        .order_by(RecordTypes.id)
+    )
 
-        result = await session.execute(
-            select(func.sum(UsersRecords.summary_count))
-            .where(UsersRecords.user_id == user_id,
-                   UsersRecords.type_record_id == training_type_id)
+    stats = {}
+    for row in result:
+        pending = write_behind.overlay((tg_user_id, group_id, row.type_record_id, today))
+        stats[row.record_type] = _stats_entry(tg_user_id, group_id, row.record_type,
+                                              row.today + pending, row.total + pending)
+    return stats
+
+
+class MissingTraining(NamedTuple):
+    username: Optional[str]
+    record_type: str
+    required: int
+    count: Optional[int]
+
+
+async def get_users_without_training_today(session: AsyncSession, group: Group, day: date = None,
+                                           type_record_id: int = None):
+    """Участники, не выполнившие норму за день day (по умолчанию сегодня в поясе группы), только по типу type_record_id"""
+    missing = await get_users_without_training(session, [group], day, type_record_id)
+    return missing[group.group_id]
+
+
+async def get_users_without_training(session: AsyncSession, groups: List[Group], day: date = None,
+                                     type_record_id: int = None):
+    """
+    Участники, не выполнившие норму за день day, сразу по всем группам groups.
+
+    Без day каждая группа берется за свои текущие сутки в своем часовом поясе, с type_record_id -
+    только этот тип. Возвращает {group_id: [MissingTraining, ...]} одним запросом независимо от числа групп.
+    """
+    if live_counters.enabled:
+        missing = await _get_users_without_training_live(session, groups, day, type_record_id)
+        if missing is not None:
+            return missing
+
+    missing = {group.group_id: [] for group in groups}
+    query = (
+        select(
+            Group.group_id,
+            User.user_id,
+            User.username,
+            RecordTypes.id,
+            RecordTypes.record_type,
+            RecordTypes.required,
+            DailyGroupRecords.count
         )
-        total = result.scalar_one_or_none() or 0
+        .select_from(user_group_association)
+        .join(Group, Group.id == user_group_association.c.group_id)
+        .join(User, User.id == user_group_association.c.user_id)
+        .join(RecordTypes, RecordTypes.group_id == Group.group_id)
+        .outerjoin(DailyGroupRecords, and_(
+            User.user_id == DailyGroupRecords.user_id,
+            DailyGroupRecords.group_id == Group.group_id,
+            RecordTypes.id == DailyGroupRecords.type_record_id,
+            DailyGroupRecords.date == (day or func.date(func.timezone(Group.timezone, func.now()))),
+        ))
+        .where(and_(
+            Group.group_id.in_(list(missing)),
+            or_(
+                DailyGroupRecords.count < RecordTypes.required,
+                DailyGroupRecords.count.is_(None)
+            )
+        ))
+        .order_by(Group.id, User.id, RecordTypes.id)
+    )
+    if type_record_id is not None:
+        query = query.where(RecordTypes.id == type_record_id)
+    result = await session.execute(query)
+    days = {group.group_id: day or local_today(group.timezone) for group in groups}
+    for row in result:
+        # Незаписанные инкременты write-behind буфера могут закрыть норму
+        pending = write_behind.overlay((row.user_id, row.group_id, row.id, days[row.group_id]))
+        count = (row.count or 0) + pending if pending else row.count
+        if count is not None and count >= row.required:
+            continue
+        missing[row.group_id].append(MissingTraining(row.username, row.record_type, row.required, count))
+    return missing
 
-        return {
-            'user_id': user.user_id,
-            'group_id': group.group_id,
-            'training_type': training_type,
-            'today': today,
-            'total': total
-        }
 
+async def _get_users_without_training_live(session: AsyncSession, groups: List[Group], day: Optional[date],
+                                           type_record_id: Optional[int]):
+    """То же по счетчикам из Redis. None - счетчики недоступны"""
+    group_ids = [group.group_id for group in groups]
+    members = defaultdict(list)
+    result = await session.execute(
+        select(Group.group_id, User.user_id, User.username)
+        .select_from(user_group_association)
+        .join(Group, Group.id == user_group_association.c.group_id)
+        .join(User, User.id == user_group_association.c.user_id)
+        .where(Group.group_id.in_(group_ids))
+        .order_by(Group.id, User.id)
+    )
+    for row in result:
+        members[row.group_id].append(row)
 
-async def get_today_records(user_id: int, group_id: str, type_record_id: int):
-    async with async_session() as session:
-        user = await get_or_create_user(user_id, "", "")
+    types = defaultdict(list)
+    query = (
+        select(RecordTypes.group_id, RecordTypes.id, RecordTypes.record_type, RecordTypes.required)
+        .where(RecordTypes.group_id.in_(group_ids))
+        .order_by(RecordTypes.id)
+    )
+    if type_record_id is not None:
+        query = query.where(RecordTypes.id == type_record_id)
+    result = await session.execute(query)
+    for row in result:
+        types[row.group_id].append(TrainingType(row.id, row.record_type, row.required))
 
-        result = await session.execute(
-            select(DailyGroupRecords.count)
-            .where(DailyGroupRecords.user_id == user.id,
-                   DailyGroupRecords.group_id == group_id,
-                   DailyGroupRecords.type_record_id == type_record_id)
+    # Пайплайн на группу, не больше 50 одновременно, чтобы не раздувать пул соединений Redis
+    counts = []
+    for start in range(0, len(group_ids), 50):
+        counts += await asyncio.gather(*(
+            live_counters.read(day or local_today(group.timezone), group.group_id,
+                               [m.user_id for m in members[group.group_id]], [t.id for t in types[group.group_id]])
+            for group in groups[start:start + 50]
+        ))
+    if any(group_counts is None for group_counts in counts):
+        return None
+
+    missing = {}
+    for group_id, group_counts in zip(group_ids, counts):
+        missing[group_id] = []
+        for member in members[group_id]:
+            for training in types[group_id]:
+                today, _ = group_counts[(member.user_id, training.id)]
+                if today is None or today < training.required:
+                    missing[group_id].append(MissingTraining(member.username, training.name,
+                                                             training.required, today))
+    return missing
+
+
+def daily_rollover_query(day: date, timezone: str = None):
+    """
+    Снимок итогов дня day по всем группам (или группам часового пояса timezone) одним INSERT ... SELECT.
+
+    Строка на участника группы и тип, в том числе без подходов (count = 0). Уже снятые
+    строки пропускаются, поэтому повторный запуск после сбоя ничего не дублирует.
+    """
+    columns = [DailyReports.group_id, DailyReports.user_id, DailyReports.type_record_id,
+               DailyReports.date, DailyReports.count, DailyReports.required]
+    snapshot = (
+        select(
+            Group.group_id,
+            User.user_id,
+            RecordTypes.id,
+            literal(day, DailyReports.date.type),
+            func.coalesce(DailyGroupRecords.count, 0),
+            RecordTypes.required
         )
-        count = result.scalar_one_or_none() or 0
-        return count
+        .select_from(user_group_association)
+        .join(Group, Group.id == user_group_association.c.group_id)
+        .join(User, User.id == user_group_association.c.user_id)
+        .join(RecordTypes, RecordTypes.group_id == Group.group_id)
+        .outerjoin(DailyGroupRecords, and_(
+            User.user_id == DailyGroupRecords.user_id,
+            DailyGroupRecords.group_id == Group.group_id,
+            RecordTypes.id == DailyGroupRecords.type_record_id,
+            DailyGroupRecords.date == day,
+        ))
+    )
+    if timezone is not None:
+        snapshot = snapshot.where(Group.timezone == timezone)
+    return insert(DailyReports).from_select(columns, snapshot).on_conflict_do_nothing(
+        index_elements=[DailyReports.group_id, DailyReports.date, DailyReports.user_id, DailyReports.type_record_id]
+    )
 
 
-async def get_total_records(user_id: int, type_record_id: int):
-    async with async_session() as session:
-        user = await get_or_create_user(user_id, "", "")
+async def rollover_day(day: date, timezone: str = None) -> int:
+    """Снимает итоги дня day в daily_reports в одной транзакции. Возвращает число новых строк"""
+    # Подходы из буфера этого процесса должны попасть в снимок; буферы остальных процессов
+    # успевают сброситься, пока задача отчета ждет ROLLOVER_GRACE после полуночи
+    await write_behind.flush()
+    async with engine.begin() as conn:
+        result = await conn.execute(daily_rollover_query(day, timezone))
+    logger.info(f"Итоги {day.isoformat()} ({timezone or 'все пояса'}) сняты: новых строк {result.rowcount}")
+    return result.rowcount
 
-        result = await session.execute(
-            select(UsersRecords.summary_count)
-            .where(UsersRecords.user_id == user.id,
-                   UsersRecords.type_record_id == type_record_id)
+
+async def get_daily_report(session: AsyncSession, groups: List[Group], day: date):
+    """Невыполненные нормы дня day из снимка daily_reports: {group_id: [MissingTraining, ...]}"""
+    missing = {group.group_id: [] for group in groups}
+    result = await session.execute(
+        select(
+            DailyReports.group_id,
+            User.username,
+            RecordTypes.record_type,
+            DailyReports.required,
+            DailyReports.count
         )
-        count = result.scalar_one_or_none() or 0
-        return count
+        .join(User, User.user_id == DailyReports.user_id)
+        .join(RecordTypes, RecordTypes.id == DailyReports.type_record_id)
+        .where(and_(
+            DailyReports.group_id.in_(list(missing)),
+            DailyReports.date == day,
+            DailyReports.count < DailyReports.required
+        ))
+        .order_by(DailyReports.group_id, User.id, RecordTypes.id)
+    )
+    for row in result:
+        missing[row.group_id].append(MissingTraining(row.username, row.record_type, row.required, row.count))
+    return missing
 
 
-async def get_user_stats(tg_user_id: int,
-                         tg_group: Chat):
-    async with async_session() as session:
-        await get_or_create_user(user_id=tg_user_id)
+async def get_group_timezones(session: AsyncSession) -> List[str]:
+    """Часовые пояса, в которых есть группы"""
+    result = await session.execute(select(Group.timezone).distinct().order_by(Group.timezone))
+    return list(result.scalars())
 
-        # Результат за сегодня
-        all_types = await get_all_types_training_group(str(tg_group.id))
-        result = {}
-        for type in all_types:
-            result[type] = await get_user_group_training_type_stats(user_id=tg_user_id,
-                                                      group_id=str(tg_group.id),
-                                                      training_type=type)
-        return result
 
+async def get_reminder_slots(session: AsyncSession) -> List[tuple]:
+    """Различные пары (часовой пояс, время напоминания) групп"""
+    result = await session.execute(
+        select(Group.timezone, Group.reminder_time).distinct().order_by(Group.timezone, Group.reminder_time))
+    return [tuple(row) for row in result]
 
-async def get_users_without_training_today(group: Group):
-    async with async_session() as session:
-        result = await session.execute(
-            select(
-                User.username,
-                RecordTypes.record_type,
-                RecordTypes.required,
-                DailyGroupRecords.count
-            )
-            .select_from(User)
-            .join(user_group_association, User.id == user_group_association.c.user_id)
-            .join(RecordTypes, RecordTypes.group_id == group.group_id)
-            .outerjoin(DailyGroupRecords, and_(
-                User.user_id == DailyGroupRecords.user_id,
-                RecordTypes.id == DailyGroupRecords.type_record_id,
-            ))
-            .where(and_(
-                user_group_association.c.group_id == group.id,
-                or_(
-                    DailyGroupRecords.count < RecordTypes.required,
-                    DailyGroupRecords.count.is_(None)
-                )
-            ))
-        )
-        users_not_done = result.all()
-    return users_not_done
+
+async def get_groups_in_slot(session: AsyncSession, timezone: str, reminder_time: time = None) -> List[Group]:
+    """Группы часового пояса timezone (и с временем напоминания reminder_time, если задано)"""
+    query = select(Group).where(Group.timezone == timezone)
+    if reminder_time is not None:
+        query = query.where(Group.reminder_time == reminder_time)
+    return list((await session.execute(query.order_by(Group.id))).scalars())
+
+
+async def set_group_schedule(session: AsyncSession, group_id: str, timezone: str = None, reminder_time: time = None):
+    """Меняет часовой пояс и/или время напоминания группы. Пояс должен быть проверен вызывающим кодом"""
+    values = {}
+    if timezone is not None:
+        values['timezone'] = timezone
+    if reminder_time is not None:
+        values['reminder_time'] = reminder_time
+    if not values:
+        return
+    await session.execute(update(Group).where(Group.group_id == group_id).values(**values))
+
+    if timezone is not None:
+        # Сутки группы считаются в поясе из кэша - обновляем его вместе с транзакцией.
+        # Остальные процессы перечитают пояс по истечении GROUP_TIMEZONE_TTL
+        def refresh():
+            cached = identity_cache.groups.get(group_id)
+            if cached is not None:
+                identity_cache.set_timezone(cached, timezone)
+        _on_commit(session, refresh)
 
 
 async def update_user_activity(
+        session: AsyncSession,
         user_id: int,
         username: str,
         first_name: str,
@@ -348,41 +1008,20 @@ async def update_user_activity(
         group_name: str = None,
         topic_id: str = None,
 ):
-    async with async_session() as session:
-        user = await get_or_create_user(user_id, username, first_name, last_name)
-        if group_id:
-            group = await get_or_create_group(group_id, group_name, topic_id)
-            await add_user_to_group(user_id, group_id, group_name)
-        await session.commit()
-
+    await get_or_create_user(session, user_id, username, first_name, last_name)
+    if group_id:
+        await get_or_create_group(session, group_id, group_name, topic_id)
+        await add_user_to_group(session, user_id, group_id, group_name)
 
-async def get_required_count(group_id: str, training_type: str):
-    async with async_session() as session:
-        result = await session.execute(
-            select(RecordTypes.required)
-            .where(RecordTypes.group_id == group_id,
-                   RecordTypes.record_type == training_type)
-        )
 
-        required_count = result.scalar_one_or_none()
-        return required_count
+async def get_required_count(session: AsyncSession, group_id: str, training_type: str):
+    types = await get_group_training_types(session, group_id)
+    required_count = types[training_type].required if training_type in types else None
+    return required_count
 
 
 # --- Пользовательское согласие ---
-async def save_user_consent(user_id: int, username: str, first_name: str):
+async def save_user_consent(session: AsyncSession, user_id: int, username: str, first_name: str):
     """Сохраняет согласие пользователя на участие. Если согласие уже дано, возвращает соответствующее сообщение"""
-    async with async_session() as session:
-        user = await get_or_create_user(user_id, username, first_name)
-        await session.commit()
-        return "✅ Согласие сохранено."
-
-async def reset_daily_trainings(group: Group):
-    """
-    Сбрасывает дневные счетчики отжиманий и возвращает список пользователей,
-    которые не сделали отжимания сегодня.
-    """
-    async with async_session() as session:
-        await session.execute(
-            delete(DailyGroupRecords)
-            .where(DailyGroupRecords.group_id == group.group_id))
-        await session.commit()
+    await get_or_create_user(session, user_id, username, first_name)
+    return "✅ Согласие сохранено."
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import date
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.database.live_counters import DailyValue, TotalValue, live_counters
+from bot.database.models import DailyGroupRecords, GroupsRecords, UsersRecords
+from bot.database.session import async_session
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# (Telegram user_id, group_id, type_record_id, день)
+CounterKey = Tuple[int, str, int, date]
+
+T = TypeVar('T')
+
+
+async def write_counters(session: AsyncSession,
+                         increments: Dict[CounterKey, int]) -> Tuple[List[DailyValue], List[TotalValue]]:
+    """
+    Применяет пачку инкрементов к трем таблицам счетчиков - по одному multi-row upsert на таблицу.
+    Возвращает новые значения дневных и общих счетчиков пользователей - для живых счетчиков
+    """
+    users_totals = defaultdict(int)
+    groups_totals = defaultdict(int)
+    for (user_id, group_id, type_record_id, _), count in increments.items():
+        users_totals[(user_id, type_record_id)] += count
+        groups_totals[(group_id, type_record_id)] += count
+
+    # Строки сортируем по ключу, чтобы параллельные сбросы блокировали их в одном порядке
+    # День берется из ключа: инкремент, накопленный до полуночи, попадает во вчерашнюю строку
+    daily_insert = insert(DailyGroupRecords).values([
+        {'user_id': user_id, 'group_id': group_id, 'type_record_id': type_record_id, 'count': count, 'date': day}
+        for (user_id, group_id, type_record_id, day), count in sorted(increments.items())
+    ])
+    daily = await session.execute(daily_insert.on_conflict_do_update(
+        index_elements=[DailyGroupRecords.user_id, DailyGroupRecords.group_id,
+                        DailyGroupRecords.type_record_id, DailyGroupRecords.date],
+        set_={'count': DailyGroupRecords.count + daily_insert.excluded.count}
+    ).returning(DailyGroupRecords.date, DailyGroupRecords.group_id, DailyGroupRecords.user_id,
+                DailyGroupRecords.type_record_id, DailyGroupRecords.count))
+    daily_values = [tuple(row) for row in daily]
+
+    users_insert = insert(UsersRecords).values([
+        {'user_id': user_id, 'type_record_id': type_record_id, 'summary_count': count}
+        for (user_id, type_record_id), count in sorted(users_totals.items())
+    ])
+    totals = await session.execute(users_insert.on_conflict_do_update(
+        index_elements=[UsersRecords.user_id, UsersRecords.type_record_id],
+        set_={'summary_count': UsersRecords.summary_count + users_insert.excluded.summary_count}
+    ).returning(UsersRecords.user_id, UsersRecords.type_record_id, UsersRecords.summary_count))
+    total_values = [tuple(row) for row in totals]
+
+    groups_insert = insert(GroupsRecords).values([
+        {'group_id': group_id, 'type_record_id': type_record_id, 'summary_count': count}
+        for (group_id, type_record_id), count in sorted(groups_totals.items())
+    ])
+    await session.execute(groups_insert.on_conflict_do_update(
+        index_elements=[GroupsRecords.group_id, GroupsRecords.type_record_id],
+        set_={'summary_count': GroupsRecords.summary_count + groups_insert.excluded.summary_count}
+    ))
+    return daily_values, total_values
+
+
+class WriteBehindBuffer:
+    """
+    Копит инкременты счетчиков в памяти и сбрасывает их одной транзакцией
+    каждые flush_interval секунд или при накоплении max_entries ключей.
+
+    Пока инкремент не записан, он виден через overlay(), поэтому ответы
+    пользователям показывают точные суммы. Запись в базу идет без блокировки,
+    которую ждали бы обработчики: сброс забирает накопленное и пишет его сам,
+    а согласованное чтение обеспечивает read_with_overlay(). Живые счетчики в Redis
+    получают значения после записи в базу, а не при добавлении в буфер.
+    """
+
+    def __init__(self, enabled: bool, flush_interval: float, max_entries: int):
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.pending: Dict[CounterKey, int] = {}
+        self.inflight: Dict[CounterKey, int] = {}
+        # Меняется при каждом изменении inflight: начале, частичной записи и конце сброса
+        self.epoch = 0
+        self.dropped = 0
+        # Сбросы идут по одному (фоновый цикл, снятие итогов дня, остановка), обработчики его не ждут
+        self._flush_lock = asyncio.Lock()
+        self._flushed: Optional[asyncio.Event] = None
+        self._full = asyncio.Event()
+
+    def add(self, key: CounterKey, count: int):
+        self.pending[key] = self.pending.get(key, 0) + count
+        if len(self.pending) >= self.max_entries:
+            self._full.set()
+
+    def overlay(self, key: CounterKey) -> int:
+        """Еще не записанная в базу часть счетчика"""
+        return self.pending.get(key, 0) + self.inflight.get(key, 0)
+
+    async def read_with_overlay(self, key: CounterKey, read: Callable[[], Awaitable[T]]) -> Tuple[T, int]:
+        """
+        Читает счетчик из базы вместе с незаписанной частью overlay(key).
+
+        Если во время чтения сброс записывал key или менял состав записываемого, неизвестно,
+        попала ли запись в прочитанное - тогда читаем заново, чтобы не посчитать ее дважды
+        или не потерять.
+        """
+        while True:
+            if key in self.inflight and self._flushed is not None:
+                await self._flushed.wait()
+                continue
+            epoch = self.epoch
+            value = await read()
+            if epoch == self.epoch and key not in self.inflight:
+                return value, self.overlay(key)
+
+    async def _write(self, batch: Dict[CounterKey, int]):
+        """
+        Пишет batch одной транзакцией. Если пачку отвергла база (FK, неверные данные),
+        делит ее пополам, пока не найдет плохие ключи: они отбрасываются, остальное пишется.
+        Записанные и отброшенные ключи убираются из inflight.
+        """
+        try:
+            async with async_session() as session:
+                async with session.begin():
+                    daily, totals = await write_counters(session, batch)
+        except (IntegrityError, DataError) as e:
+            if len(batch) == 1:
+                key, count = next(iter(batch.items()))
+                logger.error(f"Инкремент {count} по ключу {key} отброшен: {e.orig}")
+                self.dropped += 1
+                self._forget(batch)
+                return
+            items = list(batch.items())
+            middle = len(items) // 2
+            await self._write(dict(items[:middle]))
+            await self._write(dict(items[middle:]))
+        else:
+            self._forget(batch)
+            if live_counters.enabled:
+                live_counters.record_many(daily, totals)
+
+    def _forget(self, batch: Dict[CounterKey, int]):
+        for key in batch:
+            self.inflight.pop(key, None)
+        self.epoch += 1
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self.pending:
+                return 0
+            self.inflight, self.pending = self.pending, {}
+            self.epoch += 1
+            self._flushed = asyncio.Event()
+            flushed = len(self.inflight)
+            try:
+                await self._write(dict(self.inflight))
+            finally:
+                # Не записанное из-за недоступности базы возвращается в буфер до следующего сброса
+                for key, count in self.inflight.items():
+                    self.pending[key] = self.pending.get(key, 0) + count
+                flushed -= len(self.inflight)
+                self.inflight = {}
+                self.epoch += 1
+                self._flushed.set()
+            return flushed
+
+    async def run(self):
+        """Фоновый цикл сброса: по таймеру или по заполнению буфера"""
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Не удалось сбросить буфер счетчиков: {e}")
+
+
+write_behind = WriteBehindBuffer(enabled=settings.WRITE_BEHIND,
+                                 flush_interval=settings.WRITE_BEHIND_FLUSH_MS / 1000,
+                                 max_entries=settings.WRITE_BEHIND_MAX_ENTRIES)
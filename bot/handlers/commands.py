@@ -1,48 +1,52 @@
+from datetime import datetime
+
+import pytz
 from aiogram import Router, F
-from aiogram.filters import Command, CommandStart
+from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message, InlineKeyboardButton, InlineKeyboardMarkup
 from numpy.core.defchararray import upper
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from bot.database.session import async_session
 from bot.database.storage import (
     update_user_activity, save_user_consent, get_or_create_group, get_all_types_training_group, add_training_type,
     get_user_stats, get_users_without_training_today, get_required_count, get_or_create_user, get_group_stats,
-    get_today_records
+    get_today_records, set_group_schedule, get_id_group_training_type
 )
 from bot.handlers.possible_states import PossibleStates
+from bot.utils.outbound import outbound
 
 router = Router()
 
 @router.message(CommandStart())
-async def start_command(message: Message):
+async def start_command(message: Message, session: AsyncSession):
     """Обработчик команды /start"""
 
     user = message.from_user
     chat = message.chat
     topic_id = message.message_thread_id if message else None
 
-    async with async_session() as session:
-        await update_user_activity(
-            user_id=user.id,
-            username=user.username,
-            first_name=user.first_name,
-            last_name=user.last_name,
-            group_id=str(chat.id) if chat.type in ['group', 'supergroup', 'private'] else None,
-            group_name=chat.title if chat.type in ['group', 'supergroup', 'private'] else None,
-            topic_id=topic_id,
-        )
+    await update_user_activity(
+        session,
+        user_id=user.id,
+        username=user.username,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        group_id=str(chat.id) if chat.type in ['group', 'supergroup', 'private'] else None,
+        group_name=chat.title if chat.type in ['group', 'supergroup', 'private'] else None,
+        topic_id=topic_id,
+    )
 
-    await save_user_consent(user.id, user.username, user.first_name)
+    await save_user_consent(session, user.id, user.username, user.first_name)
 
-    await message.answer(
+    outbound.enqueue(message.answer(
         "👋 Привет! Я бот для отслеживания отжиманий!\n\n"
         "Я помогу вам:\n"
         "• Вести статистику отжиманий 📊\n"
         "• Напоминать об отжиманиях ⏰\n"
         "• Следить за прогрессом 🏆\n\n"
         "Вам достаточно просто отправить кружок или ввести команду /add для подсчета отжиманий\n\n"
-    )
+    ))
 
 @router.message(Command(commands='help'))
 async def help_command(message: Message):
@@ -59,75 +63,81 @@ async def help_command(message: Message):
     Групповые команды:
     /group_stats - Статистика группы
     /lazy - Кто еще не сделал отжимания сегодня
+    /timezone Europe/Moscow - Часовой пояс группы
+    /reminder_time 21:00 - Время напоминания
 
     Просто отправляйте кружочки в чат: ○ ⚪ ⭕ 🔵
     1 кружок = N отжиманий
     """
-    await message.answer(help_text)
+    outbound.enqueue(message.answer(help_text))
 
 @router.message(Command(commands='add_type'))
-async def add_type(message: Message, state: FSMContext):
-    await get_or_create_user(user_id=message.from_user.id,
+async def add_type(message: Message, state: FSMContext, session: AsyncSession):
+    await get_or_create_user(session,
+                             user_id=message.from_user.id,
                              username=message.from_user.username,
                              first_name=message.from_user.first_name,
                              last_name=message.from_user.last_name, )
-    await get_or_create_group(group_id=str(message.chat.id),
+    await get_or_create_group(session,
+                              group_id=str(message.chat.id),
                               group_name=message.chat.title,
                               topic_id=message.message_thread_id)
 
     await state.set_state(PossibleStates.create_training_type)
-    await message.answer(
+    outbound.enqueue(message.answer(
         '''Введите наименование тренировки, которое вы хотите отслеживать'''
-    )
+    ))
 
 @router.message(PossibleStates.create_training_type)
-async def create_training_type(message: Message, state: FSMContext):
+async def create_training_type(message: Message, state: FSMContext, session: AsyncSession):
     new_type = message.text.strip()
     group_id = str(message.chat.id)
 
     # Проверяем и добавляем новый тип
-    existing_types = await get_all_types_training_group(group_id=group_id)
+    existing_types = await get_all_types_training_group(session, group_id=group_id)
     if new_type in existing_types:
-        await message.answer("❌ Этот тип уже существует! Введите другое название:")
+        outbound.enqueue(message.answer("❌ Этот тип уже существует! Введите другое название:"))
         return
 
     await state.set_state(PossibleStates.choose_count)
     await state.set_data({
         'training_type': new_type,
     })
-    await message.answer(f"✅ Теперь введите количество:")
+    outbound.enqueue(message.answer(f"✅ Теперь введите количество:"))
 
 @router.message(PossibleStates.choose_count)
-async def choose_count(message: Message, state: FSMContext):
+async def choose_count(message: Message, state: FSMContext, session: AsyncSession):
     training_type = str(await state.get_value('training_type'))
     group_id = str(message.chat.id)
     required_count = message.text.strip()
 
     try:
         required_count = int(required_count)
-        await add_training_type(group_id=group_id, training_type=training_type, required_count=required_count)
+        await add_training_type(session, group_id=group_id, training_type=training_type, required_count=required_count)
         await state.clear()
-        await message.answer(f"✅ Тип '{training_type}' создан с количеством {required_count}!")
+        outbound.enqueue(message.answer(f"✅ Тип '{training_type}' создан с количеством {required_count}!"))
     except ValueError:
-        await message.answer("❌ Пожалуйста, введите число (например: 15, 30, 42)")
+        outbound.enqueue(message.answer("❌ Пожалуйста, введите число (например: 15, 30, 42)"))
 
 @router.message(Command(commands='stats'))
-async def stats_command(message: Message):
+async def stats_command(message: Message, session: AsyncSession):
     """Команда /stats - полная статистика (только по отжиманиям)"""
 
-    await get_or_create_user(user_id=message.from_user.id,
+    await get_or_create_user(session,
+                             user_id=message.from_user.id,
                              username=message.from_user.username,
                              first_name=message.from_user.first_name,
                              last_name=message.from_user.last_name, )
-    await get_or_create_group(group_id=str(message.chat.id),
+    await get_or_create_group(session,
+                              group_id=str(message.chat.id),
                               group_name=message.chat.title,
                               topic_id=message.message_thread_id)
 
     tg_user = message.from_user if message.from_user else None
-    pushup_stats = await get_user_stats(tg_user_id=tg_user.id, tg_group=message.chat)
+    pushup_stats = await get_user_stats(session, tg_user_id=tg_user.id, tg_group=message.chat)
 
     if not pushup_stats:
-        await message.answer("📊 Нет данных для отображения")
+        outbound.enqueue(message.answer("📊 Нет данных для отображения"))
         return
 
     response = f"📊 ПОЛНАЯ СТАТИСТИКА @{message.from_user.username}\n\n"
@@ -136,31 +146,33 @@ async def stats_command(message: Message):
         response += f"   📅 Сегодня: {value['today']}\n"
         response += f"   🏋️ Всего: {value['total']}\n\n"
 
-    await message.answer(response)
+    outbound.enqueue(message.answer(response))
 
 @router.message(Command(commands='group_stats'))
-async def stats_group_command(message: Message):
+async def stats_group_command(message: Message, session: AsyncSession):
     """Команда /group_stats - статистика текущей группы"""
     if message.chat.type not in ['group', 'supergroup']:
-        await message.answer("❌ Эта команда работает только в группах!")
+        outbound.enqueue(message.answer("❌ Эта команда работает только в группах!"))
         return
 
     tg_user = message.from_user if message.from_user else None
     tg_group = message.chat if message.chat else None
 
-    await get_or_create_user(user_id=tg_user.id,
+    await get_or_create_user(session,
+                             user_id=tg_user.id,
                              username=tg_user.username,
                              first_name=tg_user.first_name,
                              last_name=tg_user.last_name, )
-    await get_or_create_group(group_id=str(tg_group.id),
+    await get_or_create_group(session,
+                              group_id=str(tg_group.id),
                               group_name=tg_group.title,
                               topic_id=message.message_thread_id)
 
     try:
-        stats = await get_group_stats(tg_group=tg_group)
+        stats = await get_group_stats(session, tg_group=tg_group)
 
         if not stats:
-            await message.answer("📊 В группе пока нет данных об отжиманиях")
+            outbound.enqueue(message.answer("📊 В группе пока нет данных об отжиманиях"))
             return
 
         response = f"🏆 Статистика группы {message.chat.title}:\n\n"
@@ -172,10 +184,10 @@ async def stats_group_command(message: Message):
                 response += f"    • {upper(type)}:\n        Сегодня - {type_stats['today']}, всего - {type_stats['total']}\n"
             total_size_trainings = user_stats['total_size_trainings']
             response += f"\n    Общее число выполненных упражнений - {total_size_trainings}\n"
-        await message.answer(response)
+        outbound.enqueue(message.answer(response))
 
     except Exception as e:
-        await message.answer("❌ Ошибка при получении статистики")
+        outbound.enqueue(message.answer("❌ Ошибка при получении статистики"))
         print(f"Error in stats_command: {e}")
 
 # @router.message(Command(commands='change_required'))
@@ -183,39 +195,41 @@ async def stats_group_command(message: Message):
 
 
 @router.message(Command(commands=['lazy', 'remove']))
-async def choose_training_type(message: Message, state: FSMContext):
+async def choose_training_type(message: Message, state: FSMContext, session: AsyncSession):
     """Команда /lazy - показать кто не сделал отжимания сегодня"""
     if message.chat.type not in ['group', 'supergroup']:
-        await message.answer("❌ Эта команда работает только в группах!")
+        outbound.enqueue(message.answer("❌ Эта команда работает только в группах!"))
         return
 
-    await get_or_create_user(user_id=message.from_user.id,
+    await get_or_create_user(session,
+                             user_id=message.from_user.id,
                              username=message.from_user.username,
                              first_name=message.from_user.first_name,
                              last_name=message.from_user.last_name, )
-    await get_or_create_group(group_id=str(message.chat.id),
+    await get_or_create_group(session,
+                              group_id=str(message.chat.id),
                               group_name=message.chat.title,
                               topic_id=message.message_thread_id)
 
-    all_types_training_group = await get_all_types_training_group(group_id=str(message.chat.id))
+    all_types_training_group = await get_all_types_training_group(session, group_id=str(message.chat.id))
 
     if len(all_types_training_group) == 0:
-        await message.answer('❌ Отсутствуют типы упражнений')
+        outbound.enqueue(message.answer('❌ Отсутствуют типы упражнений'))
         return
 
     keyboard = []
     for type in all_types_training_group:
         keyboard.append([InlineKeyboardButton(text=type, callback_data='type_' + type)])
 
-    if message.text.lower() == 'lazy':
+    if message.text.lower() == '/lazy':
         keyboard.append([InlineKeyboardButton(text='Все', callback_data='type_all')])
 
     reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-    await message.answer(
+    outbound.enqueue(message.answer(
         "💪 Выберите тип упражнения:",
         reply_markup=reply_markup
-    )
+    ))
 
     await state.clear()
     await state.set_state(PossibleStates.choose_training_type)
@@ -223,16 +237,41 @@ async def choose_training_type(message: Message, state: FSMContext):
         'command': str(message.text)
     })
 
+async def lazy_users_reply(callback: CallbackQuery, session: AsyncSession, training_type: str):
+    """Кто еще не сделал норму сегодня: по выбранному типу или по всем ('all')"""
+    group = await get_or_create_group(session, group_id=str(callback.message.chat.id))
+
+    type_record_id = None
+    if training_type != 'all':
+        type_record_id = await get_id_group_training_type(session, group_id=group.group_id, training_type=training_type)
+        if not type_record_id:
+            outbound.enqueue(callback.message.edit_text('❌ Такого типа упражнений нет'))
+            return
+
+    lazy_users = await get_users_without_training_today(session, group=group, type_record_id=type_record_id)
+    if not lazy_users:
+        outbound.enqueue(callback.message.edit_text("✅ Сегодня все уже сделали норму! Молодцы! 🏆"))
+        return
+
+    response = "😴 Еще не сделали норму сегодня:\n\n"
+    for user in lazy_users:
+        response += (f" • @{user.username} {user.record_type.upper()} "
+                     f"(осталось сделать - {user.required - (user.count or 0)})\n")
+    response += "\nДавайте чемпионы, все получится💪"
+    outbound.enqueue(callback.message.edit_text(response))
+
+
 @router.callback_query(PossibleStates.choose_training_type)
-async def callback_choose_training_type(callback: CallbackQuery, state: FSMContext):
-    callback_data = callback.data.split('_')[1]
+async def callback_choose_training_type(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    callback_data = callback.data.split('_', 1)[1]
     command = str(await state.get_value('command'))
 
     if callback_data == '':
         return
 
     if command == '/lazy':
-        await callback.edit_message_text('Метод находится в разработке...')
+        await state.clear()
+        await lazy_users_reply(callback, session, callback_data)
     elif command == '/remove':
         keyboard = [
             [InlineKeyboardButton(text="10", callback_data="count_10"),
@@ -248,32 +287,78 @@ async def callback_choose_training_type(callback: CallbackQuery, state: FSMConte
         await state.set_data({
             'record_type': callback_data
         })
-        await callback.message.edit_text(text=f'Тип: {callback_data.upper()}\nВыберете количество, которое хотите удалить:',reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+        outbound.enqueue(callback.message.edit_text(text=f'Тип: {callback_data.upper()}\nВыберете количество, которое хотите удалить:',reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)))
     else:
         await state.clear()
         return
 
 @router.message(Command(commands='types'))
-async def types_command(message: Message, state: FSMContext):
-    await get_or_create_user(user_id=message.from_user.id,
+async def types_command(message: Message, state: FSMContext, session: AsyncSession):
+    await get_or_create_user(session,
+                             user_id=message.from_user.id,
                              username=message.from_user.username,
                              first_name=message.from_user.first_name,
                              last_name=message.from_user.last_name,)
-    await get_or_create_group(group_id=str(message.chat.id),
+    await get_or_create_group(session,
+                              group_id=str(message.chat.id),
                               group_name=message.chat.title,
                               topic_id=message.message_thread_id)
 
-    all_types = await get_all_types_training_group(group_id=str(message.chat.id))
+    all_types = await get_all_types_training_group(session, group_id=str(message.chat.id))
 
     if all_types is None or len(all_types) == 0:
-        await message.answer(f'В группе отсутствуют тренировки для отслеживания\n'
-                             f'Чтобы добавить тренировку - введите /add_type')
+        outbound.enqueue(message.answer(f'В группе отсутствуют тренировки для отслеживания\n'
+                             f'Чтобы добавить тренировку - введите /add_type'))
         return
 
     result = f"Все виды тренировок в группе {message.chat.title}:\n\n"
     for type in all_types:
         result += f" • {type}\n"
-    await message.answer(result)
+    outbound.enqueue(message.answer(result))
+
+@router.message(Command(commands='timezone'))
+async def timezone_command(message: Message, command: CommandObject, session: AsyncSession):
+    """Команда /timezone <пояс> - часовой пояс группы: в нем считаются сутки, напоминание и отчет"""
+    if message.chat.type not in ['group', 'supergroup']:
+        outbound.enqueue(message.answer("❌ Эта команда работает только в группах!"))
+        return
+
+    group = await get_or_create_group(session,
+                                      group_id=str(message.chat.id),
+                                      group_name=message.chat.title,
+                                      topic_id=message.message_thread_id)
+    if not command.args:
+        outbound.enqueue(message.answer(f"🕒 Часовой пояс группы: {group.timezone}\n"
+                                        f"Изменить: /timezone Europe/Moscow"))
+        return
+
+    timezone = command.args.strip()
+    if timezone not in pytz.all_timezones_set:
+        outbound.enqueue(message.answer("❌ Неизвестный часовой пояс. Пример: Europe/Moscow, Asia/Yekaterinburg"))
+        return
+
+    await set_group_schedule(session, group.group_id, timezone=timezone)
+    outbound.enqueue(message.answer(f"✅ Часовой пояс группы: {timezone}"))
+
+@router.message(Command(commands='reminder_time'))
+async def reminder_time_command(message: Message, command: CommandObject, session: AsyncSession):
+    """Команда /reminder_time ЧЧ:ММ - время ежедневного напоминания по часовому поясу группы"""
+    if message.chat.type not in ['group', 'supergroup']:
+        outbound.enqueue(message.answer("❌ Эта команда работает только в группах!"))
+        return
+
+    group = await get_or_create_group(session,
+                                      group_id=str(message.chat.id),
+                                      group_name=message.chat.title,
+                                      topic_id=message.message_thread_id)
+    try:
+        reminder_time = datetime.strptime((command.args or '').strip(), '%H:%M').time()
+    except ValueError:
+        outbound.enqueue(message.answer("❌ Укажите время в формате ЧЧ:ММ, например: /reminder_time 21:00"))
+        return
+
+    await set_group_schedule(session, group.group_id, reminder_time=reminder_time)
+    outbound.enqueue(message.answer(f"✅ Напоминание в {reminder_time:%H:%M} ({group.timezone})"))
 
 # @router.callback_query(PossibleStates.awaiting_remove)
 # async def handle_remove_count_callback(callback: CallbackQuery, state: FSMContext):
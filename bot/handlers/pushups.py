@@ -2,56 +2,52 @@ from aiogram import Router, F, Bot
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
+from aiogram.methods import DeleteMessage, EditMessageText, SendMessage
 
-from sqlalchemy import select
-from bot.database.models import Group
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from bot.database.session import async_session
 from bot.database.storage import add_pushups, get_all_types_training_group, get_id_group_training_type, \
     get_or_create_user, get_or_create_group
 from bot.handlers.possible_states import PossibleStates
+from bot.utils.outbound import outbound
 
 router = Router()
 
 @router.message(Command(commands='add'))
 @router.message(F.video_note)
 @router.message(F.video)
-async def handle_select_trainig_type(message: Message, state: FSMContext):
+async def handle_select_trainig_type(message: Message, state: FSMContext, session: AsyncSession):
     """Обработка видео-кружочка - спрашиваем количество с удобными кнопками"""
     if not message or not message.from_user:
         print("❌ Нет данных: update.message или from_user отсутствует")
         return
 
-    user = await get_or_create_user(user_id=message.from_user.id,
+    user = await get_or_create_user(session,
+                                    user_id=message.from_user.id,
                                     username=message.from_user.username,
                                     first_name=message.from_user.first_name,
                                     last_name=message.from_user.last_name)
-    group = await get_or_create_group(group_id=str(message.chat.id),
+    group = await get_or_create_group(session,
+                                      group_id=str(message.chat.id),
                                       group_name=message.chat.title,
                                       topic_id=message.message_thread_id)
     group_id = group.group_id
     topic_id = message.message_thread_id if message else None
 
-    async with async_session() as session:
-        result = await session.execute(
-            select(Group).where((Group.group_id == group_id) &
-                                (Group.topic_id == topic_id))
-        )
-        group = result.scalar_one_or_none()
-        if group:
-            print(f"🔍 Найдена группа {group.group_id}, проверяю topic_id={topic_id} vs {group.topic_id}")
-        else:
-            print(f"❌ Группа {group_id} не найдена в БД")
-            return
+    if group.topic_id == topic_id:
+        print(f"🔍 Найдена группа {group.group_id}, проверяю topic_id={topic_id} vs {group.topic_id}")
+    else:
+        print(f"❌ Группа {group_id} не найдена в БД")
+        return
 
     # ОЧИЩАЕМ предыдущие состояния
     await state.clear()
 
     # Удобные кнопки для разных уровней нагрузки
-    all_types_training_group = await get_all_types_training_group(group_id=group_id)
+    all_types_training_group = await get_all_types_training_group(session, group_id=group_id)
 
     if len(all_types_training_group) == 0:
-        await message.answer('''Чтобы записывать подходы к упражнениям, добавьте их типы через команду /add_type''')
+        outbound.enqueue(message.answer('''Чтобы записывать подходы к упражнениям, добавьте их типы через команду /add_type'''))
         return
 
     keyboard = []
@@ -60,10 +56,10 @@ async def handle_select_trainig_type(message: Message, state: FSMContext):
     keyboard.append([InlineKeyboardButton(text='⏭️ Пропустить', callback_data='type_cancel')])
     reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-    await message.answer(
+    outbound.enqueue(message.answer(
         "💪 Выберите тип упражнения:",
         reply_markup=reply_markup
-    )
+    ))
 
     print(f'user_id={message.from_user.id}')
 
@@ -71,12 +67,13 @@ async def handle_select_trainig_type(message: Message, state: FSMContext):
 
 @router.callback_query(PossibleStates.awaiting_type_training)
 async def handle_awaiting_type_training(callback: CallbackQuery, state: FSMContext):
-    type_training = callback.data.split('_')[1]
+    # Название типа может содержать '_'
+    type_training = callback.data.split('_', 1)[1]
     print(f'type_training: {type_training}, user_id={callback.from_user.id}')
 
     if type_training == 'cancel':
         await state.clear()
-        await callback.message.delete()
+        outbound.enqueue(callback.message.delete())
         return
 
     keyboard = [
@@ -90,21 +87,20 @@ async def handle_awaiting_type_training(callback: CallbackQuery, state: FSMConte
 
     reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-    await callback.message.edit_text(
+    outbound.enqueue(callback.message.edit_text(
         text =f'{type_training}\n\n' +
         '💪 Какое количество вы сделали в этом подходе?\n' +
         '• Выберите стандартную величину\n' +
         '• Или введите своё число\n' +
         '• ⏭️ Пропустить',
         reply_markup=reply_markup
-    )
+    ))
 
     await state.clear()
 
-    # Сохраняем информацию о кружочке
+    # Сохраняем выбранный тип и автора кружочка
     await state.set_data({
         'training_type': type_training,
-        'last_video_note': callback.message.video_note,
         'user_id': callback.message.from_user.id
     })
 
@@ -113,7 +109,7 @@ async def handle_awaiting_type_training(callback: CallbackQuery, state: FSMConte
     print(f"📹 Установлены состояния после видео: {state}")
 
 @router.callback_query(PossibleStates.awaiting_count)
-async def handle_count_callback(callback: CallbackQuery, state: FSMContext, bot: Bot):
+async def handle_count_callback(callback: CallbackQuery, state: FSMContext, bot: Bot, session: AsyncSession):
     """Обработка выбора количества через кнопки"""
     state_user_id = await state.get_value('user_id')
     training_type = await state.get_value('training_type')
@@ -123,11 +119,11 @@ async def handle_count_callback(callback: CallbackQuery, state: FSMContext, bot:
         return
 
     if state_user_id != callback.message.from_user.id:
-        await bot.send_message(
+        outbound.enqueue(SendMessage(
             chat_id=callback.message.chat.id,
             message_thread_id=callback.message.message_thread_id,
             text=f'''Пользователь @{callback.from_user.username}, вы не можете выбирать количество отжиманий за других'''
-        )
+        ).as_(bot))
         return
 
     await callback.answer()
@@ -157,18 +153,18 @@ async def handle_count_callback(callback: CallbackQuery, state: FSMContext, bot:
 
         print(f"🔔 Установлены состояния: {await state.get_data()}")
 
-        await callback.message.edit_text(
+        outbound.enqueue(callback.message.edit_text(
             "🔢 Введите точное количество отжиманий:\n\n"
             "Отправьте число сообщением\n"
             "Примеры: 15, 30, 42\n\n",
             reply_markup=reply_markup
-        )
+        ))
         return
 
     elif count_str == '0' or count_str == 'cancel':
         # Для кнопки "Пропустить" - просто удаляем сообщение
         print("🔔 Пропуск подхода - удаляем сообщение")
-        await callback.message.delete()
+        outbound.enqueue(callback.message.delete())
         await state.clear()
         return
 
@@ -176,7 +172,8 @@ async def handle_count_callback(callback: CallbackQuery, state: FSMContext, bot:
         # Для числовых кнопок обрабатываем как обычно
         count = int(count_str)
         print(f"🔔 Обрабатываем {count} отжиманий")
-        await process_pushup_count(bot=bot,
+        await process_pushup_count(session=session,
+                                   bot=bot,
                                    bot_message_id=callback.message.message_id,
                                    group_id=group_id,
                                    topic_id=callback.message.message_thread_id,
@@ -188,7 +185,7 @@ async def handle_count_callback(callback: CallbackQuery, state: FSMContext, bot:
         print("✅ Состояние очищено")
 
 @router.message(PossibleStates.awaiting_count)
-async def handle_pushup_text_input(message: Message, state: FSMContext, bot: Bot):
+async def handle_pushup_text_input(message: Message, state: FSMContext, bot: Bot, session: AsyncSession):
     """Обработка текстового ввода количества отжиманий"""
 
     """Проверка что пользователь выполнял шаги до этого"""
@@ -200,11 +197,11 @@ async def handle_pushup_text_input(message: Message, state: FSMContext, bot: Bot
         return
 
     if state_user_id != message.from_user.id:
-        await bot.send_message(
+        outbound.enqueue(SendMessage(
             chat_id=message.chat.id,
             message_thread_id=message.message_thread_id,
             text=f'''Пользователь @{message.from_user.username}, вы не можете выбирать количество отжиманий за других'''
-        )
+        ).as_(bot))
         return
 
 
@@ -231,15 +228,15 @@ async def handle_pushup_text_input(message: Message, state: FSMContext, bot: Bot
             user_msg_id = message.message_id
             bot_msg_id = await state.get_value('bot_msg_id')
 
-            await message.delete()
+            outbound.enqueue(message.delete())
             if bot_msg_id:
-                await bot.delete_message(
+                outbound.enqueue(DeleteMessage(
                     chat_id=message.chat.id,
                     message_id=bot_msg_id
-                )
+                ).as_(bot))
 
             await state.clear()
-            await message.delete()
+            outbound.enqueue(message.delete())
             print("✅ Удалено сообщение пользователя и сообщение бота, состояние очищено")
             return
 
@@ -255,28 +252,37 @@ async def handle_pushup_text_input(message: Message, state: FSMContext, bot: Bot
         group_id = str(message.chat.id)
         bot_message_id = await state.get_value('bot_msg_id')
         # ПЕРЕДАЕМ update, user_id, count, group_id
-        await process_pushup_count(bot=bot,
+        await process_pushup_count(session=session,
+                                   bot=bot,
                                    bot_message_id=bot_message_id,
                                    group_id=group_id,
                                    topic_id=message.message_thread_id,
                                    user_id=user_id,
                                    count=count,
                                    training_type=training_type)
-        await message.chat.delete_message(message.message_id)
+        outbound.enqueue(message.chat.delete_message(message.message_id))
 
         # Очищаем состояние
         await state.clear()
         print("✅ Состояние очищено")
 
     except ValueError:
-        await message.answer("❌ Пожалуйста, введите число (например: 15, 30, 42)")
+        outbound.enqueue(message.answer("❌ Пожалуйста, введите число (например: 15, 30, 42)"))
 
 
 
-async def process_pushup_count(bot: Bot, bot_message_id, group_id: str, topic_id, user_id, count, training_type):
+async def process_pushup_count(session: AsyncSession, bot: Bot, bot_message_id, group_id: str, topic_id, user_id, count, training_type):
     """Обработка введенного количества отжиманий"""
-    summary_record, today_total, actual_count = await add_pushups(user_id=user_id, group_id=group_id, type_record=training_type, count=count, topic_id=topic_id)
-    user = await get_or_create_user(user_id=user_id)
+    recorded = await add_pushups(session, user_id=user_id, group_id=group_id, type_record=training_type, count=count, topic_id=topic_id)
+    if recorded is None:
+        outbound.enqueue(EditMessageText(
+            chat_id=group_id,
+            message_id=bot_message_id,
+            text=f"❌ Тип '{training_type}' не найден в группе, подход не записан"
+        ).as_(bot))
+        return
+    summary_record, today_total, actual_count = recorded
+    user = await get_or_create_user(session, user_id=user_id)
 
     if count <= 15:
         emoji = "👶"
@@ -292,7 +298,7 @@ async def process_pushup_count(bot: Bot, bot_message_id, group_id: str, topic_id
         level = "Экспертный уровень"
 
     # ПРАВИЛЬНО определяем как отвечать
-    await bot.edit_message_text(
+    outbound.enqueue(EditMessageText(
         chat_id=group_id,
         message_id=bot_message_id,
         text=
@@ -302,14 +308,14 @@ async def process_pushup_count(bot: Bot, bot_message_id, group_id: str, topic_id
             f"📅 Сегодня: {today_total}\n"
             f"📈 За всё время: {summary_record}\n"
             f"⭐ Отличная работа! Продолжайте в том же духе! 🎯"
-    )
+    ).as_(bot))
 
 @router.message(Command(commands='/cancel'))
 async def cancel_command(message: Message, state: FSMContext):
     """Команда отмены ввода"""
     # Очищаем состояние
     await state.clear()
-    await message.answer("❌ Ввод отменен")
+    outbound.enqueue(message.answer("❌ Ввод отменен"))
 
 
 # async def handle_pushup_text_circles(message: Message, state: FSMContext):
@@ -0,0 +1,29 @@
+from aiogram.types import TelegramObject
+from aiogram import BaseMiddleware
+from typing import Callable, Dict, Any, Awaitable
+
+from bot.database.session import async_session
+from bot.utils.outbound import outbound
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Открывает одну сессию и одну транзакцию на апдейт и передает ее в data['session'].
+
+    Соединение из пула берется при первом запросе и возвращается после commit,
+    поэтому апдейт стоит одного checkout'а и одного commit'а. Ответы, поставленные
+    обработчиком в очередь исходящих, уходят только после успешного commit.
+    """
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        async with async_session() as session:
+            with outbound.hold() as replies:
+                async with session.begin():
+                    data['session'] = session
+                    result = await handler(event, data)
+            replies.release()
+            return result
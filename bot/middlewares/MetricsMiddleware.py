@@ -0,0 +1,68 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from prometheus_client import Counter, Histogram
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+UPDATES = Counter('tracker_bot_updates_total', 'Принятые апдейты по типу', ['type'])
+UPDATE_SECONDS = Histogram('tracker_bot_update_seconds', 'Полное время обработки апдейта',
+                           ['type'], buckets=LATENCY_BUCKETS)
+HANDLER_SECONDS = Histogram('tracker_bot_handler_seconds', 'Время обработчика',
+                            ['handler'], buckets=LATENCY_BUCKETS)
+HANDLER_ERRORS = Counter('tracker_bot_handler_errors_total', 'Исключения обработчиков', ['handler'])
+
+
+def update_type(update: Update) -> str:
+    """Тип апдейта для метрик: для сообщений - вид содержимого"""
+    message = update.message
+    if message is None:
+        return update.event_type
+    if message.video_note:
+        return 'video_note'
+    if message.video:
+        return 'video'
+    if message.text:
+        return 'command' if message.text.startswith('/') else 'text'
+    return 'message'
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Метрики апдейтов и обработчиков для /metrics.
+
+    Внешний middleware апдейтов считает апдейты по типу и полное время обработки,
+    внутренний на типах событий - время и ошибки конкретного обработчика.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        if isinstance(event, Update):
+            kind = update_type(event)
+            UPDATES.labels(kind).inc()
+            with UPDATE_SECONDS.labels(kind).time():
+                return await handler(event, data)
+
+        handler_object = data.get('handler')
+        name = getattr(handler_object.callback, '__name__', 'unknown') if handler_object else 'unknown'
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(name).inc()
+            raise
+        finally:
+            HANDLER_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+def setup_metrics(dp):
+    metrics = MetricsMiddleware()
+    dp.update.outer_middleware(metrics)
+    dp.message.middleware(metrics)
+    dp.callback_query.middleware(metrics)
@@ -0,0 +1,151 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Параметры ($1, %(name)s) и списки параметров IN (...) разной длины дают одну форму запроса
+_PARAMS = re.compile(r'\$\d+|%\(\w+\)s|\?')
+_PARAM_LISTS = re.compile(r'\?(?:\s*,\s*\?)+')
+_SPACES = re.compile(r'\s+')
+
+
+def statement_shape(statement: str) -> str:
+    shape = _PARAMS.sub('?', statement)
+    shape = _PARAM_LISTS.sub('?', shape)
+    return _SPACES.sub(' ', shape).strip()
+
+
+@dataclass
+class UpdateProfile:
+    """SQL одного апдейта"""
+    handler: Optional[str] = None
+    statements: int = 0
+    db_time: float = 0.0
+    checkouts: int = 0
+    shapes: Counter = field(default_factory=Counter)
+
+
+@dataclass
+class HandlerSqlStats:
+    """Накопленный SQL по обработчику"""
+    updates: int = 0
+    statements: int = 0
+    db_time: float = 0.0
+    checkouts: int = 0
+    over_budget: int = 0
+    repeated: int = 0
+
+
+_current: ContextVar[Optional[UpdateProfile]] = ContextVar('sql_profile', default=None)
+
+# Статистика по имени обработчика (None - апдейт не дошел до обработчика)
+handler_sql_stats: Dict[Optional[str], HandlerSqlStats] = {}
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    if profile is not None:
+        context._profiler_started = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    started = getattr(context, '_profiler_started', None)
+    if profile is None or started is None:
+        return
+    profile.statements += 1
+    profile.db_time += time.perf_counter() - started
+    profile.shapes[statement_shape(statement)] += 1
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    profile = _current.get()
+    if profile is not None:
+        profile.checkouts += 1
+
+
+def install_sql_profiler(engine: AsyncEngine):
+    """Подписывается на события движка. Вне апдейта (фоновые задачи) запросы не учитываются"""
+    if event.contains(engine.sync_engine, 'before_cursor_execute', _before_execute):
+        return
+    event.listen(engine.sync_engine, 'before_cursor_execute', _before_execute)
+    event.listen(engine.sync_engine, 'after_cursor_execute', _after_execute)
+    event.listen(engine.sync_engine, 'checkout', _on_checkout)
+
+
+class SqlProfilerMiddleware(BaseMiddleware):
+    """
+    Считает запросы, время в базе и checkout'ы пула на апдейт с разбивкой по обработчикам.
+
+    Регистрируется внешним middleware апдейтов раньше DbSessionMiddleware и внутренним
+    на типах событий - там он узнает имя сработавшего обработчика. Если апдейт превысил
+    SQL_QUERY_BUDGET запросов или выполнил одну форму запроса больше SQL_REPEAT_LIMIT раз
+    (похоже на N+1), пишет предупреждение.
+    """
+
+    def __init__(self, query_budget: int, repeat_limit: int):
+        self.query_budget = query_budget
+        self.repeat_limit = repeat_limit
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        if not isinstance(event, Update):
+            # Внутренний уровень: запоминаем, какой обработчик выбран
+            profile = _current.get()
+            handler_object = data.get('handler')
+            if profile is not None and handler_object is not None:
+                profile.handler = getattr(handler_object.callback, '__name__', repr(handler_object.callback))
+            return await handler(event, data)
+
+        profile = UpdateProfile()
+        token = _current.set(profile)
+        try:
+            return await handler(event, data)
+        finally:
+            _current.reset(token)
+            self._finish(event, profile)
+
+    def _finish(self, update: Update, profile: UpdateProfile):
+        stats = handler_sql_stats.setdefault(profile.handler, HandlerSqlStats())
+        stats.updates += 1
+        stats.statements += profile.statements
+        stats.db_time += profile.db_time
+        stats.checkouts += profile.checkouts
+
+        name = profile.handler or update.event_type
+        if profile.statements > self.query_budget:
+            stats.over_budget += 1
+            logger.warning(f"Апдейт {update.update_id} ({name}): {profile.statements} запросов "
+                           f"при бюджете {self.query_budget}, в базе {profile.db_time * 1000:.1f} мс, "
+                           f"checkout'ов {profile.checkouts}")
+
+        repeated = [(shape, count) for shape, count in profile.shapes.most_common() if count > self.repeat_limit]
+        if repeated:
+            stats.repeated += 1
+            for shape, count in repeated:
+                logger.warning(f"Апдейт {update.update_id} ({name}): запрос выполнен {count} раз: {shape[:300]}")
+
+
+def setup_sql_profiler(dp, engine: AsyncEngine):
+    """Подключает профилировщик к диспетчеру. Вызывать до регистрации остальных outer middleware"""
+    install_sql_profiler(engine)
+    profiler = SqlProfilerMiddleware(settings.SQL_QUERY_BUDGET, settings.SQL_REPEAT_LIMIT)
+    dp.update.outer_middleware(profiler)
+    dp.message.middleware(profiler)
+    dp.callback_query.middleware(profiler)
@@ -2,8 +2,8 @@ from aiogram.types import Update, TelegramObject
 from aiogram import BaseMiddleware
 from typing import Callable, Dict, Any, Awaitable
 
+from bot.database.cache import topic_routes, MISSING
 from bot.database.models import Group
-from bot.database.session import async_session
 from sqlalchemy import select
 
 
@@ -21,17 +21,26 @@ class TopicMiddlewares(BaseMiddleware):
         chat_id = str(event.message.chat.id)
         topic_id = getattr(event.message, 'message_thread_id', None)
         print(f"group - {chat_id}, topic_id - {topic_id}")
-        async with async_session() as session:
+        group_topic_id = topic_routes.lookup(chat_id)
+        if group_topic_id is MISSING:
+            # Чата нет в таблице - уточняем в базе и запоминаем результат
+            session = data['session']
             result = await session.execute(
-                select(Group).where(Group.group_id == chat_id)
+                select(Group.topic_id).where(Group.group_id == chat_id)
             )
-            group = result.scalar_one_or_none()
-
-        if group is None or (group.topic_id is None and topic_id is None):
+            row = result.one_or_none()
+            if row is None:
+                group_topic_id = topic_routes.NO_GROUP
+                topic_routes.set_missing(chat_id)
+            else:
+                group_topic_id = row.topic_id
+                topic_routes.set(chat_id, group_topic_id)
+
+        if group_topic_id is topic_routes.NO_GROUP or (group_topic_id is None and topic_id is None):
             return await handler(event, data)
 
-        if (group.topic_id is not None and topic_id is None) or (group.topic_id is None and topic_id is not None):
+        if (group_topic_id is not None and topic_id is None) or (group_topic_id is None and topic_id is not None):
             return
 
-        if int(topic_id) == int(group.topic_id):
-            return await handler(event, data)
\ No newline at end of file
+        if int(topic_id) == int(group_topic_id):
+            return await handler(event, data)
@@ -0,0 +1,15 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+async def run_periodically(job: Callable[[], Awaitable], interval: float, name: str):
+    """Выполняет job каждые interval секунд, ошибки логирует и не прерывает цикл"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except Exception as e:
+            logger.error(f"Фоновая задача {name} завершилась ошибкой: {e}")
@@ -0,0 +1,61 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.methods import SendMessage
+
+from bot.utils.outbound import Priority, outbound
+
+
+@dataclass
+class OutgoingMessage:
+    chat_id: str
+    text: str
+    message_thread_id: Optional[int] = None
+
+
+@dataclass
+class BroadcastStats:
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    # 429 от Telegram - признак того, что лимиты выставлены слишком высоко
+    flood_waits: int = 0
+    elapsed: float = 0.0
+    errors: Dict[str, int] = field(default_factory=dict)
+
+
+async def send_broadcast(bot: Bot, messages: List[OutgoingMessage]) -> BroadcastStats:
+    """
+    Рассылает сообщения через очередь исходящих с приоритетом рассылки.
+
+    Лимиты Telegram и повторы после RetryAfter соблюдает очередь; интерактивные ответы
+    обработчиков во время рассылки уходят раньше ее сообщений. Повторы и 429 в статистике
+    считаются по всей очереди за время рассылки.
+    """
+    stats = BroadcastStats(total=len(messages))
+    started = time.perf_counter()
+    retries, flood_waits = outbound.retries, outbound.flood_waits
+
+    results = await asyncio.gather(*(
+        outbound.enqueue(SendMessage(chat_id=message.chat_id,
+                                     text=message.text,
+                                     message_thread_id=message.message_thread_id).as_(bot),
+                         priority=Priority.BROADCAST)
+        for message in messages
+    ), return_exceptions=True)
+
+    for result in results:
+        if isinstance(result, Exception):
+            stats.failed += 1
+            name = type(result).__name__
+            stats.errors[name] = stats.errors.get(name, 0) + 1
+        else:
+            stats.sent += 1
+    stats.retries = outbound.retries - retries
+    stats.flood_waits = outbound.flood_waits - flood_waits
+    stats.elapsed = time.perf_counter() - started
+    return stats
@@ -0,0 +1,60 @@
+import json
+from collections import Counter
+from functools import partial
+
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage
+from aiogram.fsm.storage.memory import DisabledEventIsolation, MemoryStorage
+from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
+
+from bot.database.redis_client import get_redis
+from config.settings import settings
+
+# Данные состояния - несколько коротких полей, лишние пробелы и \u-экранирование ни к чему
+compact_json_dumps = partial(json.dumps, separators=(',', ':'), ensure_ascii=False)
+
+
+def create_fsm_storage() -> BaseStorage:
+    """
+    Хранилище состояний FSM: в памяти процесса (по умолчанию) или в Redis при FSM_STORAGE=redis.
+
+    В Redis незавершенные сценарии переживают перезапуск, общие для нескольких процессов бота
+    и удаляются через FSM_TTL секунд после последнего изменения.
+    """
+    if settings.FSM_STORAGE != 'redis':
+        return MemoryStorage()
+
+    redis = get_redis()
+    if redis is None:
+        raise RuntimeError("FSM_STORAGE=redis требует REDIS_HOST")
+    return RedisStorage(redis=redis,
+                        key_builder=DefaultKeyBuilder(prefix='fsm'),
+                        state_ttl=settings.FSM_TTL,
+                        data_ttl=settings.FSM_TTL,
+                        json_dumps=compact_json_dumps)
+
+
+def create_events_isolation(storage: BaseStorage) -> BaseEventIsolation:
+    """Апдейты одного пользователя в чате обрабатываются по очереди во всех процессах бота"""
+    if isinstance(storage, RedisStorage):
+        return storage.create_isolation()
+    return DisabledEventIsolation()
+
+
+async def count_fsm_states(storage: BaseStorage, limit: int = 10000) -> Counter:
+    """Число пользователей в каждом состоянии FSM (в Redis - не больше limit ключей за раз)"""
+    states = Counter()
+    if isinstance(storage, MemoryStorage):
+        for record in storage.storage.values():
+            if record.state is not None:
+                states[record.state] += 1
+    elif isinstance(storage, RedisStorage):
+        keys = []
+        async for key in storage.redis.scan_iter(match='fsm:*:state', count=500):
+            keys.append(key)
+            if len(keys) >= limit:
+                break
+        for start in range(0, len(keys), 500):
+            for state in await storage.redis.mget(keys[start:start + 500]):
+                if state is not None:
+                    states[state.decode() if isinstance(state, bytes) else state] += 1
+    return states
@@ -0,0 +1,149 @@
+"""
+Выбор лидера среди реплик бота через advisory lock Postgres.
+
+Расписание (напоминания, отчеты, обслуживание партиций) запускает только процесс,
+держащий блокировку. Блокировка сессионная и живет, пока открыто соединение лидера:
+упал процесс или оборвалась связь - Postgres снимает ее, и следующая реплика забирает
+лидерство при очередной проверке. Таблица scheduler_runs хранит последний запуск каждой
+задачи и не дает выполнить один запуск дважды, если при смене лидера задачи успеют
+сработать у двоих.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+from datetime import timedelta
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import func, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from bot.database.models import SchedulerRuns
+from bot.database.session import engine
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+HOLDER = f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _lock_key(name: str) -> int:
+    # Ключ advisory lock - bigint, выводим его из имени стабильно для всех процессов
+    return int.from_bytes(hashlib.md5(name.encode()).digest()[:8], 'big', signed=True)
+
+
+class LeaderElection:
+    """Держит advisory lock name на выделенном соединении и сообщает о получении и потере лидерства"""
+
+    def __init__(self, name: str, check_interval: float):
+        self.name = name
+        self.key = _lock_key(name)
+        self.check_interval = check_interval
+        self.is_leader = False
+        self._conn: Optional[AsyncConnection] = None
+
+    async def _try_acquire(self) -> bool:
+        conn = await engine.connect()
+        try:
+            acquired = (await conn.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': self.key})).scalar()
+            await conn.commit()
+        except Exception:
+            await conn.invalidate()
+            raise
+        if acquired:
+            self._conn = conn
+        else:
+            await conn.close()
+        return acquired
+
+    async def _still_held(self) -> bool:
+        try:
+            await self._conn.execute(text('SELECT 1'))
+            await self._conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Соединение лидера {self.name} потеряно: {e}")
+            return False
+
+    async def _release(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            await conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': self.key})
+            await conn.commit()
+            await conn.close()
+        except Exception:
+            # Соединение не возвращаем в пул: вместе с ним закроется и сессия с блокировкой
+            await conn.invalidate()
+
+    async def run(self, on_elected: Callable[[], Awaitable], on_demoted: Callable[[], Awaitable]):
+        """Цикл выборов до отмены: on_elected при получении лидерства, on_demoted при его потере"""
+        try:
+            while True:
+                if not self.is_leader:
+                    try:
+                        acquired = await self._try_acquire()
+                    except Exception as e:
+                        logger.error(f"Не удалось проверить лидерство {self.name}: {e}")
+                        acquired = False
+                    if acquired:
+                        self.is_leader = True
+                        logger.info(f"Процесс {HOLDER} стал лидером {self.name}")
+                        try:
+                            await on_elected()
+                        except Exception:
+                            # Лидер без работающего расписания хуже его отсутствия - уступаем другим
+                            logger.exception(f"Ошибка запуска лидера {self.name}")
+                            await self._demote(on_demoted)
+                elif not await self._still_held():
+                    await self._demote(on_demoted)
+                await asyncio.sleep(self.check_interval)
+        finally:
+            if self.is_leader:
+                await self._demote(on_demoted)
+
+    async def _demote(self, on_demoted: Callable[[], Awaitable]):
+        self.is_leader = False
+        try:
+            await on_demoted()
+        finally:
+            await self._release()
+        logger.info(f"Процесс {HOLDER} больше не лидер {self.name}")
+
+
+async def claim_run(job_id: str, min_gap: float) -> bool:
+    """
+    Отмечает запуск задачи job_id в scheduler_runs.
+
+    False - задачу уже запускали меньше min_gap секунд назад (на этой или другой реплике).
+    """
+    stmt = insert(SchedulerRuns).values(job_id=job_id, fired_at=func.now(), holder=HOLDER)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SchedulerRuns.job_id],
+        set_={'fired_at': stmt.excluded.fired_at, 'finished_at': None, 'holder': stmt.excluded.holder},
+        where=SchedulerRuns.fired_at < func.now() - timedelta(seconds=min_gap),
+    ).returning(SchedulerRuns.job_id)
+    async with engine.begin() as conn:
+        return (await conn.execute(stmt)).first() is not None
+
+
+async def finish_run(job_id: str):
+    async with engine.begin() as conn:
+        await conn.execute(update(SchedulerRuns)
+                           .where(SchedulerRuns.job_id == job_id, SchedulerRuns.holder == HOLDER)
+                           .values(finished_at=func.now()))
+
+
+async def run_exclusive(job_id: str, min_gap: float, job: Callable[..., Awaitable], *args):
+    """Выполняет job(*args), если этот запуск задачи job_id еще не выполнен другой репликой"""
+    if not await claim_run(job_id, min_gap):
+        logger.warning(f"Задача {job_id} уже запускалась в последние {min_gap:.0f} с, пропускаю")
+        return
+    await job(*args)
+    await finish_run(job_id)
+
+
+scheduler_leader = LeaderElection('tracker_bot:scheduler', check_interval=settings.LEADER_CHECK_INTERVAL)
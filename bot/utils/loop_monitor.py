@@ -0,0 +1,197 @@
+"""
+Мониторинг задержек цикла событий.
+
+Все чаты обслуживает один цикл событий: синхронный вызов в обработчике (print, запись
+лога в файл, echo SQL, тяжелый расчет) задерживает ответы всем. LoopMonitor:
+
+- раз в interval засыпает и меряет, насколько позже проснулся - это задержка цикла (lag).
+  Стоит одно пробуждение в interval, поэтому это основная, всегда включенная часть;
+- только с trace_callbacks (LOOP_MONITOR) - замеряет каждый колбэк цикла и
+  запоминает те, что выполнялись дольше slow_threshold, а поток-сторож, пока колбэк еще
+  выполняется дольше порога, снимает стек потока цикла - по нему видно, на какой строке
+  цикл заблокирован. Для этого на весь процесс подменяется внутренний asyncio.Handle._run:
+  каждый колбэк платит за обертку на Python и два perf_counter. Работает только с циклом
+  asyncio из CPython - uvloop и другие циклы на C вызывают колбэки в обход Handle._run,
+  для них замер колбэков не включается. Встроенный slow_callback_duration asyncio работает
+  только в debug-режиме, который сам по себе заметно замедляет цикл.
+
+Задержки и медленные колбэки идут в метрики, самые медленные колбэки со стеками - в
+периодическую сводку в логе.
+"""
+import asyncio
+import heapq
+import logging
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from prometheus_client import Counter, Histogram
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = Histogram('tracker_bot_event_loop_lag_seconds', 'Задержка пробуждения в цикле событий',
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+SLOW_CALLBACKS = Counter('tracker_bot_slow_callbacks_total', 'Колбэки цикла событий дольше порога')
+BLOCKED_SECONDS = Counter('tracker_bot_event_loop_blocked_seconds_total', 'Суммарное время медленных колбэков')
+
+
+@dataclass(order=True)
+class SlowCallback:
+    duration: float
+    callback: str = field(compare=False)
+    stack: Optional[str] = field(default=None, compare=False)
+
+
+def describe_handle(handle: asyncio.Handle) -> str:
+    """Что выполнял колбэк: для шага задачи - имя задачи и ее корутина"""
+    callback = handle._callback
+    task = getattr(callback, '__self__', None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        return f"задача {task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+    return getattr(callback, '__qualname__', repr(callback))
+
+
+def format_callback_stack(frame) -> str:
+    """Стек потока цикла без кадров самого цикла событий - от начала колбэка"""
+    stack = traceback.extract_stack(frame)
+    starts = [i for i, entry in enumerate(stack) if entry.filename == asyncio.events.__file__]
+    if starts:
+        stack = stack[starts[-1] + 1:]
+    return ''.join(traceback.format_list(stack))
+
+
+class LoopMonitor:
+    def __init__(self, interval: float, slow_threshold: float, report_interval: float, trace_callbacks: bool = False,
+                 keep: int = 5):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.trace_callbacks = trace_callbacks
+        self.report_interval = report_interval
+        self.keep = keep
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread_id: Optional[int] = None
+        self._original_run = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        # Начало текущего колбэка и снятый для него стек - их пишет цикл, читает сторож
+        self._running_since: Optional[float] = None
+        self._snapshot: Optional[str] = None
+        self._reset_window()
+
+    def _reset_window(self):
+        self.slowest: List[SlowCallback] = []
+        self.slow_count = 0
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+        self.lag_samples = 0
+
+    def _install(self) -> bool:
+        loop = asyncio.get_running_loop()
+        if not isinstance(loop, asyncio.BaseEventLoop):
+            logger.warning(f"Цикл {type(loop).__name__} не вызывает asyncio.Handle._run - "
+                           f"замер колбэков выключен, остается только задержка цикла")
+            return False
+        self._loop = loop
+        self._thread_id = threading.get_ident()
+        self._original_run = original_run = asyncio.Handle._run
+        monitor = self
+
+        def _run(handle):
+            if handle._loop is not monitor._loop:
+                return original_run(handle)
+            started = time.perf_counter()
+            monitor._running_since = started
+            monitor._snapshot = None
+            try:
+                return original_run(handle)
+            finally:
+                monitor._running_since = None
+                duration = time.perf_counter() - started
+                if duration >= monitor.slow_threshold:
+                    monitor._record_slow(handle, duration, monitor._snapshot)
+
+        # У TimerHandle свой класс, но _run наследуется от Handle
+        asyncio.Handle._run = _run
+        self._stopped.clear()
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+        return True
+
+    def _uninstall(self):
+        self._stopped.set()
+        if self._original_run is not None:
+            asyncio.Handle._run = self._original_run
+            self._original_run = None
+
+    def _watch(self):
+        # Проверяем чаще порога, чтобы успеть снять стек, пока колбэк еще выполняется
+        while not self._stopped.wait(self.slow_threshold / 2):
+            started = self._running_since
+            if started is None or self._snapshot is not None:
+                continue
+            if time.perf_counter() - started < self.slow_threshold:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            # Колбэк мог закончиться, пока мы снимали стек - тогда стек уже чужой
+            if frame is not None and self._running_since == started:
+                self._snapshot = format_callback_stack(frame)
+
+    def _record_slow(self, handle: asyncio.Handle, duration: float, stack: Optional[str]):
+        self.slow_count += 1
+        SLOW_CALLBACKS.inc()
+        BLOCKED_SECONDS.inc(duration)
+        entry = SlowCallback(duration, describe_handle(handle), stack)
+        if len(self.slowest) < self.keep:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def _record_lag(self, lag: float):
+        LOOP_LAG.observe(lag)
+        self.lag_max = max(self.lag_max, lag)
+        self.lag_total += lag
+        self.lag_samples += 1
+
+    def report(self):
+        """Пишет сводку за интервал в лог и начинает новый интервал"""
+        lag_avg = self.lag_total / self.lag_samples if self.lag_samples else 0.0
+        message = f"Цикл событий: задержка ср. {lag_avg * 1000:.1f} мс, макс. {self.lag_max * 1000:.1f} мс"
+        if self._original_run is not None:
+            message += f", колбэков дольше {self.slow_threshold * 1000:.0f} мс: {self.slow_count}"
+        if self.slow_count:
+            logger.warning(message)
+            for entry in sorted(self.slowest, reverse=True):
+                logger.warning(f"  {entry.duration * 1000:.0f} мс - {entry.callback}"
+                               + (f"\n{entry.stack}" if entry.stack else ''))
+        else:
+            logger.info(message)
+        self._reset_window()
+
+    async def run(self):
+        """Меряет задержку цикла до отмены. Запускать в том цикле, который нужно мониторить"""
+        if self.trace_callbacks:
+            self._install()
+        loop = asyncio.get_running_loop()
+        next_report = loop.time() + self.report_interval
+        try:
+            while True:
+                started = loop.time()
+                await asyncio.sleep(self.interval)
+                self._record_lag(max(loop.time() - started - self.interval, 0.0))
+                if loop.time() >= next_report:
+                    self.report()
+                    next_report = loop.time() + self.report_interval
+        finally:
+            self._uninstall()
+
+
+loop_monitor = LoopMonitor(interval=settings.LOOP_LAG_INTERVAL,
+                           slow_threshold=settings.SLOW_CALLBACK_MS / 1000,
+                           report_interval=settings.LOOP_REPORT_INTERVAL,
+                           trace_callbacks=settings.LOOP_MONITOR)
@@ -0,0 +1,94 @@
+"""
+HTTP-эндпоинт /metrics в формате Prometheus.
+
+Гистограммы апдейтов и обработчиков пишет MetricsMiddleware, время запросов к Bot API -
+очередь исходящих, время задач расписания - run_job. Счетчики очереди исходящих и пула
+соединений, которые и так ведутся в своих объектах, отдаются коллектором в момент опроса,
+состояния FSM пересчитываются при каждом опросе.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from aiogram import Dispatcher
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Gauge, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from bot.database.pool_stats import pool_stats
+from bot.utils.fsm_storage import count_fsm_states
+from bot.utils.outbound import outbound
+
+logger = logging.getLogger(__name__)
+
+FSM_STATES = Gauge('tracker_bot_fsm_states', 'Пользователей в состоянии FSM', ['state'])
+
+
+class ServiceCollector:
+    """Счетчики очереди исходящих и пула соединений на момент опроса"""
+
+    def collect(self):
+        yield CounterMetricFamily('tracker_bot_outbound_sent', 'Отправленные запросы к Bot API',
+                                  value=outbound.sent)
+        yield CounterMetricFamily('tracker_bot_outbound_failed', 'Запросы к Bot API, завершившиеся ошибкой',
+                                  value=outbound.failed)
+        yield CounterMetricFamily('tracker_bot_outbound_retries', 'Повторы запросов к Bot API',
+                                  value=outbound.retries)
+        yield CounterMetricFamily('tracker_bot_outbound_flood_waits', 'Ответы 429 (RetryAfter) от Bot API',
+                                  value=outbound.flood_waits)
+        yield CounterMetricFamily('tracker_bot_outbound_merged', 'Правки сообщений, слитые в очереди',
+                                  value=outbound.merged)
+        yield GaugeMetricFamily('tracker_bot_outbound_pending', 'Запросов в очереди исходящих',
+                                value=outbound.pending)
+
+        stats = pool_stats.snapshot()
+        for name in ('size', 'checked_out', 'checked_in', 'overflow'):
+            yield GaugeMetricFamily(f'tracker_bot_db_pool_{name}', f'Пул БД: {name}', value=stats[name])
+        yield CounterMetricFamily('tracker_bot_db_pool_checkouts', 'Выдачи соединений из пула',
+                                  value=stats['checkouts'])
+        yield CounterMetricFamily('tracker_bot_db_pool_wait_seconds', 'Суммарное ожидание соединения',
+                                  value=stats['wait_total_s'])
+        yield CounterMetricFamily('tracker_bot_db_pool_overflow_events', 'Соединения, открытые сверх pool_size',
+                                  value=stats['overflow_events'])
+        yield CounterMetricFamily('tracker_bot_db_pool_timeouts', 'Таймауты ожидания соединения',
+                                  value=stats['timeouts'])
+
+
+REGISTRY.register(ServiceCollector())
+
+
+async def refresh_fsm_states(dp: Dispatcher):
+    try:
+        states = await count_fsm_states(dp.storage)
+    except Exception as e:
+        logger.error(f"Не удалось посчитать состояния FSM: {e}")
+        return
+    # Состояния, из которых все вышли, не должны висеть со старым значением
+    FSM_STATES.clear()
+    for state, count in states.items():
+        FSM_STATES.labels(state).set(count)
+
+
+def create_metrics_app(dp: Optional[Dispatcher] = None) -> web.Application:
+    async def handle_metrics(request: web.Request) -> web.Response:
+        if dp is not None:
+            await refresh_fsm_states(dp)
+        response = web.Response(body=generate_latest())
+        response.headers['Content-Type'] = CONTENT_TYPE_LATEST
+        return response
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    return app
+
+
+async def serve_metrics(host: str, port: int, dp: Optional[Dispatcher] = None):
+    """Отдает /metrics до отмены. dp - диспетчер, чьи состояния FSM считать (у процесса расписания его нет)"""
+    runner = web.AppRunner(create_metrics_app(dp))
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host=host, port=port).start()
+        logger.info(f"Метрики доступны на {host}:{port}/metrics")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
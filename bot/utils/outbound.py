@@ -0,0 +1,307 @@
+"""
+Очередь исходящих запросов к Telegram.
+
+Обработчики не ждут Bot API: outbound.enqueue(message.answer(...)) ставит запрос в очередь
+и сразу возвращает future с результатом. Очередь отправляет запросы с соблюдением лимитов
+(общий и по чатам token bucket), интерактивные ответы раньше рассылок, повторяет запрос
+после RetryAfter и склеивает подряд идущие правки одного сообщения.
+
+Запросы, поставленные внутри hold() (DbSessionMiddleware оборачивает им каждый апдейт),
+уходят в очередь только после release() - то есть после commit транзакции апдейта: если
+commit не удался, пользователь не увидит "подход записан" про незаписанный подход.
+
+Лимит чата расходуют только новые сообщения: правки, удаления и ответы на нажатия кнопок
+идут сразу за ними без ожидания. Группам разрешен всплеск в несколько сообщений, личным
+чатам - свой, более высокий темп.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Any, Deque, Dict, Hashable, List, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import (CopyMessage, EditMessageText, ForwardMessage, SendAnimation, SendAudio, SendContact,
+                             SendDice, SendDocument, SendLocation, SendMediaGroup, SendMessage, SendPhoto, SendPoll,
+                             SendSticker, SendVenue, SendVideo, SendVideoNote, SendVoice, TelegramMethod)
+from prometheus_client import Histogram
+
+from bot.database.cache import LRUCache
+from bot.utils.rate_limit import TokenBucket
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+SEND_SECONDS = Histogram('tracker_bot_outbound_request_seconds', 'Время запроса к Bot API (без ожидания в очереди)',
+                         ['method'], buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+
+# Запросы, которые создают сообщение в чате, - на них действует лимит Telegram по чату
+MESSAGE_METHODS = (SendMessage, SendPhoto, SendVideo, SendVideoNote, SendAnimation, SendAudio, SendDocument,
+                   SendVoice, SendSticker, SendMediaGroup, SendLocation, SendVenue, SendContact, SendPoll, SendDice,
+                   CopyMessage, ForwardMessage)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BROADCAST = 1
+
+
+@dataclass
+class _Job:
+    method: TelegramMethod
+    priority: int
+    futures: List[asyncio.Future]
+    attempts: int = 0
+
+
+def chat_key(method: TelegramMethod) -> Hashable:
+    """
+    Ключ очереди и лимита чата. aiogram не приводит chat_id к числу: рассылки передают id
+    группы строкой, ответы на сообщения - числом, а это один и тот же чат
+    """
+    chat_id = getattr(method, 'chat_id', None)
+    if isinstance(chat_id, str) and chat_id.lstrip('-').isdigit():
+        return int(chat_id)
+    return chat_id
+
+
+class HeldRequests:
+    """Запросы, отложенные до release(); при выходе из блока с исключением отбрасываются"""
+
+    def __init__(self, dispatcher: 'OutboundDispatcher'):
+        self.dispatcher = dispatcher
+        self.requests: List[Tuple[TelegramMethod, Priority, asyncio.Future]] = []
+        self._token = None
+
+    def __enter__(self) -> 'HeldRequests':
+        self._token = _held.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _held.reset(self._token)
+        if exc_type is not None:
+            self.discard()
+        return False
+
+    def release(self):
+        requests, self.requests = self.requests, []
+        for method, priority, future in requests:
+            _chain(self.dispatcher.enqueue(method, priority), future)
+
+    def discard(self):
+        requests, self.requests = self.requests, []
+        if requests:
+            logger.warning(f"Транзакция апдейта не записана, ответы не отправлены: {len(requests)}")
+        for _, _, future in requests:
+            future.cancel()
+
+
+_held: ContextVar[Optional[HeldRequests]] = ContextVar('outbound_held', default=None)
+
+
+def _chain(source: asyncio.Future, target: asyncio.Future):
+    def copy(done: asyncio.Future):
+        if target.done():
+            return
+        if done.cancelled():
+            target.cancel()
+        elif done.exception() is not None:
+            target.set_exception(done.exception())
+        else:
+            target.set_result(done.result())
+    source.add_done_callback(copy)
+
+
+def _retrieve(future: asyncio.Future):
+    # Ошибка уже залогирована очередью, ждать результат вызывающий код не обязан
+    if not future.cancelled():
+        future.exception()
+
+
+class OutboundDispatcher:
+    def __init__(self, global_rate: float, chat_rate_per_minute: float, concurrency: int, max_attempts: int = 3,
+                 chat_burst: float = 1.0, private_rate: Optional[float] = None):
+        self.global_bucket = TokenBucket(rate=global_rate, capacity=global_rate)
+        self.chat_rate = chat_rate_per_minute / 60
+        self.chat_burst = chat_burst
+        self.private_rate = private_rate if private_rate is not None else self.chat_rate
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+        # Очередь запросов каждого чата: в чат уходит не больше одного запроса за раз и строго по порядку
+        self._queues: Dict[Hashable, Deque[_Job]] = {}
+        self._chat_buckets = LRUCache(max_size=100_000)
+        # Чаты с запросами, ждущие свободного отправителя: (приоритет, порядок, чат)
+        self._ready: List[Tuple[int, int, Hashable]] = []
+        self._busy: Set[Hashable] = set()
+        self._order = itertools.count()
+        self._available: Optional[asyncio.Semaphore] = None
+        self._workers: List[asyncio.Task] = []
+        self._pending = 0
+        self._idle: Optional[asyncio.Event] = None
+
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.flood_waits = 0
+        self.merged = 0
+
+    def enqueue(self, method: TelegramMethod, priority: Priority = Priority.INTERACTIVE) -> asyncio.Future:
+        """Ставит запрос в очередь. method должен быть привязан к Bot (message.answer(...), method.as_(bot))"""
+        if method.bot is None:
+            raise ValueError(f"{type(method).__name__} не привязан к Bot, используйте method.as_(bot)")
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_retrieve)
+        held = _held.get()
+        if held is not None:
+            held.requests.append((method, priority, future))
+            return future
+        self._start()
+        key = chat_key(method)
+        queue = self._queues.setdefault(key, deque())
+
+        # Новая правка того же сообщения заменяет еще не отправленную предыдущую
+        if isinstance(method, EditMessageText) and queue:
+            last = queue[-1]
+            if (isinstance(last.method, EditMessageText)
+                    and last.method.message_id == method.message_id
+                    and last.method.inline_message_id == method.inline_message_id):
+                last.method = method
+                last.priority = min(last.priority, priority)
+                last.futures.append(future)
+                self.merged += 1
+                return future
+
+        queue.append(_Job(method, priority, [future]))
+        self._pending += 1
+        self._idle.clear()
+        if len(queue) == 1 and key not in self._busy:
+            self._schedule(key)
+        return future
+
+    def hold(self) -> HeldRequests:
+        """Откладывает запросы, поставленные внутри блока, до release() (или отбрасывает при исключении)"""
+        return HeldRequests(self)
+
+    @property
+    def pending(self) -> int:
+        """Запросов в очереди и в отправке"""
+        return self._pending
+
+    def _start(self):
+        if self._workers:
+            return
+        self._available = asyncio.Semaphore(0)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    def _schedule(self, key: Hashable):
+        heapq.heappush(self._ready, (self._queues[key][0].priority, next(self._order), key))
+        self._available.release()
+
+    def _chat_bucket(self, key: Hashable) -> TokenBucket:
+        bucket = self._chat_buckets.get(key)
+        if bucket is None:
+            # id личного чата совпадает с id пользователя и положителен, у групп и каналов - отрицательный
+            private = isinstance(key, int) and key > 0
+            bucket = TokenBucket(rate=self.private_rate if private else self.chat_rate, capacity=self.chat_burst)
+            self._chat_buckets.set(key, bucket)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            await self._available.acquire()
+            _, _, key = heapq.heappop(self._ready)
+            self._busy.add(key)
+            try:
+                await self._send_next(key)
+            except Exception:
+                logger.exception("Ошибка в очереди исходящих сообщений")
+            finally:
+                self._busy.discard(key)
+                if self._queues.get(key):
+                    self._schedule(key)
+                else:
+                    self._queues.pop(key, None)
+
+    async def _send_next(self, key: Hashable):
+        queue = self._queues[key]
+        chat_bucket = None
+        if key is not None:
+            chat_bucket = self._chat_bucket(key)
+            if isinstance(queue[0].method, MESSAGE_METHODS):
+                await chat_bucket.acquire()
+            else:
+                # Правки и удаления лимит чата не расходуют, но после 429 ждут вместе со всеми
+                await chat_bucket.wait_unpaused()
+        await self.global_bucket.acquire()
+        # Запрос забираем только после ожидания лимитов, чтобы правки успели склеиться
+        job = queue.popleft()
+
+        started = time.perf_counter()
+        try:
+            result = await job.method
+        except TelegramRetryAfter as e:
+            self.flood_waits += 1
+            (chat_bucket or self.global_bucket).pause(e.retry_after)
+            self._retry_or_fail(queue, job, e)
+        except TelegramNetworkError as e:
+            self._retry_or_fail(queue, job, e)
+        except Exception as e:
+            self._finish(job, error=e)
+        else:
+            self._finish(job, result=result)
+        finally:
+            SEND_SECONDS.labels(type(job.method).__name__).observe(time.perf_counter() - started)
+
+    def _retry_or_fail(self, queue: Deque[_Job], job: _Job, error: Exception):
+        job.attempts += 1
+        if job.attempts < self.max_attempts:
+            self.retries += 1
+            queue.appendleft(job)
+        else:
+            self._finish(job, error=error)
+
+    def _finish(self, job: _Job, result: Any = None, error: Exception = None):
+        if error is None:
+            self.sent += 1
+        else:
+            self.failed += 1
+            logger.warning(f"Не удалось выполнить {type(job.method).__name__} "
+                           f"в чате {getattr(job.method, 'chat_id', None)}: {error}")
+        for future in job.futures:
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+        self._pending -= 1
+        if self._pending == 0:
+            self._idle.set()
+
+    async def close(self, timeout: float = 30.0):
+        """Дожидается отправки поставленных запросов и останавливает отправителей"""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Очередь исходящих не опустела за {timeout} с, осталось {self._pending} запросов")
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+
+outbound = OutboundDispatcher(global_rate=settings.TELEGRAM_GLOBAL_RATE,
+                              chat_rate_per_minute=settings.TELEGRAM_CHAT_RATE_PER_MINUTE,
+                              concurrency=settings.OUTBOUND_CONCURRENCY,
+                              chat_burst=settings.TELEGRAM_CHAT_BURST,
+                              private_rate=settings.TELEGRAM_PRIVATE_RATE)
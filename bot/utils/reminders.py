@@ -1,88 +1,241 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, time as dt_time
+from typing import Optional
+
 import pytz
 from aiogram import Bot
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from sqlalchemy import select
+from prometheus_client import Counter, Histogram
 
-from bot.database.models import Group
+from bot.database.live_counters import live_counters
 from bot.database.session import async_session
-from bot.database.storage import get_users_without_training_today, reset_daily_trainings, get_all_types_training_group
+from bot.database.write_behind import write_behind
+from bot.database.storage import get_users_without_training, get_all_types_training_group, \
+    maintain_daily_partitions, rollover_day, get_daily_report, get_group_timezones, get_reminder_slots, \
+    get_groups_in_slot, local_today, reconcile_live_counters
+from bot.utils.broadcast import BroadcastStats, OutgoingMessage, send_broadcast
+from bot.utils.leader import run_exclusive, scheduler_leader
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
 
 MOSCOW_TZ = pytz.timezone("Europe/Moscow")
 
+# Повтор запуска задачи раньше чем через час - дубль (задачи расписания суточные и реже)
+RUN_GUARD = 3600
 
-async def send_reminders(bot: Bot):
-    async with async_session() as session:
-        # Берём все группы
-        groups = await session.execute(select(Group))
-        groups = groups.scalars().all()
+_job_slots: Optional[asyncio.Semaphore] = None
 
+JOB_SECONDS = Histogram('tracker_bot_job_seconds', 'Время выполнения задач расписания', ['job'],
+                        buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+JOB_FAILURES = Counter('tracker_bot_job_failures_total', 'Задачи расписания, завершившиеся ошибкой', ['job'])
 
-        for group in groups:
-            report_text = "⏰ Напоминание!\nДо конца дня осталось 3 часа.\n\n"
-            report_text += "❌ Эти пользователи ещё не сделали упражнения:\n"
 
-            users_not_done = await get_users_without_training_today(group=group)
-            print(users_not_done)
-            if users_not_done:
-                # Если есть "прогульщики"
-                print(users_not_done)
-                for user in users_not_done:
-                    count = int(user.count) if user.count is not None else 0
-                    report_text += f" • @{user.username} {user.record_type.upper()} (осталось сделать - {int(user.required) - count})\n"
-            else:
-                # Все молодцы
-                report_text = "✅ Все молодцы! Сегодня все сделали отжимания 🎉"
+def hours_until_midnight(reminder_time: dt_time) -> int:
+    minutes = 24 * 60 - (reminder_time.hour * 60 + reminder_time.minute)
+    return minutes // 60
 
-            try:
-                await bot.send_message(chat_id=group.group_id, text=report_text, message_thread_id=group.topic_id)
-            except Exception as e:
-                print(f"Не удалось отправить сообщение в группу {group.group_id}: {e}")
 
+def reminder_text(users_not_done, hours_left: int = 3) -> str:
+    if not users_not_done:
+        # Все молодцы
+        return "✅ Все молодцы! Сегодня все сделали отжимания 🎉"
 
+    report_text = f"⏰ Напоминание!\nДо конца дня осталось часов: {hours_left}.\n\n"
+    report_text += "❌ Эти пользователи ещё не сделали упражнения:\n"
+    for user in users_not_done:
+        count = int(user.count) if user.count is not None else 0
+        report_text += f" • @{user.username} {user.record_type.upper()} (осталось сделать - {int(user.required) - count})\n"
+    return report_text
 
-async def send_daily_report(bot: Bot):
-    """Отправка отчета в 00:00 о тех, кто не сделал отжимания"""
-    async with async_session() as session:
-        groups = await session.execute(select(Group))
-        groups = groups.scalars().all()
 
-        for group in groups:
+def daily_report_text(users_not_done) -> str:
+    report_text = "📊 Отчет за день:\n\n"
+    report_text += "❌ Не сделали отжимания сегодня:\n"
+    for user in users_not_done:
+        report_text += f" • @{user.username} {user.record_type.upper()} Было сделано - {user.count or 0}\n"
+    return report_text
 
-            report_text = "📊 Отчет за день:\n\n"
-            report_text += "❌ Не сделали отжимания сегодня:\n"
 
+def log_broadcast(name: str, groups: int, prepared: float, stats: BroadcastStats):
+    logger.info(f"Рассылка {name}: групп {groups}, сообщений {stats.total}, отправлено {stats.sent}, "
+                f"ошибок {stats.failed}, повторов {stats.retries}, 429: {stats.flood_waits}, "
+                f"подготовка {prepared:.2f} с, отправка {stats.elapsed:.2f} с")
+    if stats.errors:
+        logger.warning(f"Ошибки рассылки {name}: {stats.errors}")
 
-            users_not_done = await get_users_without_training_today(group=group)
 
-            if users_not_done or len(users_not_done) > 0:
-                print(f'{users_not_done} {group.id} {group.group_id}')
+async def send_reminders(bot: Bot, timezone: str, reminder_time: dt_time):
+    """Напоминание группам часового пояса timezone с временем напоминания reminder_time"""
+    started = time.perf_counter()
+    await write_behind.flush()
 
-                for user in users_not_done:
-                    report_text += f" • @{user.username} {user.record_type.upper()} Было сделано - {user.count or 0}\n"
+    async with async_session() as session:
+        # Только группы своего слота, недоделанные нормы по ним сразу
+        groups = await get_groups_in_slot(session, timezone, reminder_time)
+        missing = await get_users_without_training(session, groups, day=local_today(timezone))
+
+    hours_left = hours_until_midnight(reminder_time)
+    messages = [OutgoingMessage(chat_id=group.group_id,
+                                text=reminder_text(missing[group.group_id], hours_left),
+                                message_thread_id=group.topic_id)
+                for group in groups]
+    prepared = time.perf_counter() - started
+    stats = await send_broadcast(bot, messages)
+    log_broadcast(f'напоминаний {timezone} {reminder_time:%H:%M}', len(groups), prepared, stats)
+
+
+async def wait_rollover_grace(timezone: str):
+    """
+    Ждет, пока с полуночи в поясе timezone пройдет ROLLOVER_GRACE секунд.
+
+    Подходы за вчера, принятые другими процессами бота перед полуночью, могут еще лежать
+    в их write-behind буферах или в незакоммиченных транзакциях: буфер сбрасывается раз в
+    WRITE_BEHIND_FLUSH_MS, а снимок видит только закоммиченное. Поэтому порядок такой:
+    полночь -> каждый процесс хотя бы раз сбросил буфер -> снимок. Снимок не перезаписывает
+    уже снятое, так что подходы, дошедшие до базы позже (база была недоступна дольше
+    ROLLOVER_GRACE), в отчет за вчера не попадут.
+    """
+    now = datetime.now(pytz.timezone(timezone))
+    since_midnight = (now - now.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds()
+    if since_midnight < settings.ROLLOVER_GRACE:
+        await asyncio.sleep(settings.ROLLOVER_GRACE - since_midnight)
+
+
+async def send_daily_report(bot: Bot, timezone: str):
+    """Отчет в полночь по часовому поясу timezone о тех, кто не сделал норму за прошедшие сутки"""
+    await wait_rollover_grace(timezone)
+    started = time.perf_counter()
+    # Сначала снимаем итоги вчерашнего дня всех групп пояса разом, отчет строится по снимку.
+    # Снимок идемпотентен: если процесс упадет после него, повторный запуск ничего не задвоит
+    yesterday = local_today(timezone) - timedelta(days=1)
+    await rollover_day(yesterday, timezone)
 
-                try:
-                    await bot.send_message(chat_id=group.group_id, text=report_text, message_thread_id=group.topic_id)
-                except Exception as e:
-                    print(f"Не удалось отправить сообщение в группу {group.group_id}:  {e}")
+    async with async_session() as session:
+        groups = await get_groups_in_slot(session, timezone)
+        missing = await get_daily_report(session, groups, yesterday)
+
+    messages = [OutgoingMessage(chat_id=group.group_id,
+                                text=daily_report_text(missing[group.group_id]),
+                                message_thread_id=group.topic_id)
+                for group in groups if missing[group.group_id]]
+    prepared = time.perf_counter() - started
+    stats = await send_broadcast(bot, messages)
+    log_broadcast(f'отчетов {timezone}', len(groups), prepared, stats)
+
+
+async def run_job(job_id: str, job, *args):
+    """Запуск задачи расписания: не больше SCHEDULER_CONCURRENCY одновременно и без дублей между репликами"""
+    global _job_slots
+    if _job_slots is None:
+        _job_slots = asyncio.Semaphore(settings.SCHEDULER_CONCURRENCY)
+    # Метка - функция задачи, а не job_id: слотов по поясам может быть много
+    name = job.__name__
+    async with _job_slots:
+        started = time.perf_counter()
+        try:
+            await run_exclusive(job_id, RUN_GUARD, job, *args)
+        except Exception:
+            JOB_FAILURES.labels(name).inc()
+            raise
+        finally:
+            JOB_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+async def catch_up_rollover():
+    """Снимает итоги вчерашнего дня каждого пояса, если процесс не работал в полночь (снятое пропускается)"""
+    async with async_session() as session:
+        timezones = await get_group_timezones(session)
+    for timezone in timezones:
+        await wait_rollover_grace(timezone)
+        await rollover_day(local_today(timezone) - timedelta(days=1), timezone)
 
-            await reset_daily_trainings(group)
 
+async def sync_schedule(scheduler: AsyncIOScheduler, bot: Bot):
+    """
+    Приводит задачи напоминаний и отчетов к настройкам групп.
 
-def setup_reminders(bot: Bot):
+    Задача на каждую пару (пояс, время напоминания) и на каждый пояс для отчета в полночь,
+    каждая грузит только свои группы. Jitter разносит запуски внутри слота, чтобы рассылки
+    разных слотов с одним временем не стартовали в одну секунду.
+    """
+    async with async_session() as session:
+        slots = await get_reminder_slots(session)
+        timezones = await get_group_timezones(session)
+
+    wanted = {}
+    for timezone, reminder_time in slots:
+        wanted[f'reminders:{timezone}:{reminder_time:%H:%M}'] = (
+            CronTrigger(hour=reminder_time.hour, minute=reminder_time.minute, timezone=timezone,
+                        jitter=settings.SCHEDULE_JITTER),
+            [send_reminders, bot, timezone, reminder_time])
+    for timezone in timezones:
+        wanted[f'daily_report:{timezone}'] = (
+            CronTrigger(hour=0, minute=0, timezone=timezone, jitter=settings.SCHEDULE_JITTER),
+            [send_daily_report, bot, timezone])
+
+    for job in scheduler.get_jobs():
+        if job.id.startswith(('reminders:', 'daily_report:')) and job.id not in wanted:
+            job.remove()
+    for job_id, (trigger, args) in wanted.items():
+        if scheduler.get_job(job_id) is None:
+            scheduler.add_job(run_job, trigger=trigger, args=[job_id, *args], id=job_id)
+
+
+async def setup_reminders(bot: Bot) -> AsyncIOScheduler:
     """Настройка напоминаний"""
-    scheduler = AsyncIOScheduler(timezone=MOSCOW_TZ)
+    await catch_up_rollover()
+    if live_counters.enabled:
+        try:
+            await reconcile_live_counters()
+        except Exception as e:
+            # Без сверки чтения просто идут в Postgres - лидерство из-за Redis не отдаем
+            logger.error(f"Не удалось сверить живые счетчики: {e}")
 
-    scheduler.add_job(send_reminders,
-                      trigger=CronTrigger(hour=21, minute=00),
-                      args=[bot],
-                      id='daily_reminders',
+    scheduler = AsyncIOScheduler(timezone=MOSCOW_TZ)
+    await sync_schedule(scheduler, bot)
+
+    # Группы меняют пояс и время командами - расписание сверяется с базой периодически
+    scheduler.add_job(sync_schedule,
+                      trigger='interval',
+                      seconds=settings.SCHEDULE_SYNC_INTERVAL,
+                      args=[scheduler, bot],
+                      id='schedule_sync',
                       replace_existing=True)
 
-    scheduler.add_job(send_daily_report,
-                      trigger=CronTrigger(hour=0, minute=0),
-                      args=[bot],
-                      id='daily_report',
+    if live_counters.enabled:
+        # Сверка только у лидера: пересборка на каждой реплике стирала бы ключи друг друга
+        scheduler.add_job(reconcile_live_counters,
+                          trigger='interval',
+                          seconds=settings.LIVE_COUNTERS_RECONCILE_INTERVAL,
+                          id='live_counters_reconcile',
+                          replace_existing=True)
+
+    scheduler.add_job(run_job,
+                      trigger=CronTrigger(day=1, hour=3, minute=0),
+                      args=['daily_partitions', maintain_daily_partitions],
+                      id='daily_partitions',
                       replace_existing=True)
 
-    scheduler.start()
\ No newline at end of file
+    scheduler.start()
+    return scheduler
+
+
+async def run_scheduler(bot: Bot):
+    """Держит расписание запущенным, пока процесс - лидер среди реплик (до отмены задачи)"""
+    scheduler: Optional[AsyncIOScheduler] = None
+
+    async def elected():
+        nonlocal scheduler
+        scheduler = await setup_reminders(bot)
+
+    async def demoted():
+        nonlocal scheduler
+        if scheduler is not None:
+            scheduler.shutdown(wait=False)
+            scheduler = None
+
+    await scheduler_leader.run(elected, demoted)
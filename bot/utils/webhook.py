@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import secrets
+from functools import partial
+from typing import Dict, Hashable, List, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import Update
+from aiohttp import web
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def update_order_key(update: Update) -> Optional[Hashable]:
+    """Ключ упорядочивания апдейта: чат, а для апдейтов без чата - пользователь"""
+    context = UserContextMiddleware.resolve_event_context(update)
+    if context.chat_id is not None:
+        return 'chat', context.chat_id
+    if context.user_id is not None:
+        return 'user', context.user_id
+    return None
+
+
+class UpdateProcessor:
+    """
+    Конкурентная обработка апдейтов вебхука.
+
+    Одновременно в диспетчере не больше max_in_flight апдейтов, апдейты одного чата
+    обрабатываются строго по очереди поступления. Принятых, но не обработанных апдейтов
+    не больше max_pending - дальше submit ждет, и Telegram упирается в лимит соединений.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_in_flight: int, max_pending: int):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._pending = asyncio.Semaphore(max_pending)
+        # Последний принятый апдейт каждого чата - следующий апдейт чата ждет его завершения
+        self._tails: Dict[Hashable, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, update: Update):
+        await self._pending.acquire()
+        key = update_order_key(update)
+        previous = self._tails.get(key) if key is not None else None
+
+        task = asyncio.create_task(self._run(update, previous))
+        self._tasks.add(task)
+        if key is not None:
+            self._tails[key] = task
+        task.add_done_callback(partial(self._done, key))
+
+    def _done(self, key: Optional[Hashable], task: asyncio.Task):
+        self._tasks.discard(task)
+        self._pending.release()
+        if key is not None and self._tails.get(key) is task:
+            del self._tails[key]
+
+    async def _run(self, update: Update, previous: Optional[asyncio.Task]):
+        if previous is not None:
+            # Ошибки предыдущего апдейта уже залогированы, нам нужно только его завершение
+            await asyncio.wait([previous])
+        # Слот берем после очереди чата, иначе ждущие апдейты занимали бы слоты впустую
+        async with self._in_flight:
+            await self.process(update)
+
+    async def process(self, update: Update):
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+        except Exception:
+            logger.exception(f"Ошибка обработки апдейта {update.update_id}")
+
+    async def drain(self):
+        """Дожидается обработки всех принятых апдейтов"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def create_webhook_app(processor, path: str, secret: Optional[str]) -> web.Application:
+    """
+    aiohttp-приложение, принимающее апдейты Telegram на path.
+
+    processor - UpdateProcessor или любой объект с bot и async submit(update).
+    """
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret and not secrets.compare_digest(request.headers.get(SECRET_HEADER, ''), secret):
+            return web.Response(status=401)
+        update = Update.model_validate(await request.json(), context={'bot': processor.bot})
+        await processor.submit(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    return app
+
+
+async def serve_webhook(bot: Bot, processor, allowed_updates: List[str]):
+    """Регистрирует вебхук в Telegram и передает апдейты в processor до отмены"""
+    app = create_webhook_app(processor, settings.WEBHOOK_PATH, settings.WEBHOOK_SECRET)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=settings.WEBHOOK_HOST, port=settings.WEBHOOK_PORT)
+    try:
+        await site.start()
+        await bot.set_webhook(url=settings.WEBHOOK_URL.rstrip('/') + settings.WEBHOOK_PATH,
+                              secret_token=settings.WEBHOOK_SECRET,
+                              allowed_updates=allowed_updates,
+                              drop_pending_updates=True)
+        logger.info(f"Вебхук слушает {settings.WEBHOOK_HOST}:{settings.WEBHOOK_PORT}{settings.WEBHOOK_PATH}")
+        await asyncio.Event().wait()
+    finally:
+        # Сначала перестаем принимать апдейты, потом дорабатываем принятые
+        await runner.cleanup()
+        await processor.drain()
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Режим вебхука в одном процессе"""
+    processor = UpdateProcessor(dp, bot,
+                                max_in_flight=settings.WEBHOOK_MAX_IN_FLIGHT,
+                                max_pending=settings.WEBHOOK_MAX_PENDING)
+    await dp.emit_startup(bot=bot)
+    try:
+        await serve_webhook(bot, processor, dp.resolve_used_update_types())
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
@@ -0,0 +1,135 @@
+"""
+Режим супервизора: апдейты принимает один процесс и раздает их WORKERS процессам-воркерам.
+
+Воркер выбирается консистентным хешированием по ключу упорядочивания апдейта (чат),
+поэтому все апдейты чата обрабатывает один процесс: сохраняются порядок, состояния FSM
+и локальные кэши группы. У каждого воркера свой пул соединений с базой.
+"""
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import queue
+from typing import Callable, Hashable, Iterable, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from bot.utils.webhook import UpdateProcessor, serve_webhook, update_order_key
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# spawn, а не fork: воркер не должен унаследовать соединения пула и цикл событий супервизора
+mp_context = multiprocessing.get_context('spawn')
+
+
+def _hash(value: str) -> int:
+    # hash() строк рандомизирован в каждом процессе, нужен стабильный
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Консистентное хеширование: при смене числа воркеров переезжает только ~1/N чатов"""
+
+    def __init__(self, nodes: Iterable[int], replicas: int = 512):
+        points = sorted((_hash(f'{node}:{replica}'), node) for node in nodes for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: Optional[Hashable]) -> int:
+        index = bisect.bisect(self._hashes, _hash(repr(key))) % len(self._hashes)
+        return self._nodes[index]
+
+
+async def consume_updates(updates: multiprocessing.Queue, processor: UpdateProcessor):
+    """Цикл воркера: берет апдейты из очереди супервизора до метки остановки (None)"""
+    loop = asyncio.get_running_loop()
+    while True:
+        payload = await loop.run_in_executor(None, updates.get)
+        if payload is None:
+            break
+        await processor.submit(Update.model_validate(payload, context={'bot': processor.bot}))
+    await processor.drain()
+
+
+class WorkerPool:
+    """Процессы-воркеры с очередями апдейтов. Упавший воркер перезапускается с той же очередью"""
+
+    def __init__(self, target: Callable[[int, multiprocessing.Queue], None], workers: int, queue_size: int, bot: Bot):
+        self.target = target
+        self.bot = bot
+        self.ring = HashRing(range(workers))
+        self.queues = [mp_context.Queue(queue_size) for _ in range(workers)]
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        # Очередь держит порядок апдейтов одного воркера, пока put ждет места
+        self._locks = [asyncio.Lock() for _ in range(workers)]
+        self._stopping = False
+
+    def start(self):
+        for index in range(len(self.queues)):
+            self._spawn(index)
+
+    def _spawn(self, index: int):
+        process = mp_context.Process(target=self.target, args=(index, self.queues[index]), name=f'worker-{index}')
+        process.start()
+        self.processes[index] = process
+        logger.info(f"Запущен воркер {index} (pid {process.pid})")
+
+    async def submit(self, update: Update):
+        index = self.ring.node_for(update_order_key(update))
+        payload = update.model_dump(mode='json', by_alias=True, exclude_none=True)
+        async with self._locks[index]:
+            try:
+                self.queues[index].put_nowait(payload)
+            except queue.Full:
+                await asyncio.get_running_loop().run_in_executor(None, self.queues[index].put, payload)
+
+    async def watch(self, interval: float = 1.0):
+        """Перезапускает воркеры, завершившиеся не по команде супервизора"""
+        while not self._stopping:
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive() and not self._stopping:
+                    logger.error(f"Воркер {index} завершился с кодом {process.exitcode}, перезапускаю")
+                    self._spawn(index)
+            await asyncio.sleep(interval)
+
+    async def drain(self, timeout: float = 30.0):
+        """Останавливает воркеры после обработки уже отправленных им апдейтов"""
+        if self._stopping:
+            return
+        self._stopping = True
+        loop = asyncio.get_running_loop()
+        for index, updates in enumerate(self.queues):
+            async with self._locks[index]:
+                await loop.run_in_executor(None, updates.put, None)
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.error(f"Воркер {process.name} не остановился за {timeout} с, завершаю принудительно")
+                process.terminate()
+
+
+async def run_supervisor(bot: Bot, target: Callable[[int, multiprocessing.Queue], None], allowed_updates: List[str]):
+    """Принимает апдейты (polling или webhook по BOT_MODE) и раздает их воркерам"""
+    pool = WorkerPool(target, workers=settings.WORKERS, queue_size=settings.WORKER_QUEUE_SIZE, bot=bot)
+    pool.start()
+    watcher = asyncio.create_task(pool.watch())
+    try:
+        if settings.BOT_MODE == 'webhook':
+            await serve_webhook(bot, pool, allowed_updates)
+        else:
+            dp = Dispatcher()
+
+            # Апдейт только пересылается воркеру, обработчики супервизора не вызываются
+            async def forward(handler, event: Update, data: dict):
+                await pool.submit(event)
+
+            dp.update.outer_middleware(forward)
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot, allowed_updates=allowed_updates)
+    finally:
+        watcher.cancel()
+        await pool.drain()
+        await bot.session.close()
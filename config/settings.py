@@ -12,6 +12,101 @@ class Settings:
     DB_PORT:            int = os.getenv("DB_PORT")
     DB_NAME:            str = os.getenv("DB_NAME")
     REQUIRED_PUSHUPS:   int = os.getenv("REQUIRED_PUSHUPS")
+    REDIS_HOST:         str = os.getenv("REDIS_HOST")
+    REDIS_PORT:         int = int(os.getenv("REDIS_PORT", 6379))
+    REDIS_PASSWORD:     str = os.getenv("REDIS_PASSWORD")
+
+    # Пул соединений с базой (свой у каждого процесса)
+    DB_POOL_SIZE:       int = int(os.getenv("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW:    int = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT:    float = float(os.getenv("DB_POOL_TIMEOUT", 30))
+    # Пересоздавать соединения старше (с), -1 - никогда; pre-ping проверяет соединение при выдаче из пула
+    DB_POOL_RECYCLE:    int = int(os.getenv("DB_POOL_RECYCLE", 1800))
+    DB_POOL_PRE_PING:   bool = os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+    # Кэш подготовленных запросов asyncpg на соединение (0 - выключен, нужно за pgbouncer в режиме transaction)
+    DB_STATEMENT_CACHE_SIZE: int = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+    DB_ECHO:            bool = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+    # Как часто писать статистику пула в лог (с), 0 - не писать
+    DB_POOL_STATS_INTERVAL: float = float(os.getenv("DB_POOL_STATS_INTERVAL", 300))
+
+    # Профилировщик SQL на апдейт: предупреждение, если запросов больше бюджета или одна форма запроса повторяется
+    SQL_PROFILER:       bool = os.getenv("SQL_PROFILER", "true").lower() in ("1", "true", "yes")
+    SQL_QUERY_BUDGET:   int = int(os.getenv("SQL_QUERY_BUDGET", 15))
+    SQL_REPEAT_LIMIT:   int = int(os.getenv("SQL_REPEAT_LIMIT", 3))
+
+    # Эндпоинт /metrics для Prometheus (0 - выключен); воркеры слушают METRICS_PORT + 1 + номер
+    METRICS_HOST:       str = os.getenv("METRICS_HOST", "0.0.0.0")
+    METRICS_PORT:       int = int(os.getenv("METRICS_PORT", 0))
+
+    # Монитор цикла событий: период замера задержки (с), порог медленного колбэка (мс), период сводки в логе (с).
+    # Задержка цикла меряется всегда; LOOP_MONITOR добавляет замер каждого колбэка через подмену
+    # asyncio.Handle._run - это накладные расходы на каждый колбэк и только цикл asyncio CPython
+    LOOP_MONITOR:       bool = os.getenv("LOOP_MONITOR", "false").lower() in ("1", "true", "yes")
+    LOOP_LAG_INTERVAL:  float = float(os.getenv("LOOP_LAG_INTERVAL", 0.5))
+    SLOW_CALLBACK_MS:   float = float(os.getenv("SLOW_CALLBACK_MS", 100))
+    LOOP_REPORT_INTERVAL: float = float(os.getenv("LOOP_REPORT_INTERVAL", 300))
+
+    # Режим получения апдейтов: polling или webhook
+    BOT_MODE:           str = os.getenv("BOT_MODE", "polling").lower()
+    WEBHOOK_URL:        str = os.getenv("WEBHOOK_URL")
+    WEBHOOK_PATH:       str = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_HOST:       str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT:       int = int(os.getenv("WEBHOOK_PORT", 8080))
+    WEBHOOK_SECRET:     str = os.getenv("WEBHOOK_SECRET")
+    WEBHOOK_MAX_IN_FLIGHT: int = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", 64))
+    WEBHOOK_MAX_PENDING: int = int(os.getenv("WEBHOOK_MAX_PENDING", 1000))
+
+    # Процессы-воркеры: при WORKERS > 1 апдейты раздаются воркерам по чатам
+    WORKERS:            int = int(os.getenv("WORKERS", 1))
+    WORKER_QUEUE_SIZE:  int = int(os.getenv("WORKER_QUEUE_SIZE", 1000))
+
+    # Очередь исходящих: сообщений в секунду всего, в минуту в один чат и параллельных запросов
+    TELEGRAM_GLOBAL_RATE: float = float(os.getenv("TELEGRAM_GLOBAL_RATE", 25))
+    TELEGRAM_CHAT_RATE_PER_MINUTE: float = float(os.getenv("TELEGRAM_CHAT_RATE_PER_MINUTE", 20))
+    # Лимит по чату - только на новые сообщения: всплеск до TELEGRAM_CHAT_BURST, в личные чаты - свой темп (в секунду)
+    TELEGRAM_CHAT_BURST: float = float(os.getenv("TELEGRAM_CHAT_BURST", 5))
+    TELEGRAM_PRIVATE_RATE: float = float(os.getenv("TELEGRAM_PRIVATE_RATE", 1))
+    OUTBOUND_CONCURRENCY: int = int(os.getenv("OUTBOUND_CONCURRENCY", 20))
+
+    # Хранилище состояний FSM: memory или redis; незавершенные сценарии живут FSM_TTL секунд
+    FSM_STORAGE:        str = os.getenv("FSM_STORAGE", "memory").lower()
+    FSM_TTL:            int = int(os.getenv("FSM_TTL", 3600))
+
+    # Кэши
+    TOPIC_ROUTES_SIZE:  int = int(os.getenv("TOPIC_ROUTES_SIZE", 10000))
+    # Сколько секунд помнить, что чата нет в groups (группу может создать другой процесс)
+    TOPIC_ROUTES_NEGATIVE_TTL: float = float(os.getenv("TOPIC_ROUTES_NEGATIVE_TTL", 30))
+    TRAINING_TYPES_CACHE_SIZE: int = int(os.getenv("TRAINING_TYPES_CACHE_SIZE", 10000))
+    TRAINING_TYPES_TTL: float = float(os.getenv("TRAINING_TYPES_TTL", 300))
+    IDENTITY_CACHE_SIZE: int = int(os.getenv("IDENTITY_CACHE_SIZE", 50000))
+    IDENTITY_FLUSH_INTERVAL: float = float(os.getenv("IDENTITY_FLUSH_INTERVAL", 30))
+    GROUP_TIMEZONE_TTL: float = float(os.getenv("GROUP_TIMEZONE_TTL", 60))
+
+    # Write-behind буфер счетчиков подходов
+    WRITE_BEHIND:       bool = os.getenv("WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+    WRITE_BEHIND_FLUSH_MS: int = int(os.getenv("WRITE_BEHIND_FLUSH_MS", 200))
+    WRITE_BEHIND_MAX_ENTRIES: int = int(os.getenv("WRITE_BEHIND_MAX_ENTRIES", 500))
+
+    # История дневных записей: сколько месяцев хранить (0 - не удалять) и на сколько создавать партиции вперед
+    DAILY_HISTORY_MONTHS: int = int(os.getenv("DAILY_HISTORY_MONTHS", 0))
+    DAILY_PARTITIONS_AHEAD: int = int(os.getenv("DAILY_PARTITIONS_AHEAD", 2))
+
+    # Живые счетчики и рейтинги дня в Redis (нужен REDIS_HOST)
+    LIVE_COUNTERS:      bool = os.getenv("LIVE_COUNTERS", "false").lower() in ("1", "true", "yes")
+    LIVE_COUNTERS_RECONCILE_INTERVAL: float = float(os.getenv("LIVE_COUNTERS_RECONCILE_INTERVAL", 600))
+
+    # Расписание напоминаний по часовым поясам групп: разброс запуска задач (с) и период сверки расписания
+    SCHEDULE_JITTER:    int = int(os.getenv("SCHEDULE_JITTER", 300))
+    SCHEDULE_SYNC_INTERVAL: int = int(os.getenv("SCHEDULE_SYNC_INTERVAL", 300))
+    # Снимок итогов дня не раньше чем через столько секунд после полуночи: должен быть больше
+    # WRITE_BEHIND_FLUSH_MS плюс время сброса, чтобы буферы всех процессов успели дойти до базы
+    ROLLOVER_GRACE:     float = float(os.getenv("ROLLOVER_GRACE", 5))
+    # Расписание выполняет одна реплика-лидер: как часто проверять блокировку лидера (с)
+    LEADER_CHECK_INTERVAL: float = float(os.getenv("LEADER_CHECK_INTERVAL", 5))
+    # Запускать ли расписание в процессе бота (false - расписание работает в отдельном процессе scheduler.py)
+    RUN_SCHEDULER:      bool = os.getenv("RUN_SCHEDULER", "true").lower() in ("1", "true", "yes")
+    # Сколько задач расписания выполняются одновременно
+    SCHEDULER_CONCURRENCY: int = int(os.getenv("SCHEDULER_CONCURRENCY", 2))
 
 
 settings = Settings()
\ No newline at end of file
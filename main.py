@@ -1,15 +1,31 @@
 import logging
 import asyncio
+import signal
+from typing import List
 
-from aiogram import Dispatcher, Bot
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from aiogram import Dispatcher, Bot, Router
 
 from bot.handlers import commands
 from bot.handlers import pushups
+from bot.middlewares.DbSessionMiddleware import DbSessionMiddleware
+from bot.middlewares.MetricsMiddleware import setup_metrics
+from bot.middlewares.SqlProfilerMiddleware import setup_sql_profiler
 from bot.middlewares.TopicMiddleware import TopicMiddlewares
-from bot.utils.reminders import setup_reminders
+from bot.utils.reminders import run_scheduler
 from config.settings import settings
-from bot.database.storage import init_database
+from bot.database.session import async_session, engine
+from bot.database.storage import init_database, load_topic_routes, flush_identity_updates
+from bot.database.live_counters import live_counters
+from bot.database.pool_stats import log_pool_stats
+from bot.database.redis_client import close_redis
+from bot.database.write_behind import write_behind
+from bot.utils.fsm_storage import create_fsm_storage, create_events_isolation
+from bot.utils.loop_monitor import loop_monitor
+from bot.utils.metrics import serve_metrics
+from bot.utils.outbound import outbound
+from bot.utils.webhook import UpdateProcessor, run_webhook
+from bot.utils.workers import consume_updates, run_supervisor
+from bot.utils.background import run_periodically
 # from bot.utils.reminders import setup_reminders
 
 # Настройка логирования
@@ -20,11 +36,113 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def create_dispatcher() -> Dispatcher:
+    """Собирает диспетчер с middleware и роутерами бота"""
+    storage = create_fsm_storage()
+    dp = Dispatcher(storage=storage, events_isolation=create_events_isolation(storage))
+
+    if settings.SQL_PROFILER:
+        # Снаружи сессии, чтобы учесть и ее checkout и commit
+        setup_sql_profiler(dp, engine)
+    # Время апдейта вместе с сессией БД и остальными middleware
+    setup_metrics(dp)
+    # Одна сессия БД на апдейт - должна оборачивать остальные middleware
+    dp.update.outer_middleware(DbSessionMiddleware())
+    dp.update.outer_middleware(TopicMiddlewares())
+    include_routers(dp)
+    return dp
+
+
+def include_routers(parent: Router):
+    """Подключает роутеры бота к parent"""
+    parent.include_router(commands.router)
+    parent.include_router(pushups.router)
+
+
+def used_update_types() -> List[str]:
+    """
+    Типы апдейтов, которые обрабатывают роутеры бота, - без сборки диспетчера (FSM-хранилища,
+    хуков профайлера и метрик). Роутер подключается только к одному родителю, поэтому после
+    вызова диспетчер в этом процессе уже не собрать - подходит супервизору, воркеры отдельные процессы.
+    """
+    parent = Router(name='update_types')
+    include_routers(parent)
+    return parent.resolve_used_update_types()
+
+
+async def start_services(bot: Bot, dp: Dispatcher, run_jobs: bool = True, metrics_port: int = 0):
+    """
+    Загружает кэши процесса и запускает его фоновые задачи.
+
+    run_jobs - запускать ли расписание (напоминания, сверка живых счетчиков): в режиме
+    воркеров оно нужно только в одном процессе. metrics_port - порт /metrics (0 - не отдавать).
+    """
+    async with async_session() as session:
+        await load_topic_routes(session)
+
+    background = [asyncio.create_task(
+        run_periodically(flush_identity_updates, settings.IDENTITY_FLUSH_INTERVAL, 'identity_flush')
+    )]
+    if write_behind.enabled:
+        background.append(asyncio.create_task(write_behind.run()))
+    if settings.DB_POOL_STATS_INTERVAL > 0:
+        background.append(asyncio.create_task(
+            run_periodically(log_pool_stats, settings.DB_POOL_STATS_INTERVAL, 'pool_stats')))
+    background.append(asyncio.create_task(loop_monitor.run()))
+    if metrics_port:
+        background.append(asyncio.create_task(serve_metrics(settings.METRICS_HOST, metrics_port, dp)))
+    if run_jobs and settings.RUN_SCHEDULER:
+        # Расписание напоминаний запускает только реплика-лидер
+        background.append(asyncio.create_task(run_scheduler(bot)))
+    return background
+
+
+async def stop_services(dp: Dispatcher, background):
+    """Останавливает фоновые задачи и дописывает накопленное в базу"""
+    for task in background:
+        task.cancel()
+    # Задачи дорабатывают свои finally: лидер расписания отпускает блокировку
+    await asyncio.gather(*background, return_exceptions=True)
+    await outbound.close()
+    await write_behind.flush()
+    await live_counters.drain()
+    await flush_identity_updates()
+    await dp.storage.close()
+    await dp.fsm.events_isolation.close()
+    await close_redis()
+
+
+async def serve_worker(index: int, updates):
+    """Процесс-воркер: обрабатывает апдейты своих чатов из очереди супервизора"""
+    bot = Bot(token=settings.BOT_TOKEN)
+    dp = create_dispatcher()
+    metrics_port = settings.METRICS_PORT + 1 + index if settings.METRICS_PORT else 0
+    background = await start_services(bot, dp, run_jobs=index == 0, metrics_port=metrics_port)
+    processor = UpdateProcessor(dp, bot,
+                                max_in_flight=settings.WEBHOOK_MAX_IN_FLIGHT,
+                                max_pending=settings.WEBHOOK_MAX_PENDING)
+    try:
+        await consume_updates(updates, processor)
+    finally:
+        await stop_services(dp, background)
+        await bot.session.close()
+
+
+def worker_main(index: int, updates):
+    """Точка входа процесса-воркера"""
+    # Остановкой воркеров управляет супервизор: Ctrl+C приходит всей группе процессов
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(serve_worker(index, updates))
+
+
 async def main():
     """Основная функция запуска бота"""
     if not settings.BOT_TOKEN:
         logger.error("❌ BOT_TOKEN не найден! Проверьте файл .env")
         return
+    if settings.BOT_MODE == 'webhook' and not settings.WEBHOOK_URL:
+        logger.error("❌ Для BOT_MODE=webhook нужен WEBHOOK_URL")
+        return
 
     logger.info("✅ Токен найден, инициализируем базу данных...")
 
@@ -32,25 +150,26 @@ async def main():
     await init_database()
 
     bot = Bot(token=settings.BOT_TOKEN)
-    dp = Dispatcher()
-    scheduler = AsyncIOScheduler()
-    timezone = "Europe/Moscow"
-    dp.update.middleware()
-
-    dp.update.outer_middleware(TopicMiddlewares())
-    dp.include_router(commands.router)
-    dp.include_router(pushups.router)
+    if settings.WORKERS > 1:
+        logger.info(f"🤖 Бот запускается с {settings.WORKERS} воркерами...")
+        allowed_updates = used_update_types()
+        # Супервизор в базу больше не ходит, пулы соединений у воркеров свои
+        await engine.dispose()
+        await run_supervisor(bot, worker_main, allowed_updates)
+        return
 
-    # Настраиваем напоминания
-    setup_reminders(bot)
+    dp = create_dispatcher()
+    background = await start_services(bot, dp, metrics_port=settings.METRICS_PORT)
     # Запускаем бота
     logger.info("🤖 Бот запускается...")
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
-
-    logger.info("✅ Бот запущен и работает!")
-    logger.info("⏰ Напоминания настроены: 22:00 и 00:00")
-    logger.info("🔍 Режим отладки включен")
+    try:
+        if settings.BOT_MODE == 'webhook':
+            await run_webhook(dp, bot)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+    finally:
+        await stop_services(dp, background)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,61 @@
+"""
+Отдельный процесс расписания: напоминания, отчеты в полночь, обслуживание партиций.
+
+Рассылки идут из своего цикла событий, со своим пулом соединений и своей очередью
+исходящих, поэтому не отнимают время у обработки апдейтов. Процессу бота в этом случае
+нужен RUN_SCHEDULER=false, а этому - свои DB_POOL_SIZE, OUTBOUND_CONCURRENCY и
+TELEGRAM_GLOBAL_RATE (общий лимит Telegram делится между процессами).
+
+    python -m scheduler
+"""
+import asyncio
+import logging
+
+from aiogram import Bot
+
+from bot.database.pool_stats import log_pool_stats
+from bot.database.redis_client import close_redis
+from bot.database.session import engine
+from bot.utils.background import run_periodically
+from bot.utils.loop_monitor import loop_monitor
+from bot.utils.metrics import serve_metrics
+from bot.utils.outbound import outbound
+from bot.utils.reminders import run_scheduler
+from config.settings import settings
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    if not settings.BOT_TOKEN:
+        logger.error("❌ BOT_TOKEN не найден! Проверьте файл .env")
+        return
+
+    bot = Bot(token=settings.BOT_TOKEN)
+    background = []
+    if settings.DB_POOL_STATS_INTERVAL > 0:
+        background.append(asyncio.create_task(
+            run_periodically(log_pool_stats, settings.DB_POOL_STATS_INTERVAL, 'pool_stats')))
+    background.append(asyncio.create_task(loop_monitor.run()))
+    if settings.METRICS_PORT:
+        background.append(asyncio.create_task(serve_metrics(settings.METRICS_HOST, settings.METRICS_PORT)))
+
+    logger.info("⏰ Процесс расписания запущен")
+    try:
+        # Схему создает процесс бота; пока ее нет, запуск расписания не удается и повторяется
+        await run_scheduler(bot)
+    finally:
+        for task in background:
+            task.cancel()
+        await outbound.close()
+        await close_redis()
+        await bot.session.close()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
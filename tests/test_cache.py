@@ -0,0 +1,19 @@
+import time
+
+from bot.database.cache import MISSING, TopicRoutes
+
+
+def test_topic_routes_forget_missing_groups_after_ttl():
+    routes = TopicRoutes(max_size=10, negative_ttl=0.05)
+    routes.load([('-1', None), ('-2', 7)])
+    routes.set_missing('-3')
+
+    assert routes.lookup('-2') == 7
+    assert routes.lookup('-3') is TopicRoutes.NO_GROUP
+    # Чат, который не загружался, - не "нет группы", а повод сходить в базу
+    assert routes.lookup('-4') is MISSING
+
+    time.sleep(0.06)
+    # Группу мог создать другой процесс - после TTL снова спрашиваем базу
+    assert routes.lookup('-3') is MISSING
+    assert routes.lookup('-1') is None
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from config.settings import settings
+
+if not settings.DB_HOST:
+    pytest.skip('нет настроек PostgreSQL', allow_module_level=True)
+
+from bot.database.models import Base
+from bot.database.partitions import ensure_daily_partitions
+from bot.database.session import DATABASE_URL
+from bot.database.storage import collapse_duplicates
+
+SCHEMA = 'test_ensure_indexes'
+
+# База до уникальных индексов: повторное членство, два одинаковых типа и повторяющиеся счетчики
+SEED = [
+    "INSERT INTO users (user_id, username) VALUES (1, 'a'), (2, 'b')",
+    "INSERT INTO groups (group_id, group_name) VALUES ('-1', 'g')",
+    "INSERT INTO user_groups VALUES (1, 1), (1, 1), (2, 1)",
+    "INSERT INTO record_types (id, group_id, record_type, required) "
+    "VALUES (10, '-1', 'pushups', 50), (11, '-1', 'pushups', 60), (12, '-1', 'squats', 20)",
+    "INSERT INTO daily_group_records (user_id, group_id, type_record_id, count, date) "
+    "VALUES (1, '-1', 10, 5, '2026-10-18'), (1, '-1', 11, 7, '2026-10-18'), (2, '-1', 11, 3, '2026-10-18')",
+    "INSERT INTO daily_reports (group_id, user_id, type_record_id, date, count, required) "
+    "VALUES ('-1', 1, 10, '2026-10-17', 5, 50), ('-1', 1, 11, '2026-10-17', 6, 60)",
+    "INSERT INTO users_records (user_id, type_record_id, summary_count) "
+    "VALUES (1, 10, 100), (1, 11, 50), (1, 12, 1), (1, 12, 2)",
+    "INSERT INTO groups_records (group_id, type_record_id, summary_count) "
+    "VALUES ('-1', 10, 105), ('-1', 11, 53), ('-1', 12, 3), ('-1', 12, 0)",
+]
+
+
+async def collapse_seeded_duplicates():
+    engine = create_async_engine(DATABASE_URL)
+    try:
+        try:
+            async with engine.connect():
+                pass
+        except OSError as e:
+            pytest.skip(f'PostgreSQL недоступен: {e}')
+
+        async with engine.connect() as conn:
+            await conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+            await conn.execute(text(f'CREATE SCHEMA {SCHEMA}'))
+            await conn.execute(text(f'SET search_path TO {SCHEMA}'))
+            try:
+                await conn.run_sync(Base.metadata.create_all)
+                await ensure_daily_partitions(conn)
+                # Индекс дневных записей создается вместе с партиционированной таблицей, остальных раньше не было
+                for table in Base.metadata.sorted_tables:
+                    for index in table.indexes:
+                        if index.unique and table.name != 'daily_group_records':
+                            await conn.execute(text(f'DROP INDEX {index.name}'))
+                for statement in SEED:
+                    await conn.execute(text(statement))
+
+                for table in Base.metadata.sorted_tables:
+                    for index in table.indexes:
+                        if index.unique and table.name != 'daily_group_records':
+                            await collapse_duplicates(conn, table, [column.name for column in index.columns])
+                            await conn.run_sync(index.create)
+
+                rows = {}
+                for query in ['SELECT id, required FROM record_types',
+                              'SELECT group_id, user_id FROM user_groups',
+                              'SELECT user_id, type_record_id, count FROM daily_group_records',
+                              'SELECT user_id, type_record_id, count, required FROM daily_reports',
+                              'SELECT user_id, type_record_id, summary_count FROM users_records',
+                              'SELECT group_id, type_record_id, summary_count FROM groups_records']:
+                    rows[query.split()[-1]] = sorted(tuple(row) for row in await conn.execute(text(query)))
+                return rows
+            finally:
+                await conn.rollback()
+                await conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+                await conn.commit()
+    finally:
+        await engine.dispose()
+
+
+def test_duplicates_are_merged_before_unique_indexes():
+    rows = asyncio.run(collapse_seeded_duplicates())
+
+    # Второй pushups сливается в тип с меньшим id, его записи складываются с записями этого типа
+    assert rows['record_types'] == [(10, 50), (12, 20)]
+    assert rows['user_groups'] == [(1, 1), (1, 2)]
+    assert rows['daily_group_records'] == [(1, 10, 12), (2, 10, 3)]
+    assert rows['daily_reports'] == [(1, 10, 11, 60)]
+    assert rows['users_records'] == [(1, 10, 150), (1, 12, 3)]
+    assert rows['groups_records'] == [('-1', 10, 158), ('-1', 12, 3)]
@@ -0,0 +1,164 @@
+import asyncio
+from datetime import date
+from types import SimpleNamespace
+
+import fakeredis
+from fakeredis.aioredis import FakeRedis
+from redis.exceptions import ConnectionError
+
+from bot.database.live_counters import READY_KEY, RECONCILE_LOCK, LiveCounters, total_key
+
+DAY = date(2026, 10, 18)
+GROUP = '-100'
+
+
+class FakeStream:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def partitions(self, size):
+        for start in range(0, len(self.rows), size):
+            yield self.rows[start:start + size]
+
+
+class FakeSession:
+    """Отдает строки счетчиков вместо Postgres: по имени таблицы первого столбца запроса"""
+
+    def __init__(self, daily, totals, during_read=None):
+        self.tables = {'daily_group_records': daily, 'users_records': totals}
+        # Что происходит в других процессах, пока сверка читает базу
+        self.during_read = during_read
+
+    async def stream(self, query):
+        if self.during_read is not None:
+            await self.during_read()
+        return FakeStream(self.tables[query.selected_columns[0].table.name])
+
+
+class BrokenPipelineRedis:
+    """Redis, в котором пайплайны падают, а одиночные команды проходят"""
+
+    def __init__(self, redis):
+        self._redis = redis
+
+    def pipeline(self, *args, **kwargs):
+        raise ConnectionError('connection reset')
+
+    def __getattr__(self, name):
+        return getattr(self._redis, name)
+
+
+def daily_row(user_id, type_id, count, day=DAY):
+    return SimpleNamespace(date=day, group_id=GROUP, user_id=user_id, type_record_id=type_id, count=count)
+
+
+def total_row(user_id, type_id, count):
+    return SimpleNamespace(user_id=user_id, type_record_id=type_id, summary_count=count)
+
+
+def shared_redis():
+    server = fakeredis.FakeServer()
+    return lambda: FakeRedis(server=server, decode_responses=True)
+
+
+def test_record_then_read():
+    async def scenario():
+        counters = LiveCounters(FakeRedis(decode_responses=True), enabled=True)
+        await counters.redis.set(READY_KEY, DAY.isoformat())
+        counters.record(DAY, GROUP, user_id=1, type_record_id=7, daily=10, total=100)
+        counters.record(DAY, GROUP, user_id=1, type_record_id=7, daily=25, total=115)
+        await counters.drain()
+        # Запоздавшее значение более раннего подхода не уменьшает счетчик
+        counters.record(DAY, GROUP, user_id=1, type_record_id=7, daily=10, total=100)
+        await counters.drain()
+        return await counters.read(DAY, GROUP, [1, 2], [7])
+
+    assert asyncio.run(scenario()) == {(1, 7): (25, 115), (2, 7): (None, 0)}
+
+
+def test_read_without_ready_mark_falls_back():
+    async def scenario():
+        counters = LiveCounters(FakeRedis(decode_responses=True), enabled=True)
+        counters.record(DAY, GROUP, user_id=1, type_record_id=7, daily=10, total=10)
+        await counters.drain()
+        return await counters.read(DAY, GROUP, [1], [7])
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_failed_record_invalidates_all_replicas():
+    async def scenario():
+        connect = shared_redis()
+        replica_a = LiveCounters(BrokenPipelineRedis(connect()), enabled=True)
+        replica_b = LiveCounters(connect(), enabled=True)
+        await replica_b.redis.set(READY_KEY, DAY.isoformat())
+
+        replica_a.record(DAY, GROUP, user_id=1, type_record_id=7, daily=10, total=10)
+        await replica_a.drain()
+        return await replica_b.redis.exists(READY_KEY), await replica_b.read(DAY, GROUP, [1], [7])
+
+    ready, counts = asyncio.run(scenario())
+    assert not ready
+    assert counts is None
+
+
+def test_reconcile_keeps_values_written_during_it():
+    async def scenario():
+        connect = shared_redis()
+        counters = LiveCounters(connect(), enabled=True)
+        other_process = LiveCounters(connect(), enabled=True)
+
+        async def concurrent_set():
+            # Подход в другом процессе закоммичен уже после того, как сверка прочитала строку
+            other_process.record(DAY, GROUP, user_id=1, type_record_id=7, daily=40, total=310)
+            await other_process.drain()
+
+        session = FakeSession(daily=[daily_row(1, 7, 30), daily_row(2, 7, 5)],
+                              totals=[total_row(1, 7, 300), total_row(2, 7, 5)],
+                              during_read=concurrent_set)
+        reconciled = await counters.reconcile(session, days=[DAY])
+        counts = await counters.read(DAY, GROUP, [1, 2], [7])
+        return reconciled, counts, await counters.redis.exists(RECONCILE_LOCK)
+
+    reconciled, counts, locked = asyncio.run(scenario())
+    assert reconciled
+    assert counts == {(1, 7): (40, 310), (2, 7): (5, 5)}
+    assert not locked
+
+
+def test_failed_record_during_reconcile_keeps_counters_unready():
+    async def scenario():
+        connect = shared_redis()
+        counters = LiveCounters(connect(), enabled=True)
+        broken = LiveCounters(BrokenPipelineRedis(connect()), enabled=True)
+
+        async def lost_set():
+            broken.record(DAY, GROUP, user_id=1, type_record_id=7, daily=40, total=310)
+            await broken.drain()
+
+        session = FakeSession(daily=[daily_row(1, 7, 30)], totals=[total_row(1, 7, 300)], during_read=lost_set)
+        reconciled = await counters.reconcile(session, days=[DAY])
+        return reconciled, await counters.read(DAY, GROUP, [1], [7])
+
+    reconciled, counts = asyncio.run(scenario())
+    assert reconciled
+    # Значение 40 до Redis не дошло - верить счетчикам до следующей сверки нельзя
+    assert counts is None
+
+
+def test_reconcile_skips_while_another_process_holds_the_lock():
+    async def scenario():
+        connect = shared_redis()
+        counters = LiveCounters(connect(), enabled=True)
+        await counters.redis.set(READY_KEY, DAY.isoformat())
+        await counters.redis.zadd(total_key(1), {7: 300})
+        await connect().set(RECONCILE_LOCK, 'other-process', nx=True, ex=60)
+
+        reconciled = await counters.reconcile(FakeSession(daily=[], totals=[total_row(1, 7, 500)]), days=[DAY])
+        return reconciled, await counters.redis.exists(READY_KEY), await counters.redis.zscore(total_key(1), 7)
+
+    reconciled, ready, total = asyncio.run(scenario())
+    assert not reconciled
+    # Чужую сверку не трогаем: ни отметку, ни ключи
+    assert ready
+    assert total == 300
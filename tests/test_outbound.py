@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+from aiogram.methods import DeleteMessage, EditMessageText, SendMessage
+
+from benchmarks.fakes import create_fake_bot
+from bot.utils.outbound import OutboundDispatcher
+
+GROUP = -100123
+PRIVATE = 555
+
+
+def make_outbound(**kwargs) -> OutboundDispatcher:
+    options = dict(global_rate=1000, chat_rate_per_minute=20, concurrency=4, chat_burst=1, private_rate=1)
+    options.update(kwargs)
+    return OutboundDispatcher(**options)
+
+
+async def timed(future) -> float:
+    await future
+    return time.perf_counter()
+
+
+def test_edit_and_delete_after_send_are_not_delayed():
+    async def scenario():
+        bot = create_fake_bot()
+        outbound = make_outbound()
+        started = time.perf_counter()
+        sent = outbound.enqueue(SendMessage(chat_id=GROUP, text='💪').as_(bot))
+        edited = outbound.enqueue(EditMessageText(chat_id=GROUP, message_id=1, text='10').as_(bot))
+        deleted = outbound.enqueue(DeleteMessage(chat_id=GROUP, message_id=1).as_(bot))
+        finished = await asyncio.gather(timed(sent), timed(edited), timed(deleted))
+        await outbound.close()
+        return [moment - started for moment in finished]
+
+    # Без разделения правка и удаление ждали бы по 3 с лимита 20 сообщений в минуту
+    assert max(asyncio.run(scenario())) < 0.5
+
+
+def test_group_sends_burst_then_follow_chat_rate():
+    async def scenario():
+        bot = create_fake_bot()
+        outbound = make_outbound(chat_rate_per_minute=600, chat_burst=3)
+        started = time.perf_counter()
+        futures = [outbound.enqueue(SendMessage(chat_id=GROUP, text=str(index)).as_(bot)) for index in range(4)]
+        finished = await asyncio.gather(*(timed(future) for future in futures))
+        await outbound.close()
+        return [moment - started for moment in finished]
+
+    delays = asyncio.run(scenario())
+    # Три сообщения всплеском, четвертое - через 1/10 с при 600 в минуту
+    assert max(delays[:3]) < 0.05
+    assert delays[3] >= 0.08
+
+
+def test_private_chats_use_their_own_rate():
+    async def scenario():
+        bot = create_fake_bot()
+        outbound = make_outbound(chat_rate_per_minute=1, private_rate=20)
+        started = time.perf_counter()
+        futures = [outbound.enqueue(SendMessage(chat_id=PRIVATE, text=str(index)).as_(bot)) for index in range(3)]
+        finished = await asyncio.gather(*(timed(future) for future in futures))
+        await outbound.close()
+        return finished[-1] - started
+
+    # При групповом лимите 1 в минуту три сообщения заняли бы две минуты
+    assert asyncio.run(scenario()) < 0.3
+
+
+def test_string_and_int_chat_ids_share_one_queue():
+    async def scenario():
+        bot = create_fake_bot()
+        outbound = make_outbound(chat_rate_per_minute=60, chat_burst=1)
+        started = time.perf_counter()
+        first = outbound.enqueue(SendMessage(chat_id=str(GROUP), text='рассылка').as_(bot))
+        second = outbound.enqueue(SendMessage(chat_id=GROUP, text='ответ').as_(bot))
+        edit = outbound.enqueue(EditMessageText(chat_id=str(GROUP), message_id=1, text='1').as_(bot))
+        merged = outbound.enqueue(EditMessageText(chat_id=GROUP, message_id=1, text='2').as_(bot))
+        queues = len(outbound._queues)
+        finished = await asyncio.gather(timed(first), timed(second), timed(edit), timed(merged))
+        await outbound.close()
+        return queues, outbound.merged, [moment - started for moment in finished]
+
+    queues, merged, delays = asyncio.run(scenario())
+    assert queues == 1
+    assert merged == 1
+    # Одно ведро на чат: второе сообщение ждет секунду лимита 60 в минуту, а не уходит сразу
+    assert delays[1] >= 0.9
+    assert delays[0] < delays[1] <= delays[2]
+
+
+def test_held_requests_wait_for_release_and_drop_on_error():
+    async def scenario():
+        bot = create_fake_bot()
+        outbound = make_outbound()
+        with outbound.hold() as held:
+            saved = outbound.enqueue(SendMessage(chat_id=GROUP, text='✅ записано').as_(bot))
+        await asyncio.sleep(0.05)
+        before_release = saved.done()
+        held.release()
+        await saved
+
+        lost = None
+        try:
+            with outbound.hold():
+                lost = outbound.enqueue(SendMessage(chat_id=GROUP, text='✅ не записано').as_(bot))
+                raise RuntimeError('commit не удался')
+        except RuntimeError:
+            pass
+        await outbound.close()
+        return before_release, len(bot.session.requests), lost.cancelled()
+
+    before_release, requests, lost_cancelled = asyncio.run(scenario())
+    assert not before_release
+    assert requests == 1
+    assert lost_cancelled
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from config.settings import settings
+
+if not settings.DB_HOST:
+    pytest.skip('нет настроек PostgreSQL', allow_module_level=True)
+
+from benchmarks.query_plans import bench_schema, explain_hot_queries
+from bot.database.session import DATABASE_URL
+
+GROUPS = 20
+
+
+async def hot_query_seq_scans():
+    engine = create_async_engine(DATABASE_URL)
+    try:
+        try:
+            async with engine.connect():
+                pass
+        except OSError as e:
+            pytest.skip(f'PostgreSQL недоступен: {e}')
+
+        async with engine.connect() as conn:
+            async with bench_schema(conn, users=2000, groups=GROUPS, types=2):
+                # На маленьких таблицах Seq Scan дешевле любого индекса - запрещаем его,
+                # чтобы в плане он остался только там, где подходящего индекса нет
+                await conn.execute(text('SET enable_seqscan = off'))
+                plans = await explain_hot_queries(conn, GROUPS)
+                await conn.execute(text('RESET enable_seqscan'))
+                return {name: scans for name, _, scans in plans if scans}
+    finally:
+        await engine.dispose()
+
+
+def test_hot_queries_use_indexes():
+    assert asyncio.run(hot_query_seq_scans()) == {}